@@ -0,0 +1,27 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""Load and benchmark suite of the api.
+
+    python -m benchmarks run --samples 10000 --output results.json
+    python -m benchmarks compare old.json new.json
+
+The run command fills the configured database with a synthetic dataset (see
+generate.py) and times the request mix of the typical clients (see
+workloads.py), either through the flask test client or against a running
+server given by --url. The database and blob store are taken from the KOI_*
+environment like for the server, by default a temporary sqlite file is used.
+The results are written as json, so runs of different releases can be compared.
+"""
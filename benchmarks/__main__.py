@@ -0,0 +1,185 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""Command line of the benchmark suite, see benchmarks/__init__.py."""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+DEFAULT_WORKLOADS = "ingest=200,download=500,snapshot=3,labeling=200,merge=3"
+
+
+def parse_workloads(value):
+    """parse name=operations,... into an ordered dict"""
+    from benchmarks.workloads import WORKLOADS
+
+    workloads = {}
+    for item in value.split(","):
+        name, _, operations = item.partition("=")
+        if name not in WORKLOADS:
+            raise argparse.ArgumentTypeError("unknown workload: " + name)
+        try:
+            workloads[name] = int(operations or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError("illegal number of operations: " + item)
+    return workloads
+
+
+def release():
+    """version of the package and commit of the checkout, if any"""
+    try:
+        from importlib.metadata import version
+
+        package = version("koi-api")
+    except Exception:
+        package = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"version": package, "commit": commit}
+
+
+def run(args):
+    if "KOI_SQLALCHEMY_DATABASE_URI" not in os.environ:
+        if args.url is not None:
+            sys.exit("--url needs the database of the server in KOI_SQLALCHEMY_DATABASE_URI")
+        # a fresh database and blob store for every run
+        directory = tempfile.mkdtemp(prefix="koi-bench-")
+        os.environ["KOI_SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(directory, "koi.db")
+        os.environ["KOI_FILEPERSISTENCE_BASE_URI"] = os.path.join(directory, "blobs", "")
+
+    from koi_api import create_app
+    from koi_api.orm import db
+    from benchmarks.client import HttpClient, LocalClient, login
+    from benchmarks.generate import generate
+    from benchmarks.workloads import Context, WORKLOADS, summarize
+
+    app = create_app()
+    client = LocalClient(app) if args.url is None else HttpClient(args.url)
+    header = login(client, args.user, args.password)
+
+    start = time.perf_counter()
+    dataset = generate(
+        app,
+        client,
+        header,
+        models=args.models,
+        instances=args.instances,
+        samples=args.samples,
+        seed=args.seed,
+        data=args.data,
+        labels=args.labels,
+        tags=args.tags,
+        label_requests=args.label_requests,
+        payload=args.payload,
+    )
+    generate_seconds = time.perf_counter() - start
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+
+    results = {
+        **release(),
+        "python": platform.python_version(),
+        "database": dialect,
+        "target": args.url or "test client",
+        "started": datetime.now(timezone.utc).isoformat(),
+        "dataset": {k: v for k, v in dataset.items() if k != "uuids"},
+        "generate_seconds": round(generate_seconds, 3),
+        "workloads": {},
+    }
+    for name, operations in args.workloads.items():
+        ctx = Context(app, client, header, dataset, payload=args.payload, merge_samples=args.merge_samples, seed=args.seed)
+        start = time.perf_counter()
+        WORKLOADS[name](ctx, operations)
+        results["workloads"][name] = summarize(ctx, time.perf_counter() - start)
+        print(f"{name}: {results['workloads'][name]['operations']} operations", file=sys.stderr)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def compare(args):
+    """print the throughput and latencies of two result files side by side"""
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"old: {old.get('version')} {old.get('commit')}")
+    print(f"new: {new.get('version')} {new.get('commit')}")
+    print(f"{'workload':<10} {'metric':<22} {'old':>10} {'new':>10} {'ratio':>7}")
+    for name in new["workloads"]:
+        if name not in old["workloads"]:
+            continue
+        a, b = old["workloads"][name], new["workloads"][name]
+        rows = [
+            ("operations/s", a["operations_per_second"], b["operations_per_second"]),
+            ("request p50 ms", a["request_ms"].get("p50"), b["request_ms"].get("p50")),
+            ("request p99 ms", a["request_ms"].get("p99"), b["request_ms"].get("p99")),
+            ("operation p50 ms", a["operation_ms"].get("p50"), b["operation_ms"].get("p50")),
+            ("errors", a["errors"], b["errors"]),
+        ]
+        for metric, x, y in rows:
+            ratio = f"{y / x:7.2f}" if x and y is not None else f"{'-':>7}"
+            print(f"{name:<10} {metric:<22} {x if x is not None else '-':>10} {y if y is not None else '-':>10} {ratio}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="generate a dataset and run the workloads")
+    p.add_argument("--url", help="benchmark a running server instead of the test client")
+    p.add_argument("--user", default="admin")
+    p.add_argument("--password", default="admin")
+    p.add_argument("--models", type=int, default=1)
+    p.add_argument("--instances", type=int, default=1, help="instances per model")
+    p.add_argument("--samples", type=int, default=1000, help="samples per instance")
+    p.add_argument("--data", type=int, default=1, help="data per sample")
+    p.add_argument("--labels", type=int, default=1, help="labels per sample")
+    p.add_argument("--tags", type=int, default=8, help="distinct tags per instance")
+    p.add_argument("--label-requests", type=float, default=0.1, help="share of samples with a label request")
+    p.add_argument("--payload", type=int, default=4096, help="bytes per data and label file")
+    p.add_argument("--merge-samples", type=int, default=100, help="samples per merged instance")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workloads", type=parse_workloads, default=DEFAULT_WORKLOADS, help="name=operations,...")
+    p.add_argument("--output", help="json file for the results, default stdout")
+    p.set_defaults(func=run)
+
+    p = commands.add_parser("compare", help="compare two result files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""Minimal clients sending the benchmark requests in-process or over http."""
+import json
+import urllib.error
+import urllib.request
+from collections import namedtuple
+
+
+class Response(namedtuple("Response", ["status", "body", "headers"])):
+    def json(self):
+        return json.loads(self.body)
+
+
+class LocalClient:
+    """send the requests through the flask test client of the app, without any server"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, json=None, data=None):
+        rsp = self.client.open(path, method=method, headers=headers, json=json, data=data)
+        return Response(rsp.status_code, rsp.get_data(), dict(rsp.headers))
+
+
+class HttpClient:
+    """send the requests to a running server, e.g. http://localhost:5000"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, headers=None, json=None, data=None):
+        headers = dict(headers or {})
+        if json is not None:
+            data = _dumps(json)
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as rsp:
+                return Response(rsp.status, rsp.read(), dict(rsp.headers))
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.read(), dict(e.headers))
+
+
+def _dumps(obj):
+    return json.dumps(obj).encode()
+
+
+def login(client, user_name, password):
+    """log in and return the authorization header for the following requests"""
+    rsp = client.request("POST", "/api/login", json={"user_name": user_name, "password": password})
+    if rsp.status != 200:
+        raise RuntimeError("login failed with status %d" % rsp.status)
+    return {"Authorization": "Bearer " + rsp.json()["token"]}
@@ -0,0 +1,214 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""Fill the database with a synthetic dataset of a given shape.
+
+Models and instances are created through the api, so their access rights are
+set up like for any other user. The samples with their data, labels, tags and
+label requests are written with bulk inserts into the database of the app,
+the data and labels of an instance share a few blobs of the given size.
+Shape and content only depend on the parameters and the seed, the uuids differ
+between runs so several datasets can live in one database.
+"""
+import random
+from datetime import datetime
+from io import BytesIO
+from secrets import token_hex
+from uuid import uuid4
+from zipfile import ZipFile
+from sqlalchemy import insert, select
+from koi_api.orm import db
+from koi_api.orm.sample import (
+    CHANGE_CREATED,
+    ORMAssociationTags,
+    ORMSample,
+    ORMSampleChange,
+    ORMSampleData,
+    ORMSampleLabel,
+    ORMSampleTag,
+)
+from koi_api.orm.file import ORMFile
+from koi_api.orm.label_request import ORMLabelRequest
+from koi_api.orm.instance import ORMInstance
+from koi_api.persistence import persistence
+
+# rows written per transaction
+CHUNK_SIZE = 1000
+
+# distinct blobs per instance for the data and for the labels
+BLOBS = 8
+
+MODEL_CODE = b"def train(*args):\n    pass\n"
+
+
+def make_model(client, header):
+    """create a finalized model with a stub code archive"""
+    rsp = client.request("POST", "/api/model", headers=header, json={})
+    model = rsp.json()
+
+    code = BytesIO()
+    with ZipFile(code, "w") as zip:
+        zip.writestr("__model__.py", MODEL_CODE)
+    client.request("POST", f"/api/model/{model['model_uuid']}/code", headers=header, data=code.getvalue())
+
+    model["finalized"] = True
+    rsp = client.request("PUT", f"/api/model/{model['model_uuid']}", headers=header, json=model)
+    if rsp.status != 200:
+        raise RuntimeError("could not finalize the model: %d" % rsp.status)
+    return model["model_uuid"]
+
+
+def make_instance(client, header, model_uuid):
+    rsp = client.request("POST", f"/api/model/{model_uuid}/instance", headers=header, json={})
+    if rsp.status != 200:
+        raise RuntimeError("could not create an instance: %d" % rsp.status)
+    return rsp.json()["instance_uuid"]
+
+
+def insert_ids(model, key, rows):
+    """insert the rows and return their primary keys in the order of the rows"""
+    stmt = insert(model).returning(key, sort_by_parameter_order=True)
+    if db.engine.dialect.insert_returning:
+        return list(db.session.scalars(stmt, rows))
+    # mysql has no returning, fall back to one statement per row
+    return [db.session.execute(insert(model).values(**row)).inserted_primary_key[0] for row in rows]
+
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little")
+
+
+def store_blobs(rng, payload):
+    """store the shared blobs of one kind and return the columns of their file rows"""
+    blobs = []
+    for _ in range(BLOBS):
+        file = persistence.store_file(random_bytes(rng, payload))
+        blobs.append({"file_url": file.file_url, "file_digest": file.file_digest, "file_inline": file.file_inline})
+    return blobs
+
+
+def populate(instance_uuid, samples, data=1, labels=1, tags=8, label_requests=0.1, payload=4096, seed=0):
+    """add finalized samples to an instance with bulk inserts, needs an app context.
+
+    Every sample gets the given number of data and labels, one of the tags
+    and a label request with the probability label_requests.
+    """
+    rng = random.Random(seed)
+    instance_id = db.session.scalar(
+        select(ORMInstance.instance_id).where(ORMInstance.instance_uuid == bytes.fromhex(instance_uuid))
+    )
+
+    data_blobs = store_blobs(rng, payload)
+    label_blobs = store_blobs(rng, payload)
+
+    tag_names = ["tag-%d" % i for i in range(tags)]
+    tag_ids = insert_ids(
+        ORMSampleTag, ORMSampleTag.tag_id, [{"tag_name": n, "instance_id": instance_id} for n in tag_names]
+    )
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for start in range(0, samples, CHUNK_SIZE):
+        count = min(CHUNK_SIZE, samples - start)
+        sample_rows = [
+            {
+                "sample_uuid": uuid4().bytes,
+                "sample_finalized": True,
+                "sample_last_modified": now,
+                "sample_etag": token_hex(16),
+                "instance_id": instance_id,
+            }
+            for _ in range(count)
+        ]
+        sample_ids = insert_ids(ORMSample, ORMSample.sample_id, sample_rows)
+
+        for model, kind, blobs, per_sample in [
+            (ORMSampleData, "data", data_blobs, data),
+            (ORMSampleLabel, "label", label_blobs, labels),
+        ]:
+            file_ids = insert_ids(ORMFile, ORMFile.file_id, [rng.choice(blobs) for _ in range(count * per_sample)])
+            rows = []
+            for i, sample_id in enumerate(sample_ids):
+                for k in range(per_sample):
+                    row = {
+                        kind + "_uuid": uuid4().bytes,
+                        kind + "_last_modified": now,
+                        kind + "_etag": token_hex(16),
+                        kind + "_key": "%s%d" % (kind, k),
+                        "sample_id": sample_id,
+                        "file_id": file_ids[i * per_sample + k],
+                    }
+                    if kind == "label":
+                        row["mergeable"] = True
+                    rows.append(row)
+            if len(rows) > 0:
+                db.session.execute(insert(model), rows)
+
+        if len(tag_ids) > 0:
+            db.session.execute(
+                insert(ORMAssociationTags),
+                [{"tag_id": rng.choice(tag_ids), "sample_id": s, "mergeable": True} for s in sample_ids],
+            )
+
+        requests = [
+            {
+                "label_request_uuid": uuid4().bytes,
+                "obsolete": False,
+                "label_request_sample_id": s,
+                "label_request_instance_id": instance_id,
+            }
+            for s in sample_ids
+            if rng.random() < label_requests
+        ]
+        if len(requests) > 0:
+            db.session.execute(insert(ORMLabelRequest), requests)
+
+        db.session.execute(
+            insert(ORMSampleChange),
+            [
+                {
+                    "instance_id": instance_id,
+                    "sample_uuid": row["sample_uuid"],
+                    "change_kind": CHANGE_CREATED,
+                    "change_time": now,
+                }
+                for row in sample_rows
+            ],
+        )
+        db.session.commit()
+
+
+def generate(app, client, header, models=1, instances=1, samples=1000, seed=0, **shape):
+    """create the models and instances and populate every instance.
+
+    Returns:
+        dict: the parameters and the model and instance uuids of the dataset
+    """
+    dataset = {
+        "models": models,
+        "instances": instances,
+        "samples": samples,
+        "seed": seed,
+        **shape,
+        "uuids": [],
+    }
+    for m in range(models):
+        model_uuid = make_model(client, header)
+        instance_uuids = [make_instance(client, header, model_uuid) for _ in range(instances)]
+        with app.app_context():
+            for i, instance_uuid in enumerate(instance_uuids):
+                populate(instance_uuid, samples, seed=seed * 1000003 + m * instances + i, **shape)
+        dataset["uuids"].append({"model_uuid": model_uuid, "instance_uuids": instance_uuids})
+    return dataset
@@ -0,0 +1,74 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""Compare the serialization of sample listings before and after the fast json path.
+
+    python benchmarks/json_listing.py
+
+The old path converts every uuid with UUID(bytes=...).hex and serializes with
+flask.json, the new path uses bytes.hex() and the encoder selected by
+JSON_ENCODER="auto". The compressed size shows what gzip saves on the wire.
+"""
+import gzip
+import os
+import timeit
+from uuid import UUID
+from flask import Flask, json
+from koi_api.common.return_codes import JSON_ENCODERS, COMPRESS_LEVEL, orjson
+
+
+def make_rows(count):
+    return [(os.urandom(16), i % 2 == 0) for i in range(count)]
+
+
+def listing_old(rows):
+    body = [{"sample_uuid": UUID(bytes=uuid).hex, "finalized": finalized} for uuid, finalized in rows]
+    return json.dumps(body)
+
+
+def listing_new(rows, dumps):
+    body = [{"sample_uuid": uuid.hex(), "finalized": finalized} for uuid, finalized in rows]
+    return dumps(body)
+
+
+def measure(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    app = Flask(__name__)
+    dumps = JSON_ENCODERS["flask" if orjson is None else "orjson"]
+
+    print("encoder:", "flask" if orjson is None else "orjson")
+    print(f"{'rows':>6} {'old ms':>8} {'new ms':>8} {'speedup':>8} {'bytes':>9} {'gzip bytes':>11} {'gzip ms':>8}")
+    with app.app_context():
+        for count, repeat in [(100, 200), (10000, 20)]:
+            rows = make_rows(count)
+            old = measure(lambda: listing_old(rows), repeat)
+            new = measure(lambda: listing_new(rows, dumps), repeat)
+
+            data = listing_new(rows, dumps)
+            if isinstance(data, str):
+                data = data.encode()
+            compressed = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+            compress = measure(lambda: gzip.compress(data, compresslevel=COMPRESS_LEVEL), repeat)
+
+            print(
+                f"{count:>6} {old:>8.3f} {new:>8.3f} {old / new:>7.1f}x {len(data):>9} {len(compressed):>11} {compress:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""The request mix of the typical clients of the api.
+
+Every workload runs a number of operations against the first instance of the
+dataset. The requests sent with Context.call are timed one by one, the
+operations as a whole by Context.operation. Setup requests are sent with the
+client directly and are left out of the results.
+"""
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from benchmarks.generate import make_instance, populate, random_bytes
+
+# seconds to wait for a merge job or a snapshot
+JOB_TIMEOUT = 600
+POLL_INTERVAL = 0.05
+
+
+class Context:
+    def __init__(self, app, client, header, dataset, payload=4096, merge_samples=100, seed=0):
+        self.app = app
+        self.client = client
+        self.header = header
+        self.dataset = dataset
+        self.payload_size = payload
+        self.merge_samples = merge_samples
+        self.rng = random.Random(seed)
+        self.latencies = []
+        self.durations = []
+        self.statuses = Counter()
+
+    @property
+    def model_uuid(self):
+        return self.dataset["uuids"][0]["model_uuid"]
+
+    def instance_url(self, instance_uuid=None):
+        if instance_uuid is None:
+            instance_uuid = self.dataset["uuids"][0]["instance_uuids"][0]
+        return f"/api/model/{self.model_uuid}/instance/{instance_uuid}"
+
+    def payload(self):
+        return random_bytes(self.rng, self.payload_size)
+
+    def call(self, method, path, headers=None, **kwargs):
+        start = time.perf_counter()
+        rsp = self.client.request(method, path, headers={**self.header, **(headers or {})}, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        self.statuses[rsp.status] += 1
+        return rsp
+
+    @contextmanager
+    def operation(self):
+        start = time.perf_counter()
+        yield
+        self.durations.append(time.perf_counter() - start)
+
+
+def percentiles(values):
+    """mean and percentiles of the values in milliseconds"""
+    if len(values) == 0:
+        return {}
+    ordered = sorted(values)
+
+    def at(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": at(50),
+        "p90": at(90),
+        "p99": at(99),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def summarize(ctx, seconds):
+    return {
+        "operations": len(ctx.durations),
+        "requests": len(ctx.latencies),
+        "errors": sum(count for status, count in ctx.statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(ctx.statuses.items())},
+        "seconds": round(seconds, 3),
+        "operations_per_second": round(len(ctx.durations) / seconds, 3) if seconds > 0 else None,
+        "requests_per_second": round(len(ctx.latencies) / seconds, 3) if seconds > 0 else None,
+        "operation_ms": percentiles(ctx.durations),
+        "request_ms": percentiles(ctx.latencies),
+    }
+
+
+def ingest(ctx, operations):
+    """a worker adding samples one by one, each with a data and a label file and a tag"""
+    base = ctx.instance_url()
+    for i in range(operations):
+        with ctx.operation():
+            rsp = ctx.call("POST", f"{base}/sample", json={})
+            if rsp.status != 200:
+                continue
+            url = f"{base}/sample/{rsp.json()['sample_uuid']}"
+
+            rsp = ctx.call("POST", f"{url}/data", json={"key": "data0"})
+            if rsp.status == 200:
+                ctx.call("POST", f"{url}/data/{rsp.json()['data_uuid']}/file", data=ctx.payload())
+            rsp = ctx.call("POST", f"{url}/label", json={"key": "label0"})
+            if rsp.status == 200:
+                ctx.call("POST", f"{url}/label/{rsp.json()['label_uuid']}/file", data=ctx.payload())
+
+            ctx.call("PUT", f"{url}/tags", json=[{"name": "ingest-%d" % (i % 8)}])
+            ctx.call("PUT", url, json={"finalized": True})
+
+
+def download(ctx, operations):
+    """a training worker reading the samples page by page with all their data and labels"""
+    base = ctx.instance_url()
+    offset = 0
+    done = 0
+    while done < operations:
+        rsp = ctx.call("GET", f"{base}/sample?page_offset={offset}&page_limit=100")
+        page = rsp.json() if rsp.status == 200 else []
+        if len(page) == 0:
+            if offset == 0:
+                break
+            # start over with the first page
+            offset = 0
+            continue
+        offset += len(page)
+
+        for sample in page[:operations - done]:
+            url = f"{base}/sample/{sample['sample_uuid']}"
+            with ctx.operation():
+                for kind in ["data", "label"]:
+                    rsp = ctx.call("GET", f"{url}/{kind}")
+                    if rsp.status != 200:
+                        continue
+                    for entry in rsp.json():
+                        ctx.call("GET", f"{url}/{kind}/{entry[kind + '_uuid']}/file")
+            done += 1
+
+
+def snapshot(ctx, operations):
+    """a training worker requesting a snapshot of the current samples and downloading the latest archives"""
+    base = ctx.instance_url()
+    for _ in range(operations):
+        with ctx.operation():
+            if ctx.call("POST", f"{base}/snapshot").status != 200:
+                continue
+            deadline = time.monotonic() + JOB_TIMEOUT
+            ready = None
+            while ready is None and time.monotonic() < deadline:
+                rsp = ctx.call("GET", f"{base}/snapshot")
+                if rsp.status != 200:
+                    break
+                ready = rsp.json()["ready"]
+                if ready is None:
+                    time.sleep(POLL_INTERVAL)
+            if ready is None:
+                continue
+
+            for shard in ready["shards"]:
+                ctx.call("GET", f"{base}/snapshot/{ready['snapshot_uuid']}/shard/{shard['index']}")
+
+
+def labeling(ctx, operations):
+    """the labeling ui polling the open label requests and showing the data of the first one"""
+    base = ctx.instance_url()
+    samples_etag = None
+    versions = {}
+    for _ in range(operations):
+        with ctx.operation():
+            rsp = ctx.call("GET", f"{base}/label_request?obsolete=0&page_limit=20")
+            requests = rsp.json() if rsp.status == 200 else []
+            if len(requests) > 0:
+                url = f"{base}/sample/{requests[0]['sample_uuid']}"
+                rsp = ctx.call("GET", f"{url}/data")
+                if rsp.status == 200 and len(rsp.json()) > 0:
+                    ctx.call("GET", f"{url}/data/{rsp.json()[0]['data_uuid']}/file")
+
+            # revalidate the sample list and ask for changes without waiting
+            headers = {} if samples_etag is None else {"If-None-Match": samples_etag}
+            rsp = ctx.call("HEAD", f"{base}/sample", headers=headers)
+            samples_etag = rsp.headers.get("ETag", samples_etag)
+            query = "&".join(f"{k}={v}" for k, v in versions.items())
+            rsp = ctx.call("GET", f"{base}/notify?timeout=0&{query}")
+            if rsp.status == 200:
+                body = rsp.json()
+                versions = {k: body[k] for k in ["samples", "label_requests"]}
+
+
+def merge(ctx, operations):
+    """merging two populated instances into a new one and waiting for the job"""
+    header = ctx.header
+    for i in range(operations):
+        # set up the instances without timing
+        instances = [make_instance(ctx.client, header, ctx.model_uuid) for _ in range(3)]
+        with ctx.app.app_context():
+            for k, instance_uuid in enumerate(instances[1:]):
+                populate(instance_uuid, ctx.merge_samples, payload=ctx.payload_size, seed=i * 2 + k)
+        for instance_uuid in instances:
+            ctx.client.request("PUT", ctx.instance_url(instance_uuid), headers=header, json={"finalized": True})
+
+        with ctx.operation():
+            rsp = ctx.call("POST", ctx.instance_url(instances[0]) + "/merge", json={"instance_uuid": instances[1:]})
+            if rsp.status != 200:
+                continue
+            job = rsp.json()
+            deadline = time.monotonic() + JOB_TIMEOUT
+            while job["phase"] in ["queued", "running"] and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                rsp = ctx.call("GET", ctx.instance_url(instances[0]) + "/merge/" + job["job_uuid"])
+                if rsp.status != 200:
+                    break
+                job = rsp.json()
+
+
+WORKLOADS = {
+    "ingest": ingest,
+    "download": download,
+    "snapshot": snapshot,
+    "labeling": labeling,
+    "merge": merge,
+}
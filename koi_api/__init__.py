@@ -27,11 +27,22 @@ def create_app():
 
     CORS(app)
 
-    from . import orm, resources, persistence
-    from datetime import datetime
+    from . import orm, resources, persistence, jobs, seed
+    from .common import response_cache, return_codes, metrics, profiler
+
+    # first, so its after_request handler runs last and times the whole request
+    metrics.init_app(app)
+
+    return_codes.init_app(app)
+
+    profiler.init_app(app)
 
     persistence.init_app(app)
 
+    response_cache.init_app(app)
+
+    jobs.init_app(app)
+
     resources.init_app(app)
 
     orm.init_app(app)
@@ -42,80 +53,15 @@ def create_app():
                 orm.db.drop_all()
 
             orm.db.create_all()
-            from uuid import uuid4
-
-            # pair the config keys with their appropriate ORM-constructors
-            roles = [
-                ("INITIAL_INSTANCE_ROLES", orm.role.ORMUserRoleInstance),
-                ("INITIAL_MODEL_ROLES", orm.role.ORMUserRoleModel),
-                ("INITIAL_GENERAL_ROLES", orm.role.ORMUserRoleGeneral),
-                ("ADDITIONAL_GENERAL_ROLES", orm.role.ORMUserRoleGeneral),
-            ]
-
-            # add all initial roles if not present
-            for role_type, role_object in roles:
-                if role_type in app.config:
-                    for role in app.config[role_type]:
-                        stmt = orm.db.select(role_object).where(role_object.role_name == role["name"])
-                        db_role = orm.db.session.scalars(stmt).one_or_none()
-                        if db_role is None:
-                            # create a new role
-                            db_role = role_object()
-                            db_role.role_uuid = uuid4().bytes
-                            db_role.role_name = role["name"]
-                            db_role.role_description = role["description"]
-                            db_role.is_essential = role["is_essential"]
-                            for priv, value in role["priviledges"].items():
-                                setattr(db_role, priv, value)
-                            orm.db.session.add(db_role)
-                        else:
-                            # update if we already know this role
-                            # do not update the uuid and the name
-                            db_role.role_description = role["description"]
-                            db_role.is_essential = role["is_essential"]
-                            for priv, value in role["priviledges"].items():
-                                setattr(db_role, priv, value)
-            orm.db.session.commit()
-
-            for user_type in ["INITIAL_USERS", "ADDITIONAL_USERS"]:
-                if user_type in app.config:
-                    for user in app.config[user_type]:
-                        stmt = orm.db.select(orm.user.ORMUser).where(orm.user.ORMUser.user_name == user["name"])
-                        db_user = orm.db.session.scalars(stmt).one_or_none()
-                        if db_user is None:
-                            # create a new user but do not edit existing users
-                            db_user = orm.user.ORMUser()
-                            db_user.user_name = user["name"]
-                            db_user.user_uuid = uuid4().bytes
-                            db_user.user_hash = resources.user.hash_password(user["password"])
-                            db_user.user_created = datetime.utcnow()
-                            db_user.is_essential = user["is_essential"]
-                            orm.db.session.add(db_user)
-                            orm.db.session.commit()
-
-                        # for each role assigned to this user, add it if not present
-                        for role_name in user["general_roles"]:
-                            stmt = orm.db.select(orm.role.ORMUserRoleGeneral).where(
-                                orm.role.ORMUserRoleGeneral.role_name == role_name
-                            )
-                            db_role = orm.db.session.scalars(stmt).one_or_none()
-                            if db_role is None:
-                                # something is very wrong -> we do not know this role
-                                continue
-
-                            stmt = orm.db.select(orm.access.ORMAccessGeneral).where(
-                                orm.access.ORMAccessGeneral.user_id == db_user.user_id,
-                                orm.access.ORMAccessGeneral.role_id == db_role.role_id,
-                            )
-                            user_role_assoc = orm.db.session.scalars(stmt).one_or_none()
-                            if user_role_assoc is None:
-                                # create a new association
-                                user_role_assoc = orm.access.ORMAccessGeneral()
-                                user_role_assoc.user_id = db_user.user_id
-                                user_role_assoc.role_id = db_role.role_id
-                                user_role_assoc.access_uuid = uuid4().bytes
-                                orm.db.session.add(user_role_assoc)
-            orm.db.session.commit()
+
+            # add the roles and users of the config unless seeded from the same config already
+            seed.seed_database(app.config)
+
+            # continue the jobs interrupted by the last shutdown and watch for
+            # the jobs of other processes that stop
+            if app.config["RESUME_JOBS"]:
+                jobs.resume_jobs()
+                jobs.watch_jobs()
     except OperationalError:
         return None
     return app
@@ -0,0 +1,234 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_app_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# upper bounds in seconds of the latency histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# names in flask.g of the measurements of the current request
+REQUEST_START = "koi_request_start"
+REQUEST_QUERIES = "koi_request_queries"
+REQUEST_QUERY_TIME = "koi_request_query_time"
+REQUEST_QUERY_SHAPES = "koi_request_query_shapes"
+
+# headers reporting the statements of a request while QUERY_DEBUG is set
+HEADER_QUERY_COUNT = "X-Query-Count"
+HEADER_QUERY_TIME = "X-Query-Time"
+HEADER_QUERY_REPEATED = "X-Query-Repeated"
+
+# execution context attribute of the start time of a statement, a failing
+# statement leaves it behind with its context
+QUERY_START = "koi_query_start"
+
+
+class Metrics:
+    """counters and histograms recorded per thread without locking.
+
+    Every thread writes only to its own store, the stores are summed up when
+    the metrics are rendered. Labels are tuples of (name, value) pairs.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._stores = []
+        self._lock = threading.Lock()
+        self._collectors = []
+        self.enabled = False
+
+    def _store(self):
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = (dict(), dict())
+            self._local.store = store
+            with self._lock:
+                self._stores.append(store)
+        return store
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._store()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self._store()[1]
+        key = (name, labels)
+        hist = histograms.get(key)
+        if hist is None:
+            # one count per bucket and +Inf, followed by the sum and the count
+            hist = [0] * (len(BUCKETS) + 3)
+            histograms[key] = hist
+        hist[bisect_left(BUCKETS, value)] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+    def collector(self, func):
+        """register a function returning (name, type, labels, value) tuples read at render time"""
+        self._collectors.append(func)
+        return func
+
+    def collect(self):
+        """sum up the stores of all threads"""
+        with self._lock:
+            stores = list(self._stores)
+
+        counters = dict()
+        histograms = dict()
+        for thread_counters, thread_histograms in stores:
+            # copying a dict is atomic, the owning thread may keep writing
+            for key, value in thread_counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, hist in thread_histograms.copy().items():
+                hist = list(hist)
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = hist
+                else:
+                    histograms[key] = [a + b for a, b in zip(total, hist)]
+        return counters, histograms
+
+    def render(self):
+        """the metrics in the prometheus text format"""
+        counters, histograms = self.collect()
+
+        # name -> (type, [(sample name, labels, value)])
+        families = dict()
+        for (name, labels), value in counters.items():
+            families.setdefault(name, ("counter", []))[1].append((name, labels, value))
+        for func in self._collectors:
+            for name, kind, labels, value in func():
+                families.setdefault(name, (kind, []))[1].append((name, labels, value))
+        for (name, labels), hist in histograms.items():
+            samples = families.setdefault(name, ("histogram", []))[1]
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), hist):
+                cumulative += count
+                samples.append((name + "_bucket", labels + (("le", str(bound)),), cumulative))
+            samples.append((name + "_sum", labels, hist[-2]))
+            samples.append((name + "_count", labels, hist[-1]))
+
+        lines = []
+        for name in sorted(families):
+            kind, samples = families[name]
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(sample_name + format_labels(labels) + " " + format_value(value))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+metrics = Metrics()
+
+
+def start_request():
+    setattr(g, REQUEST_START, time.perf_counter())
+    setattr(g, REQUEST_QUERIES, 0)
+    setattr(g, REQUEST_QUERY_TIME, 0.0)
+    if current_app.config["QUERY_DEBUG"]:
+        setattr(g, REQUEST_QUERY_SHAPES, dict())
+
+
+def report_queries(rsp):
+    """add the statements of the request to the response and warn about statements run over and over.
+
+    The statements are parameterized, so identical texts are queries of the
+    same shape, usually lazy loads within a loop.
+    """
+    shapes = g.get(REQUEST_QUERY_SHAPES)
+    if shapes is None:
+        return rsp
+
+    rsp.headers[HEADER_QUERY_COUNT] = str(g.get(REQUEST_QUERIES, 0))
+    rsp.headers[HEADER_QUERY_TIME] = "%.3f" % (g.get(REQUEST_QUERY_TIME, 0.0) * 1000)
+
+    threshold = current_app.config["QUERY_REPEAT_THRESHOLD"]
+    repeated = {statement: count for statement, count in shapes.items() if count >= threshold}
+    if len(repeated) > 0:
+        rsp.headers[HEADER_QUERY_REPEATED] = str(max(repeated.values()))
+        for statement, count in repeated.items():
+            current_app.logger.warning(
+                "probable N+1 in %s %s, statement ran %d times: %s",
+                request.method,
+                request.endpoint,
+                count,
+                " ".join(statement.split())[:300],
+            )
+    return rsp
+
+
+def finish_request(rsp):
+    start = g.pop(REQUEST_START, None)
+    # the timings are also taken for the headers of QUERY_DEBUG
+    if start is None or not metrics.enabled:
+        return rsp
+    endpoint = request.endpoint or "unknown"
+    labels = (("endpoint", endpoint), ("method", request.method))
+    metrics.inc("koi_requests_total", labels + (("status", str(rsp.status_code)),))
+    metrics.observe("koi_request_duration_seconds", labels, time.perf_counter() - start)
+    metrics.observe("koi_request_db_seconds", labels, g.get(REQUEST_QUERY_TIME, 0.0))
+    metrics.inc("koi_request_db_queries_total", labels, g.get(REQUEST_QUERIES, 0))
+    return rsp
+
+
+def before_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        setattr(context, QUERY_START, time.perf_counter())
+
+
+def after_query(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, QUERY_START, None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_app_context() and REQUEST_START in g:
+        setattr(g, REQUEST_QUERIES, g.get(REQUEST_QUERIES, 0) + 1)
+        setattr(g, REQUEST_QUERY_TIME, g.get(REQUEST_QUERY_TIME, 0.0) + elapsed)
+        shapes = g.get(REQUEST_QUERY_SHAPES)
+        if shapes is not None:
+            shapes[statement] = shapes.get(statement, 0) + 1
+    elif metrics.enabled:
+        metrics.inc("koi_db_queries_total", (("endpoint", "background"),))
+        metrics.inc("koi_db_query_seconds_total", (("endpoint", "background"),), elapsed)
+
+
+def init_app(app):
+    metrics.enabled = app.config["METRICS_ENABLED"]
+    if not metrics.enabled and not app.config["QUERY_DEBUG"]:
+        return
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.after_request(report_queries)
+    if not event.contains(Engine, "before_cursor_execute", before_query):
+        event.listen(Engine, "before_cursor_execute", before_query)
+        event.listen(Engine, "after_cursor_execute", after_query)
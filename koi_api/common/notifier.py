@@ -0,0 +1,110 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import threading
+import time
+from sqlalchemy import event
+from koi_api.orm import KoiSession
+from koi_api.orm.sample import ORMSampleChange
+from koi_api.orm.label_request import ORMLabelRequest
+
+
+# session info key of the instances whose samples or label requests changed
+CHANGED_INSTANCES = "koi_changed_instances"
+
+# number of notified instances kept before the ones nobody waits for are forgotten
+MAX_GENERATIONS = 10000
+
+
+class Notifier:
+    """wakes requests waiting for changes to an instance once a session commits such a change.
+
+    Only requests of this process are woken, waiters have to check the database
+    from time to time to notice changes committed by other processes.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generations = dict()
+        self._waiters = dict()
+        self._sequence = 0
+
+    def generation(self, instance_id):
+        """number of the last notification sent for the instance, passed to wait"""
+        with self._condition:
+            return self._generations.get(instance_id, 0)
+
+    def notify(self, instance_ids):
+        with self._condition:
+            # the numbers come from one sequence, so a forgotten instance never gets a number again
+            self._sequence += 1
+            for instance_id in instance_ids:
+                self._generations[instance_id] = self._sequence
+            # forget instances nobody waits for
+            if len(self._generations) > MAX_GENERATIONS:
+                self._generations = {
+                    key: value for key, value in self._generations.items() if key in self._waiters
+                }
+            self._condition.notify_all()
+
+    def wait(self, instance_id, generation, timeout):
+        """block until the instance was notified after the generation was read or the timeout passed.
+
+        Returns:
+            bool: True if the instance was notified
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._waiters[instance_id] = self._waiters.get(instance_id, 0) + 1
+            try:
+                while self._generations.get(instance_id, 0) == generation:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                return True
+            finally:
+                self._waiters[instance_id] -= 1
+                if self._waiters[instance_id] == 0:
+                    del self._waiters[instance_id]
+
+
+notifier = Notifier()
+
+
+def instance_changed(session, instance_id):
+    """notify the waiters of the instance once the session commits"""
+    session.info.setdefault(CHANGED_INSTANCES, set()).add(instance_id)
+
+
+@event.listens_for(KoiSession, "after_flush")
+def collect_changed_instances(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ORMSampleChange):
+            instance_changed(session, obj.instance_id)
+        elif isinstance(obj, ORMLabelRequest):
+            instance_changed(session, obj.label_request_instance_id)
+
+
+@event.listens_for(KoiSession, "after_commit")
+def notify_changed_instances(session):
+    changed = session.info.pop(CHANGED_INSTANCES, None)
+    if changed:
+        notifier.notify(changed)
+
+
+@event.listens_for(KoiSession, "after_rollback")
+def drop_changed_instances(session):
+    session.info.pop(CHANGED_INSTANCES, None)
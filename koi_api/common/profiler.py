@@ -0,0 +1,138 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import g, request
+from koi_api.common.metrics import REQUEST_QUERIES
+
+# requests of admins with this header are profiled, the response names the profile in HEADER_PROFILE_ID
+HEADER_PROFILE = "X-Profile"
+HEADER_PROFILE_ID = "X-Profile-Id"
+
+# what caused a request to be profiled
+TRIGGER_HEADER = "header"
+TRIGGER_SAMPLE = "sample"
+
+
+class Profiler:
+    """profiles selected requests with cProfile and keeps the last ones in a ring buffer.
+
+    The buffer belongs to the process, with several server processes every
+    process holds the profiles of the requests it answered.
+    """
+
+    def __init__(self):
+        self._profiles = deque(maxlen=20)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_id = 1
+        self.header = False
+        self.sample_rate = 0.0
+
+    def trigger(self):
+        """the reason to profile the current request, or None"""
+        # cProfile can not nest, the sub-requests of a profiled batch are part of its profile
+        if getattr(self._local, "active", False):
+            return None
+        if self.header and HEADER_PROFILE in request.headers:
+            return TRIGGER_HEADER
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return TRIGGER_SAMPLE
+        return None
+
+    def run(self, func, resource, trigger):
+        """call func under the profiler and record the profile tagged with the resource and the request"""
+        queries = g.get(REQUEST_QUERIES)
+        profile = cProfile.Profile()
+        self._local.active = True
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            rsp = func()
+        finally:
+            profile.disable()
+            self._local.active = False
+        duration = time.perf_counter() - start
+        profile.create_stats()
+
+        entry = {
+            "resource": resource,
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": getattr(rsp, "status_code", None),
+            "duration": duration,
+            # the statement count is recorded by the metrics, None if they are disabled
+            "queries": None if queries is None else g.get(REQUEST_QUERIES) - queries,
+            "trigger": trigger,
+            "created": datetime.utcnow(),
+            "profile": profile,
+        }
+        with self._lock:
+            entry["id"] = self._next_id
+            self._next_id += 1
+            self._profiles.append(entry)
+
+        if hasattr(rsp, "headers"):
+            rsp.headers[HEADER_PROFILE_ID] = str(entry["id"])
+        return rsp
+
+    def resize(self, size):
+        with self._lock:
+            self._profiles = deque(self._profiles, maxlen=size)
+
+    def profiles(self):
+        with self._lock:
+            return list(self._profiles)
+
+    def get(self, profile_id):
+        with self._lock:
+            for entry in self._profiles:
+                if entry["id"] == profile_id:
+                    return entry
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+def dump(entry):
+    """the profile in the binary format of pstats, load it with pstats.Stats(path)"""
+    return marshal.dumps(entry["profile"].stats)
+
+
+def render(entry, sort, limit):
+    """the profile as the text table of pstats"""
+    stream = io.StringIO()
+    stats = pstats.Stats(entry["profile"], stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+profiler = Profiler()
+
+
+def init_app(app):
+    profiler.header = app.config["PROFILE_HEADER"]
+    profiler.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+    profiler.resize(app.config["PROFILE_BUFFER_SIZE"])
@@ -0,0 +1,97 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from collections import OrderedDict
+from datetime import timedelta
+import threading
+from koi_api.common.metrics import metrics
+
+
+class ResponseCache:
+    """least recently used cache of response bodies, bounded by their size in bytes.
+
+    Keys contain the version of the parent resource, so entries never have to be
+    invalidated. Outdated entries are evicted once the cache is full.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._max_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self._max_size = app.config["RESPONSE_CACHE_SIZE"]
+
+    @property
+    def enabled(self):
+        return self._max_size > 0
+
+    def get(self, key):
+        """get the (body, headers, valid_seconds) stored for the key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, key, body, headers, valid_seconds):
+        size = len(body) + sum(len(k) + len(v) for k, v in headers)
+        if size > self._max_size:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[0]
+            self._entries[key] = (size, body, headers, valid_seconds)
+            self._size += size
+
+            # evict the least recently used entries
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+def valid_seconds(rsp, now):
+    """remaining lifetime of a response built at the given time"""
+    if rsp.expires is None:
+        return 0
+    return max((rsp.expires.replace(tzinfo=None) - now) // timedelta(seconds=1), 0)
+
+
+cache = ResponseCache()
+
+
+def init_app(app):
+    cache.init_app(app)
+
+
+@metrics.collector
+def cache_metrics():
+    return [
+        ("koi_response_cache_hits_total", "counter", (), cache.hits),
+        ("koi_response_cache_misses_total", "counter", (), cache.misses),
+    ]
@@ -13,8 +13,110 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
-from flask import Response, json
+from flask import Response, json, request, current_app
 from datetime import datetime, timedelta
+from werkzeug.http import is_resource_modified
+import gzip
+import time
+import zlib
+from koi_api.common.metrics import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# compression level for json bodies, higher levels take twice as long and save about 5%
+COMPRESS_LEVEL = 1
+
+
+def dumps_orjson(obj):
+    return orjson.dumps(obj, default=current_app.json.default, option=orjson.OPT_NON_STR_KEYS)
+
+
+JSON_ENCODERS = {
+    "flask": json.dumps,
+    "orjson": dumps_orjson,
+}
+
+
+class Encoder:
+    """serializes the response bodies with the encoder selected by JSON_ENCODER.
+    "auto" uses orjson if it is installed.
+    """
+
+    def __init__(self):
+        self.dumps = json.dumps
+
+    def init_app(self, app):
+        name = app.config["JSON_ENCODER"]
+        if name == "auto":
+            name = "flask" if orjson is None else "orjson"
+        if name not in JSON_ENCODERS or (name == "orjson" and orjson is None):
+            raise ValueError("json encoder not available: " + name)
+        self.dumps = JSON_ENCODERS[name]
+
+
+encoder = Encoder()
+
+
+def compress_response(rsp):
+    """compress large json bodies with gzip or deflate if the client accepts it"""
+    min_size = current_app.config["JSON_COMPRESS_MIN_SIZE"]
+    if min_size <= 0 or rsp.status_code != 200 or not rsp.is_json:
+        return rsp
+    if rsp.direct_passthrough or "Content-Encoding" in rsp.headers:
+        return rsp
+
+    data = rsp.get_data()
+    if len(data) < min_size:
+        return rsp
+
+    rsp.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    start = time.perf_counter()
+    if encoding == "gzip":
+        rsp.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    elif encoding == "deflate":
+        rsp.set_data(zlib.compress(data, level=COMPRESS_LEVEL))
+    else:
+        return rsp
+    rsp.headers["Content-Encoding"] = encoding
+
+    labels = (("encoding", encoding),)
+    metrics.inc("koi_compress_seconds_total", labels, time.perf_counter() - start)
+    metrics.inc("koi_compress_input_bytes_total", labels, len(data))
+    metrics.inc("koi_compress_output_bytes_total", labels, rsp.content_length)
+    return rsp
+
+
+def init_app(app):
+    encoder.init_app(app)
+    app.after_request(compress_response)
+
+
+def not_modified(etag=None, last_modified=None):
+    """evaluate If-None-Match and If-Modified-Since of the current request.
+
+    Returns:
+        a 304 response if the client already holds this state of the resource, None otherwise
+    """
+    if etag is None and last_modified is None:
+        return None
+    if request.method not in ["GET", "HEAD"]:
+        return None
+    if "If-None-Match" not in request.headers and "If-Modified-Since" not in request.headers:
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+
+    rsp = Response(status=304)
+    if etag is not None:
+        rsp.set_etag(etag, False)
+    if last_modified is not None:
+        rsp.last_modified = last_modified
+    return rsp
 
 
 class ReturnCode:
@@ -23,11 +125,16 @@ class ReturnCode:
         self.c = code
 
     def __call__(self, body=None, header=None, last_modified=None, valid_seconds=15, etag=None):
+        if self.c == 200:
+            rsp = not_modified(etag, last_modified)
+            if rsp is not None:
+                return rsp
+
         rsp = None
         if body is None:
-            rsp = Response(json.dumps(self.m), self.c, header, mimetype="application/json")
+            rsp = Response(encoder.dumps(self.m), self.c, header, mimetype="application/json")
         else:
-            rsp = Response(json.dumps(body), self.c, header, mimetype="application/json")
+            rsp = Response(encoder.dumps(body), self.c, header, mimetype="application/json")
 
         if last_modified is not None:
             then = datetime.utcnow() + timedelta(seconds=valid_seconds)
@@ -23,6 +23,15 @@ class BODY_GENERAL:
     EXPIRES = "expires"
 
 
+class BODY_BATCH:
+    BATCH_REQUESTS = "requests"
+    BATCH_METHOD = "method"
+    BATCH_PATH = "path"
+    BATCH_BODY = "body"
+    BATCH_DATA = "data"
+    BATCH_STATUS = "status"
+
+
 class BODY_SAMPLE:
     SAMPLE_UUID = "sample_uuid"
     SAMPLE_FINALIZED = "finalized"
@@ -36,13 +45,82 @@ class BODY_SAMPLE:
     SAMPLE_LABEL_REQUEST_UUID = "label_request_uuid"
     SAMPLE_KEY = "key"
     SAMPLE_HAS_FILE = "has_file"
+    SAMPLE_COUNT = "count"
 
     SAMPLE_TAGS_INCLUDE = "inc_tags"
     SAMPLE_TAGS_EXCLUDE = "exc_tags"
 
 
+class BODY_CHANGES:
+    CHANGES_SINCE = "since"
+    CHANGES_SINCE_TIME = "since_time"
+    CHANGES_CURSOR = "cursor"
+    CHANGES_CREATED = "created"
+    CHANGES_MODIFIED = "modified"
+    CHANGES_DELETED = "deleted"
+    CHANGES_MORE = "more"
+
+
+class BODY_NOTIFY:
+    NOTIFY_SAMPLES = "samples"
+    NOTIFY_LABEL_REQUESTS = "label_requests"
+    NOTIFY_TIMEOUT = "timeout"
+    NOTIFY_CHANGED = "changed"
+
+
+class BODY_ADMIN:
+    ADMIN_PID = "pid"
+    ADMIN_POOLS = "pools"
+    ADMIN_REPLICA_FALLBACKS = "replica_fallbacks"
+    PROFILE_ID = "profile_id"
+    PROFILE_RESOURCE = "resource"
+    PROFILE_METHOD = "method"
+    PROFILE_PATH = "path"
+    PROFILE_STATUS = "status"
+    PROFILE_DURATION = "duration"
+    PROFILE_QUERIES = "queries"
+    PROFILE_TRIGGER = "trigger"
+    PROFILE_CREATED = "created"
+    PROFILE_FORMAT = "format"
+    PROFILE_SORT = "sort"
+    PROFILE_LIMIT = "limit"
+    PERSISTENCE_OPERATIONS = "operations"
+    PERSISTENCE_CODECS = "codecs"
+    PERSISTENCE_SLOW = "slow"
+    PERSISTENCE_THRESHOLDS = "thresholds"
+    PERSISTENCE_COUNT = "count"
+    PERSISTENCE_SLOW_COUNT = "slow_count"
+    PERSISTENCE_OP = "op"
+    PERSISTENCE_FILE = "file"
+    PERSISTENCE_TIME = "time"
+    PERSISTENCE_SECONDS = "seconds"
+    PERSISTENCE_IO_SECONDS = "io_seconds"
+    PERSISTENCE_CODEC_SECONDS = "codec_seconds"
+    PERSISTENCE_COMPRESS_SECONDS = "compress_seconds"
+    PERSISTENCE_DECOMPRESS_SECONDS = "decompress_seconds"
+    PERSISTENCE_RAW_BYTES = "raw_bytes"
+    PERSISTENCE_STORED_BYTES = "stored_bytes"
+    PERSISTENCE_READ_BYTES = "read_bytes"
+    PERSISTENCE_STORED_READ_BYTES = "stored_read_bytes"
+    PERSISTENCE_WRITTEN_BYTES = "written_bytes"
+    PERSISTENCE_STORED_WRITTEN_BYTES = "stored_written_bytes"
+    PERSISTENCE_RATIO = "ratio"
+    RECONCILE_REMOVE = "remove"
+    RECONCILE_STEP = "step"
+    RECONCILE_CHECKED = "checked"
+    RECONCILE_DANGLING_ROWS = "dangling_rows"
+    RECONCILE_UNREFERENCED_FILES = "unreferenced_files"
+    RECONCILE_MISSING_BLOBS = "missing_blobs"
+    RECONCILE_ORPHAN_BLOBS = "orphan_blobs"
+    RECONCILE_SUPERSEDED_CHANGES = "superseded_changes"
+    RECONCILE_REMOVED = "removed"
+    RECONCILE_REPORT = "report"
+
+
 class BODY_TAG:
     TAG_NAME = "name"
+    TAG_ADD = "add"
+    TAG_REMOVE = "remove"
 
 
 class BODY_USER:
@@ -70,6 +148,32 @@ class BODY_INSTANCE:
     INSTANCE_HAS_REQUESTS = "has_requests"
 
 
+class BODY_JOB:
+    JOB_UUID = "job_uuid"
+    JOB_PHASE = "phase"
+    JOB_TOTAL = "total"
+    JOB_PROCESSED = "processed"
+    JOB_SAMPLES = "samples"
+    JOB_ERROR = "error"
+    JOB_CREATED = "created"
+    JOB_LAST_MODIFIED = "last_modified"
+
+
+class BODY_SNAPSHOT:
+    SNAPSHOT_UUID = "snapshot_uuid"
+    SNAPSHOT_VERSION = "version"
+    SNAPSHOT_PHASE = "phase"
+    SNAPSHOT_SAMPLES = "samples"
+    SNAPSHOT_ERROR = "error"
+    SNAPSHOT_CREATED = "created"
+    SNAPSHOT_SHARDS = "shards"
+    SNAPSHOT_CURRENT = "snapshot"
+    SNAPSHOT_READY = "ready"
+    SHARD_INDEX = "index"
+    SHARD_SIZE = "size"
+    SHARD_SAMPLES = "samples"
+
+
 class BODY_MODEL:
     MODEL_NAME = "model_name"
     MODEL_UUID = "model_uuid"
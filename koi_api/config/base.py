@@ -16,11 +16,96 @@
 SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# read replicas of the database, GET and HEAD requests read from one of them
+SQLALCHEMY_REPLICA_URIS = []
+# repeat GET and HEAD requests on the primary if the replica misses the resource or
+# the token, the replica may lag behind
+REPLICA_FALLBACK = True
+
+# connection pool of each process, see koi_api/serve.py for running several processes
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+# seconds after which connections are replaced, below the wait_timeout of mysql
+DB_POOL_RECYCLE = 3600
+DB_POOL_TIMEOUT = 30
+# test connections before use, avoids "server has gone away" errors after idle times
+DB_POOL_PRE_PING = True
+
 FILEPERSISTENCE_COMPRESS = True
 FILEPERSISTENCE_BASE_URI = "./temp/"
+# files smaller than this many bytes are stored uncompressed in the database instead
+# of a blob, 0 disables it. keep it below 65535 bytes, the size of a mysql blob column
+FILEPERSISTENCE_INLINE_SIZE = 1024
+
+# file reads and writes taking longer than this many seconds for io and compression
+# are logged, the last PERSISTENCE_SLOW_LOG_SIZE are listed at /api/admin/persistence
+PERSISTENCE_SLOW_READ_SECONDS = 0.5
+PERSISTENCE_SLOW_WRITE_SECONDS = 1.0
+PERSISTENCE_SLOW_LOG_SIZE = 50
+
+# reconcile jobs check this many rows or blobs per transaction, blobs younger than
+# RECONCILE_GRACE_SECONDS may belong to an open transaction and are never orphans
+RECONCILE_BATCH_SIZE = 500
+RECONCILE_GRACE_SECONDS = 3600
+
+# reconcile jobs delete the sample changes older than this many seconds that a newer
+# change of the same sample supersedes, 0 keeps the whole log. change feeds resuming
+# from an older cursor may report a created sample as modified
+CHANGE_LOG_RETENTION_SECONDS = 7 * 24 * 3600
 
 FORCE_RESET = False
 
+# resume interrupted jobs on startup and the jobs abandoned by other processes later on
+RESUME_JOBS = True
+
+# number of worker threads running merge, snapshot and reconcile jobs. with an in-memory
+# sqlite database, which can not be shared between threads, the jobs run in the
+# requesting thread right after its commit
+MERGE_JOB_WORKERS = 2
+
+# running jobs not reporting progress for this many seconds are taken over by another
+# process, keep it above the longest step of a job like building a snapshot or merging
+# one instance. processes with job workers look for such jobs at the same interval
+JOB_LEASE_SECONDS = 600
+
+# bytes of collection responses kept in memory, 0 disables the cache
+RESPONSE_CACHE_SIZE = 64 * 1024 * 1024
+
+# the change feed leaves out changes younger than this many seconds, they may
+# belong to transactions committing after newer changes
+CHANGE_FEED_SETTLE_SECONDS = 0
+
+# longest wait of a notification request in seconds, each wait blocks a worker thread
+NOTIFY_MAX_TIMEOUT = 30
+
+# waiting notification requests check the database this often in seconds, to
+# notice changes committed by other processes
+NOTIFY_RECHECK_SECONDS = 5
+
+# maximum size in bytes of one archive of a sample snapshot
+SNAPSHOT_SHARD_SIZE = 1024 * 1024 * 1024
+
+# record request, database, persistence and compression metrics served at /metrics
+METRICS_ENABLED = True
+
+# report the statements of each request in X-Query-* headers and log statements
+# run at least QUERY_REPEAT_THRESHOLD times within one request as probable N+1
+QUERY_DEBUG = False
+QUERY_REPEAT_THRESHOLD = 5
+
+# profile the requests of admins sending the X-Profile header and this share of all
+# requests with cProfile, the last PROFILE_BUFFER_SIZE profiles of every process are
+# served at /api/admin/profile
+PROFILE_HEADER = True
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_BUFFER_SIZE = 20
+
+# "auto" uses orjson if installed, "flask" or "orjson" select an encoder
+JSON_ENCODER = "auto"
+
+# json bodies of at least this many bytes are compressed if the client accepts it, 0 disables
+JSON_COMPRESS_MIN_SIZE = 4096
+
 INITIAL_GENERAL_ROLES = [
     {
         "name": "admin",
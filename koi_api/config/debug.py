@@ -16,3 +16,5 @@
 SQLALCHEMY_TRACK_MODIFICATIONS = True
 
 FORCE_RESET = True
+
+QUERY_DEBUG = True
@@ -20,3 +20,9 @@ FILEPERSISTENCE_COMPRESS = True
 FILEPERSISTENCE_BASE_URI = "./temp/"
 
 FORCE_RESET = False
+
+# number of threads running merge jobs in the background
+MERGE_JOB_WORKERS = 2
+
+# writers commit concurrently, give them some time before changes enter the feed
+CHANGE_FEED_SETTLE_SECONDS = 5
@@ -0,0 +1,188 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, select, update, and_, or_
+from sqlalchemy.engine import make_url
+from koi_api.orm import db, KoiSession
+from koi_api.orm.job import JOB_QUEUED, JOB_RUNNING, JOB_FAILED
+
+
+# session info key of the jobs to start once the session commits
+PENDING_JOBS = "koi_pending_jobs"
+
+
+def in_memory_database(uri):
+    """whether the uri names an in-memory sqlite database, its connection can not be used by several threads at once"""
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def job_owner():
+    """name of the calling process as the owner of the jobs it runs"""
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class LeaseLost(Exception):
+    """another process took over the job after its lease expired"""
+
+
+class JobLease:
+    """ownership of the rows of one kind of job.
+
+    A process claims a job by setting itself as owner and renews the heartbeat
+    with every checkpoint. Running jobs whose heartbeat is older than
+    JOB_LEASE_SECONDS were abandoned and can be claimed by any other process,
+    the checkpoints of the former owner fail from then on.
+    """
+
+    def __init__(self, key, phase, owner, heartbeat):
+        self.key = key
+        self.phase = phase
+        self.owner = owner
+        self.heartbeat = heartbeat
+
+    def claimable(self):
+        expired = datetime.utcnow() - timedelta(seconds=current_app.config["JOB_LEASE_SECONDS"])
+        return or_(
+            self.phase == JOB_QUEUED,
+            and_(self.phase == JOB_RUNNING, or_(self.heartbeat.is_(None), self.heartbeat < expired)),
+        )
+
+    def resumable(self):
+        """get the ids of the queued and abandoned jobs"""
+        return db.session.scalars(select(self.key).where(self.claimable())).all()
+
+    def claim(self, job_id):
+        """take over a queued or abandoned job and commit, of several processes only one succeeds"""
+        stmt = (
+            update(self.key.class_)
+            .where(self.key == job_id, self.claimable())
+            .values({self.phase: JOB_RUNNING, self.owner: job_owner(), self.heartbeat: datetime.utcnow()})
+            .execution_options(synchronize_session=False)
+        )
+        claimed = db.session.execute(stmt).rowcount == 1
+        db.session.commit()
+        return claimed
+
+    def renew(self, job_id):
+        """refresh the heartbeat in the current transaction, call it before every checkpoint"""
+        stmt = (
+            update(self.key.class_)
+            .where(self.key == job_id, self.owner == job_owner())
+            .values({self.heartbeat: datetime.utcnow()})
+            .execution_options(synchronize_session=False)
+        )
+        if db.session.execute(stmt).rowcount != 1:
+            raise LeaseLost()
+
+    def fail(self, job_id, values):
+        """mark the job as failed with the given column values unless another process took it over, commits"""
+        stmt = (
+            update(self.key.class_)
+            .where(self.key == job_id, self.owner == job_owner())
+            .values({self.phase: JOB_FAILED, **values})
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(stmt)
+        db.session.commit()
+
+
+class JobRunner:
+    """runs jobs on a pool of worker threads, each with its own app context.
+    With an in-memory sqlite database the jobs run in the calling thread instead,
+    still in their own app context and only after the submitting session committed.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._executor = None
+        self._watcher = None
+
+    def init_app(self, app):
+        self._app = app
+        if not in_memory_database(app.config["SQLALCHEMY_DATABASE_URI"]):
+            workers = max(1, app.config["MERGE_JOB_WORKERS"])
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="koi-job")
+
+    def submit(self, session, func, *args):
+        """run func(*args) once the session has committed the job"""
+        session.info.setdefault(PENDING_JOBS, []).append((self, func, args))
+
+    def start(self, func, *args):
+        """run func(*args) right away, returns the future of a background run"""
+        if self._executor is None:
+            self._run(func, *args)
+            return None
+        return self._executor.submit(self._run, func, *args)
+
+    def _run(self, func, *args):
+        with self._app.app_context():
+            return func(*args)
+
+    def watch(self):
+        """resume the jobs abandoned by other processes every JOB_LEASE_SECONDS"""
+        if self._executor is None or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="koi-job-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self._app.config["JOB_LEASE_SECONDS"])
+            with self._app.app_context():
+                try:
+                    resume_jobs()
+                except Exception:
+                    self._app.logger.exception("resuming abandoned jobs failed")
+
+
+jobs = JobRunner()
+
+
+@event.listens_for(KoiSession, "after_commit")
+def start_pending_jobs(session):
+    for runner, func, args in session.info.pop(PENDING_JOBS, []):
+        runner.start(func, *args)
+
+
+@event.listens_for(KoiSession, "after_rollback")
+def drop_pending_jobs(session):
+    session.info.pop(PENDING_JOBS, None)
+
+
+def init_app(app):
+    jobs.init_app(app)
+
+
+def watch_jobs():
+    jobs.watch()
+
+
+def resume_jobs():
+    """start all queued jobs and the jobs abandoned by a process that stopped"""
+    from koi_api.jobs.merge import resume_merge_jobs
+    from koi_api.jobs.snapshot import resume_snapshots
+    from koi_api.jobs.reconcile import resume_reconcile_jobs
+
+    resume_merge_jobs()
+    resume_snapshots()
+    resume_reconcile_jobs()
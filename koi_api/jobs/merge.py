@@ -0,0 +1,138 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import json
+from datetime import datetime
+from secrets import token_hex
+from uuid import uuid4, UUID
+from sqlalchemy import select
+from koi_api.orm import db
+from koi_api.orm.file import ORMFile
+from koi_api.orm.instance import ORMInstance, ORMInstanceDescriptor
+from koi_api.orm.job import ORMMergeJob, JOB_QUEUED, JOB_DONE
+from koi_api.persistence import persistence
+from koi_api.jobs import jobs, JobLease, LeaseLost
+
+merge_lease = JobLease(ORMMergeJob.job_id, ORMMergeJob.job_phase, ORMMergeJob.job_owner, ORMMergeJob.job_heartbeat)
+
+
+def descriptor_files(instance):
+    """get the key and file of all descriptors of an instance that have a file.
+    Files stored before digests were recorded receive their digest here.
+    """
+    stmt = (
+        select(ORMInstanceDescriptor.descriptor_key, ORMFile)
+        .join(ORMInstanceDescriptor.file)
+        .where(ORMInstanceDescriptor.descriptor_instance_id == instance.instance_id)
+        .order_by(ORMInstanceDescriptor.descriptor_id)
+    )
+    descriptors = db.session.execute(stmt).all()
+    for _, file in descriptors:
+        if file.file_digest is None:
+            file.file_digest = persistence.digest_file(file)
+    return descriptors
+
+
+def new_merge_job(instance, source_uuids):
+    """create a merge job for the instance and start it once the session commits"""
+    job = ORMMergeJob()
+    job.job_uuid = uuid4().bytes
+    job.instance = instance
+    job.job_phase = JOB_QUEUED
+    job.job_created = datetime.utcnow()
+    job.job_last_modified = job.job_created
+    job.job_sources = json.dumps([UUID(u).hex for u in source_uuids])
+    job.job_total = len(source_uuids)
+    job.job_processed = 0
+    job.job_samples = 0
+    db.session.add(job)
+    db.session.flush()
+
+    jobs.submit(db.session, run_merge_job, job.job_id)
+    return job
+
+
+def resume_merge_jobs():
+    for job_id in merge_lease.resumable():
+        jobs.start(run_merge_job, job_id)
+
+
+def run_merge_job(job_id):
+    """merge the source instances of the job into its instance.
+
+    Every source instance is merged in its own transaction together with the
+    progress of the job, so an interrupted job continues with the next source.
+    """
+    if not merge_lease.claim(job_id):
+        return
+    job = db.session.get(ORMMergeJob, job_id)
+
+    try:
+        instance = job.instance
+
+        # collect all known descriptors by their content digest
+        known_descriptors = {(key, file.file_digest) for key, file in descriptor_files(instance)}
+
+        for inst_uuid in json.loads(job.job_sources)[job.job_processed:]:
+            stmt_inst = select(ORMInstance).where(ORMInstance.instance_uuid == UUID(inst_uuid).bytes)
+            inst = db.session.scalars(stmt_inst).one_or_none()
+
+            # skip unknown, already merged instances and the target itself
+            if inst is not None and inst.instance_merged_id is None and inst.instance_id != instance.instance_id:
+                # add the new descriptors of this instance, linked to the existing blobs
+                for key, file in descriptor_files(inst):
+                    if (key, file.file_digest) in known_descriptors:
+                        continue
+                    try:
+                        file_pers = persistence.link_file(file)
+                    except FileNotFoundError:
+                        # the descriptor was removed by a concurrent request
+                        continue
+                    known_descriptors.add((key, file.file_digest))
+                    db.session.add(file_pers)
+
+                    new_desc = ORMInstanceDescriptor()
+                    new_desc.descriptor_key = key
+                    new_desc.instance = instance
+                    new_desc.descriptor_uuid = uuid4().bytes
+
+                    new_desc.file = file_pers
+                    db.session.add(new_desc)
+
+                    instance.instance_last_modified = datetime.utcnow()
+                    instance.instance_etag = token_hex(16)
+
+                # transfer all samples to the new merged instance
+                job.job_samples += instance.absorb_samples(inst)
+
+                # mark the current instance as merged
+                inst.instance_merged = instance
+
+            # checkpoint the progress together with the merged instance
+            job.job_processed += 1
+            job.job_last_modified = datetime.utcnow()
+            merge_lease.renew(job_id)
+            db.session.commit()
+
+        job.job_phase = JOB_DONE
+        job.job_last_modified = datetime.utcnow()
+        merge_lease.renew(job_id)
+        db.session.commit()
+    except LeaseLost:
+        # the process that took over continues after the last checkpoint
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        merge_lease.fail(job_id, {ORMMergeJob.job_error: str(e)[:500], ORMMergeJob.job_last_modified: datetime.utcnow()})
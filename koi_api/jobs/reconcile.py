@@ -0,0 +1,273 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import json
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+from flask import current_app
+from sqlalchemy import select, delete, func
+from koi_api.orm import db
+from koi_api.orm.file import ORMFile
+from koi_api.orm.instance import ORMInstance, ORMInstanceInferenceData, ORMInstanceTrainingData
+from koi_api.orm.sample import ORMSampleChange
+from koi_api.orm.model import ORMModelCode, ORMModelVisualPlugin, ORMModelLabelRequestPlugin
+from koi_api.orm.job import ORMReconcileJob, JOB_QUEUED, JOB_DONE
+from koi_api.persistence import persistence
+from koi_api.jobs import jobs, JobLease, LeaseLost
+
+
+# rows holding the file of a model or an instance, they are replaced as a whole
+HOLDERS = [
+    ORMModelCode,
+    ORMModelVisualPlugin,
+    ORMModelLabelRequestPlugin,
+    ORMInstanceInferenceData,
+    ORMInstanceTrainingData,
+]
+
+# blobs are named by a hex uuid, each bucket holds the blobs of one first digit
+BUCKETS = "0123456789abcdef"
+
+# the holders are checked first, then the files, the blobs of every bucket and
+# last the change logs of the instances
+STEP_FILES = len(HOLDERS)
+STEP_BLOBS = STEP_FILES + 1
+STEP_CHANGES = STEP_BLOBS + len(BUCKETS)
+STEP_END = STEP_CHANGES + 1
+
+# kinds of findings
+DANGLING_ROW = "dangling_rows"
+UNREFERENCED_FILE = "unreferenced_files"
+MISSING_BLOB = "missing_blobs"
+ORPHAN_BLOB = "orphan_blobs"
+SUPERSEDED_CHANGE = "superseded_changes"
+
+# findings of each kind listed in the report of a job
+REPORT_LIMIT = 100
+
+reconcile_lease = JobLease(
+    ORMReconcileJob.job_id, ORMReconcileJob.job_phase, ORMReconcileJob.job_owner, ORMReconcileJob.job_heartbeat
+)
+
+
+def new_reconcile_job(remove):
+    """create a reconcile job and start it once the session commits"""
+    job = ORMReconcileJob()
+    job.job_uuid = uuid4().bytes
+    job.job_phase = JOB_QUEUED
+    job.job_created = datetime.utcnow()
+    job.job_last_modified = job.job_created
+    job.job_remove = remove
+    job.job_step = 0
+    job.job_cursor = None
+    job.job_checked = 0
+    job.job_dangling_rows = 0
+    job.job_unreferenced_files = 0
+    job.job_missing_blobs = 0
+    job.job_orphan_blobs = 0
+    job.job_superseded_changes = 0
+    job.job_removed = 0
+    job.job_report = json.dumps(
+        {kind: [] for kind in [DANGLING_ROW, UNREFERENCED_FILE, MISSING_BLOB, ORPHAN_BLOB, SUPERSEDED_CHANGE]}
+    )
+    db.session.add(job)
+    db.session.flush()
+
+    jobs.submit(db.session, run_reconcile_job, job.job_id)
+    return job
+
+
+def resume_reconcile_jobs():
+    for job_id in reconcile_lease.resumable():
+        jobs.start(run_reconcile_job, job_id)
+
+
+def referencing_columns(column):
+    """get all columns with a foreign key to the given column"""
+    return [
+        fk.parent
+        for table in db.metadata.sorted_tables
+        for fk in table.foreign_keys
+        if fk.column is column
+    ]
+
+
+def referenced_ids(column, ids):
+    """get the ids out of ids that are referenced by any foreign key to the column"""
+    found = set()
+    for ref in referencing_columns(column):
+        found.update(db.session.scalars(select(ref).where(ref.in_(ids)).distinct()))
+    return found
+
+
+class Reconciler:
+    """checks one batch of a reconcile job after the other and records the findings"""
+
+    def __init__(self, job):
+        self.job = job
+        self.report = json.loads(job.job_report)
+        self.batch_size = current_app.config["RECONCILE_BATCH_SIZE"]
+        self.grace_seconds = current_app.config["RECONCILE_GRACE_SECONDS"]
+        self.retention_seconds = current_app.config["CHANGE_LOG_RETENTION_SECONDS"]
+        self._blobs = None
+
+    def found(self, kind, entry, count=1):
+        setattr(self.job, "job_" + kind, getattr(self.job, "job_" + kind) + count)
+        if len(self.report[kind]) < REPORT_LIMIT:
+            self.report[kind].append(entry)
+
+    def checkpoint(self, step, cursor):
+        """commit the progress together with the removals of the batch"""
+        self.job.job_step = step
+        self.job.job_cursor = cursor
+        self.job.job_report = json.dumps(self.report)
+        self.job.job_last_modified = datetime.utcnow()
+        reconcile_lease.renew(self.job.job_id)
+        db.session.commit()
+
+    def step(self):
+        """check the next batch, returns False once all steps are done"""
+        step = self.job.job_step
+        if step < STEP_FILES:
+            self.check_rows(step, HOLDERS[step])
+        elif step == STEP_FILES:
+            self.check_rows(step, ORMFile)
+        elif step < STEP_CHANGES:
+            self.check_blobs(step, BUCKETS[step - STEP_BLOBS])
+        elif step == STEP_CHANGES:
+            self.check_changes(step)
+        return self.job.job_step < STEP_END
+
+    def check_rows(self, step, model):
+        """find the rows of the model not referenced by any other row, and files without blob"""
+        key = model.__table__.primary_key.columns.values()[0]
+        stmt = select(model).order_by(key).limit(self.batch_size)
+        if self.job.job_cursor is not None:
+            stmt = stmt.where(key > int(self.job.job_cursor))
+        rows = db.session.scalars(stmt).all()
+        if len(rows) == 0:
+            self.checkpoint(step + 1, None)
+            return
+
+        ids = [getattr(row, key.key) for row in rows]
+        referenced = referenced_ids(key, ids)
+        for row, id in zip(rows, ids):
+            if model is ORMFile and row.file_url is not None and not persistence.has_blob(row.file_url):
+                self.found(MISSING_BLOB, {"table": model.__tablename__, "id": id, "url": row.file_url})
+            if id in referenced:
+                continue
+            self.found(
+                UNREFERENCED_FILE if model is ORMFile else DANGLING_ROW,
+                {"table": model.__tablename__, "id": id},
+            )
+            if self.job.job_remove:
+                # the file of a holder and the blob go with it once the batch commits
+                db.session.delete(row)
+                self.job.job_removed += 1
+
+        self.job.job_checked += len(rows)
+        self.checkpoint(step, str(ids[-1]))
+
+    def check_blobs(self, step, bucket):
+        """find the blobs of the bucket without a file row"""
+        if self._blobs is None:
+            # list every bucket once per run, a run resumes after the cursor
+            cursor = self.job.job_cursor or ""
+            self._blobs = [blob for blob in persistence.list_blobs(bucket) if blob[0] > cursor]
+
+        batch, self._blobs = self._blobs[: self.batch_size], self._blobs[self.batch_size:]
+        if len(batch) == 0:
+            self._blobs = None
+            self.checkpoint(step + 1, None)
+            return
+
+        urls = [url for url, _ in batch]
+        known = set(db.session.scalars(select(ORMFile.file_url).where(ORMFile.file_url.in_(urls))))
+        # blobs of transactions that did not commit yet look like orphans
+        settled = time.time() - self.grace_seconds
+        for url, modified in batch:
+            if url in known or modified > settled:
+                continue
+            self.found(ORPHAN_BLOB, {"url": url})
+            if self.job.job_remove:
+                try:
+                    persistence.remove_blob(url)
+                    self.job.job_removed += 1
+                except FileNotFoundError:
+                    pass
+
+        self.job.job_checked += len(batch)
+        self.checkpoint(step, urls[-1])
+
+    def check_changes(self, step):
+        """find the logged changes of the next instance superseded by newer changes of their sample"""
+        stmt = select(ORMInstance).order_by(ORMInstance.instance_id).limit(1)
+        if self.job.job_cursor is not None:
+            stmt = stmt.where(ORMInstance.instance_id > int(self.job.job_cursor))
+        instance = db.session.scalars(stmt).first()
+        if self.retention_seconds <= 0 or instance is None:
+            self.checkpoint(step + 1, None)
+            return
+
+        superseded = instance.superseded_changes(datetime.utcnow() - timedelta(seconds=self.retention_seconds))
+        if not self.job.job_remove:
+            count = db.session.scalar(select(func.count()).select_from(superseded.subquery()))
+        else:
+            # a batch at a time, the instance is checked again until nothing is left
+            ids = db.session.scalars(superseded.limit(self.batch_size)).all()
+            count = len(ids)
+            if count > 0:
+                db.session.execute(delete(ORMSampleChange).where(ORMSampleChange.change_id.in_(ids)))
+                self.job.job_removed += count
+        if count > 0:
+            self.found(SUPERSEDED_CHANGE, {"instance_id": instance.instance_id, "count": count}, count)
+
+        self.job.job_checked += 1
+        if self.job.job_remove and count == self.batch_size:
+            self.checkpoint(step, self.job.job_cursor)
+        else:
+            self.checkpoint(step, str(instance.instance_id))
+
+
+def run_reconcile_job(job_id):
+    """compare the holder rows, the file rows and the blobs and report or remove the orphans.
+
+    Dangling holder rows and unreferenced files are removed in the transaction
+    of their batch, which also checkpoints the progress of the job, so an
+    interrupted job continues with the next batch. Files without a blob are
+    only reported.
+    """
+    if not reconcile_lease.claim(job_id):
+        return
+    job = db.session.get(ORMReconcileJob, job_id)
+
+    try:
+        reconciler = Reconciler(job)
+        while reconciler.step():
+            pass
+
+        job.job_phase = JOB_DONE
+        job.job_last_modified = datetime.utcnow()
+        reconcile_lease.renew(job_id)
+        db.session.commit()
+    except LeaseLost:
+        # the process that took over continues after the last checkpoint
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        reconcile_lease.fail(
+            job_id, {ORMReconcileJob.job_error: str(e)[:500], ORMReconcileJob.job_last_modified: datetime.utcnow()}
+        )
@@ -0,0 +1,222 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import json
+import tarfile
+from io import BytesIO
+from tempfile import TemporaryFile
+from datetime import datetime
+from uuid import uuid4
+from flask import current_app
+from sqlalchemy import select
+from koi_api.orm import db
+from koi_api.orm.sample import ORMSample, ORMSampleData, ORMSampleLabel, ORMSampleTag, ORMAssociationTags
+from koi_api.orm.snapshot import ORMSnapshot, ORMSnapshotShard
+from koi_api.orm.job import JOB_QUEUED, JOB_DONE, JOB_FAILED
+from koi_api.persistence import persistence
+from koi_api.jobs import jobs, JobLease, LeaseLost
+
+
+# number of samples loaded together with their data, labels and tags
+SNAPSHOT_BATCH = 500
+
+# number of finished snapshots kept per instance
+SNAPSHOT_KEEP = 2
+
+snapshot_lease = JobLease(
+    ORMSnapshot.snapshot_id, ORMSnapshot.snapshot_phase, ORMSnapshot.snapshot_owner, ORMSnapshot.snapshot_heartbeat
+)
+
+
+def new_snapshot(instance, version):
+    """create a snapshot of the instance and build it once the session commits"""
+    snapshot = ORMSnapshot()
+    snapshot.snapshot_uuid = uuid4().bytes
+    snapshot.instance = instance
+    snapshot.snapshot_version = version
+    snapshot.snapshot_phase = JOB_QUEUED
+    snapshot.snapshot_created = datetime.utcnow()
+    snapshot.snapshot_samples = 0
+    db.session.add(snapshot)
+    db.session.flush()
+
+    jobs.submit(db.session, build_snapshot, snapshot.snapshot_id)
+    return snapshot
+
+
+def resume_snapshots():
+    for snapshot_id in snapshot_lease.resumable():
+        jobs.start(build_snapshot, snapshot_id)
+
+
+class ShardWriter:
+    """writes sample entries into an uncompressed tar archive in a temporary file.
+    The archive is stored uncompressed too, range requests read from any offset.
+    """
+
+    def __init__(self):
+        self._tmp = TemporaryFile()
+        self._tar = tarfile.open(fileobj=self._tmp, mode="w")
+        self.samples = 0
+
+    def add(self, name, data, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        self._tar.addfile(info, BytesIO(data))
+
+    def size(self):
+        return self._tmp.tell()
+
+    def store(self):
+        """close the archive and hand it to the persistence, returns the file and its size"""
+        self._tar.close()
+        size = self._tmp.tell()
+        self._tmp.seek(0)
+        try:
+            return persistence.store_stream(self._tmp, compress=False), size
+        finally:
+            self._tmp.close()
+
+    def discard(self):
+        self._tmp.close()
+
+
+def sample_batches(instance_id):
+    """yield lists of (sample, data, labels, tags) of all finalized samples, loaded in batches"""
+    stmt = (
+        select(ORMSample)
+        .where(ORMSample.instance_id == instance_id, ORMSample.sample_finalized.is_(True))
+        .order_by(ORMSample.sample_id)
+    )
+    last_id = 0
+    while True:
+        samples = db.session.scalars(stmt.where(ORMSample.sample_id > last_id).limit(SNAPSHOT_BATCH)).all()
+        if len(samples) == 0:
+            return
+        last_id = samples[-1].sample_id
+        ids = [s.sample_id for s in samples]
+
+        data = {i: [] for i in ids}
+        stmt_data = select(ORMSampleData).where(ORMSampleData.sample_id.in_(ids)).order_by(ORMSampleData.data_id)
+        for d in db.session.scalars(stmt_data):
+            data[d.sample_id].append(d)
+
+        labels = {i: [] for i in ids}
+        stmt_labels = select(ORMSampleLabel).where(ORMSampleLabel.sample_id.in_(ids)).order_by(ORMSampleLabel.label_id)
+        for label in db.session.scalars(stmt_labels):
+            labels[label.sample_id].append(label)
+
+        tags = {i: [] for i in ids}
+        stmt_tags = (
+            select(ORMAssociationTags.sample_id, ORMSampleTag.tag_name)
+            .join(ORMSampleTag, ORMSampleTag.tag_id == ORMAssociationTags.tag_id)
+            .where(ORMAssociationTags.sample_id.in_(ids))
+            .order_by(ORMSampleTag.tag_name)
+        )
+        for sample_id, tag_name in db.session.execute(stmt_tags):
+            tags[sample_id].append(tag_name)
+
+        yield [(s, data[s.sample_id], labels[s.sample_id], tags[s.sample_id]) for s in samples]
+
+
+def write_sample(writer, sample, data, labels, tags):
+    """add one sample as <sample_uuid>/meta.json, <sample_uuid>/data/<uuid> and <sample_uuid>/label/<uuid>"""
+    prefix = sample.sample_uuid.hex()
+    mtime = int(sample.sample_last_modified.timestamp())
+    meta = {
+        "sample_uuid": prefix,
+        "tags": tags,
+        "data": [{"uuid": d.data_uuid.hex(), "key": d.data_key} for d in data if d.file is not None],
+        "label": [{"uuid": lb.label_uuid.hex(), "key": lb.label_key} for lb in labels if lb.file is not None],
+    }
+    writer.add(prefix + "/meta.json", json.dumps(meta).encode("utf-8"), mtime)
+    for d in data:
+        if d.file is not None:
+            writer.add(prefix + "/data/" + d.data_uuid.hex(), persistence.get_file(d.file), mtime)
+    for lb in labels:
+        if lb.file is not None:
+            writer.add(prefix + "/label/" + lb.label_uuid.hex(), persistence.get_file(lb.file), mtime)
+    writer.samples += 1
+
+
+def prune_snapshots(instance_id):
+    """remove all but the newest finished snapshots of the instance"""
+    stmt = (
+        select(ORMSnapshot)
+        .where(ORMSnapshot.instance_id == instance_id, ORMSnapshot.snapshot_phase.in_([JOB_DONE, JOB_FAILED]))
+        .order_by(ORMSnapshot.snapshot_id.desc())
+        .offset(SNAPSHOT_KEEP)
+    )
+    for snapshot in db.session.scalars(stmt).all():
+        db.session.delete(snapshot)
+
+
+def build_snapshot(snapshot_id):
+    """pack the finalized samples of the instance into tar archives of at most SNAPSHOT_SHARD_SIZE bytes.
+
+    All samples are read in one transaction, the version of the snapshot is
+    taken from the same transaction so it matches the packed samples.
+    """
+    if not snapshot_lease.claim(snapshot_id):
+        return
+    snapshot = db.session.get(ORMSnapshot, snapshot_id)
+
+    shard_limit = current_app.config["SNAPSHOT_SHARD_SIZE"]
+    stored = []
+    writer = ShardWriter()
+    try:
+        instance = snapshot.instance
+        _, snapshot.snapshot_version = instance.samples_version()
+
+        def finish_shard():
+            file, size = writer.store()
+            stored.append(file)
+            shard = ORMSnapshotShard()
+            shard.shard_index = len(snapshot.shards)
+            shard.shard_size = size
+            shard.shard_samples = writer.samples
+            shard.file = file
+            snapshot.shards.append(shard)
+
+        for batch in sample_batches(instance.instance_id):
+            for entry in batch:
+                write_sample(writer, *entry)
+                snapshot.snapshot_samples += 1
+                if writer.size() >= shard_limit:
+                    finish_shard()
+                    writer = ShardWriter()
+
+        if writer.samples > 0 or len(snapshot.shards) == 0:
+            finish_shard()
+        else:
+            writer.discard()
+
+        snapshot.snapshot_phase = JOB_DONE
+        db.session.flush()
+        prune_snapshots(snapshot.instance_id)
+        # the only checkpoint, a process that took over meanwhile builds its own shards
+        snapshot_lease.renew(snapshot_id)
+        db.session.commit()
+    except Exception as e:
+        writer.discard()
+        db.session.rollback()
+        for file in stored:
+            try:
+                persistence.remove_file(file)
+            except FileNotFoundError:
+                pass
+        if not isinstance(e, LeaseLost):
+            snapshot_lease.fail(snapshot_id, {ORMSnapshot.snapshot_error: str(e)[:500]})
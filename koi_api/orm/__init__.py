@@ -13,11 +13,156 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
+import os
+import random
+import weakref
+from flask import request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, Select
+from koi_api.common.metrics import metrics
 
 
-db = SQLAlchemy()
+# session info keys used while several requests share one transaction
+DEFER_COMMIT = "koi_defer_commit"
+STORED_FILES = "koi_stored_files"
+REMOVED_FILES = "koi_removed_files"
+
+# session info keys of the replica reads of a request go to and whether it wrote already
+READ_REPLICA = "koi_read_replica"
+WROTE = "koi_wrote"
+
+# counter of the requests repeated on the primary because the replica lagged behind
+REPLICA_FALLBACKS = "koi_replica_fallbacks_total"
+
+
+class KoiSession(Session):
+    """Session that only flushes on commit while DEFER_COMMIT is set in its info.
+    The batch endpoint uses this to run several resources in one transaction.
+
+    While READ_REPLICA is set, plain selects go to that engine until the session
+    writes anything, later reads see the writes on the primary.
+    """
+
+    def commit(self):
+        if self.info.get(DEFER_COMMIT, False):
+            self.flush()
+            return
+        super().commit()
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get(READ_REPLICA)
+        if replica is not None and bind is None:
+            if isinstance(clause, Select) and clause._for_update_arg is None and not self.info.get(WROTE, False):
+                return replica
+            self.info[WROTE] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": KoiSession})
+
+
+def engine_options(config):
+    """engine options from the DB_POOL_* keys, explicit SQLALCHEMY_ENGINE_OPTIONS take precedence"""
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    options.setdefault("pool_pre_ping", bool(config["DB_POOL_PRE_PING"]))
+
+    # sqlite uses a pool without size limits
+    if not config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        options.setdefault("pool_size", int(config["DB_POOL_SIZE"]))
+        options.setdefault("max_overflow", int(config["DB_MAX_OVERFLOW"]))
+        options.setdefault("pool_recycle", int(config["DB_POOL_RECYCLE"]))
+        options.setdefault("pool_timeout", float(config["DB_POOL_TIMEOUT"]))
+    return options
+
+
+def pool_status(engine):
+    """statistics of the connection pool of an engine"""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    for stat in ["size", "checkedin", "checkedout", "overflow"]:
+        if hasattr(pool, stat):
+            status[stat] = getattr(pool, stat)()
+    return status
+
+
+class Replicas:
+    """engines of the read replicas of the primary database"""
+
+    def __init__(self):
+        self.engines = []
+
+    @property
+    def fallbacks(self):
+        """number of requests repeated on the primary, summed up over all threads"""
+        return metrics.collect()[0].get((REPLICA_FALLBACKS, ()), 0)
+
+    def fallback(self):
+        """count a request repeated on the primary, without locking like the other metrics"""
+        metrics.inc(REPLICA_FALLBACKS)
+
+    def init_app(self, app):
+        options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        self.engines = [create_engine(uri, **options) for uri in app.config["SQLALCHEMY_REPLICA_URIS"]]
+
+    def choose(self):
+        if len(self.engines) == 0:
+            return None
+        return random.choice(self.engines)
+
+
+replicas = Replicas()
+
+
+@metrics.collector
+def pool_metrics():
+    engines = [(key or "default", engine) for key, engine in db.engines.items()]
+    engines += [("replica" + str(index), engine) for index, engine in enumerate(replicas.engines)]
+    samples = []
+    for key, engine in engines:
+        status = pool_status(engine)
+        if "checkedout" in status:
+            samples.append(("koi_db_pool_checked_out", "gauge", (("bind", key),), status["checkedout"]))
+    return samples
+
+
+def use_replica():
+    """let the reads of GET and HEAD requests go to a replica"""
+    if request.method in ["GET", "HEAD"]:
+        engine = replicas.choose()
+        if engine is not None:
+            db.session.info[READ_REPLICA] = engine
+
+
+def end_replica(exc):
+    db.session.info.pop(READ_REPLICA, None)
+    db.session.info.pop(WROTE, None)
+
+
+# the applications whose engines a forked child process must not share with its parent
+fork_apps = weakref.WeakSet()
+
+
+def dispose_engines():
+    """drop the connections inherited from the parent process, without closing them for the parent"""
+    engines = set(replicas.engines)
+    for app in list(fork_apps):
+        with app.app_context():
+            engines.update(db.engines.values())
+    for engine in engines:
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_engines)
 
 
 def init_app(app):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
     db.init_app(app)
+
+    replicas.init_app(app)
+    app.before_request(use_replica)
+    app.teardown_request(end_replica)
+
+    fork_apps.add(app)
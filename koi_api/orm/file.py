@@ -14,11 +14,19 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 from sqlalchemy.orm import mapped_column
-from sqlalchemy import Integer, String
+from sqlalchemy import Integer, String, LargeBinary, Index
 from koi_api.orm import db
 
 
 class ORMFile(db.Model):
     __tablename__ = "file"
+    # the rows sharing a blob are counted and locked by their url
+    __table_args__ = (Index("idx_file_url", "file_url"),)
     file_id = mapped_column(Integer, primary_key=True, unique=True)
     file_url = mapped_column(String(500))
+
+    # sha256 of the uncompressed content, several rows may share one blob
+    file_digest = mapped_column(String(64))
+
+    # content of small files stored in the row instead of a blob, file_url is None then
+    file_inline = mapped_column(LargeBinary)
@@ -13,9 +13,45 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
-from sqlalchemy.orm import mapped_column, relationship
+from datetime import datetime
+from secrets import token_hex
+from uuid import uuid4
+from sqlalchemy.orm import mapped_column, relationship, aliased
 from sqlalchemy import Integer, String, LargeBinary, Boolean, DateTime, ForeignKey
-from koi_api.orm import db
+from sqlalchemy import select, insert, update, delete, func, literal, exists, case, and_, event
+from koi_api.orm import db, KoiSession
+from koi_api.orm.file import ORMFile
+from koi_api.orm.sample import ORMSample, ORMSampleChange, ORMSampleLabel, ORMSampleTag, ORMAssociationTags
+from koi_api.orm.sample import CHANGE_CREATED, CHANGE_MODIFIED, CHANGE_DELETED
+from koi_api.orm.label_request import ORMLabelRequest
+from koi_api.common.notifier import instance_changed
+
+
+# session info key of the instances whose samples version moves when the session commits
+SAMPLES_CHANGED = "koi_samples_changed"
+
+
+def samples_versions(instances):
+    """get the last-modified date and etag of the samples of many instances with one query.
+
+    The columns are read from the database, the instances of the session may hold
+    values from before the last commit of another request.
+
+    Returns:
+        dict: instance_id -> (last_modified, etag)
+    """
+    stmt = select(
+        ORMInstance.instance_id,
+        ORMInstance.instance_samples_last_modified,
+        ORMInstance.instance_samples_etag,
+        ORMInstance.instance_samples_version,
+    ).where(ORMInstance.instance_id.in_([i.instance_id for i in instances]))
+    return {row[0]: (row[1], row[2] + "-" + str(row[3])) for row in db.session.execute(stmt)}
+
+
+def samples_version_changed(session, instance_id):
+    """move the samples version of the instance once the session commits"""
+    session.info.setdefault(SAMPLES_CHANGED, set()).add(instance_id)
 
 
 class ORMInstance(db.Model):
@@ -30,12 +66,16 @@ class ORMInstance(db.Model):
     instance_uuid = mapped_column(LargeBinary(16))
     instance_finalized = mapped_column(Boolean)
     instance_last_modified = mapped_column(DateTime, nullable=False)
-    instance_samples_last_modified = mapped_column(DateTime, nullable=False)
     instance_etag = mapped_column(String(50))
+
+    # the state of the samples, the version is counted up right before a transaction
+    # changing samples commits, the change log records what changed
+    instance_samples_last_modified = mapped_column(DateTime, nullable=False)
     instance_samples_etag = mapped_column(String(50))
+    instance_samples_version = mapped_column(Integer, nullable=False)
 
     instance_merged_id = mapped_column(Integer, ForeignKey("instance.instance_id"))
-    instance_merged = relationship("ORMInstance")
+    instance_merged = relationship("ORMInstance", remote_side=[instance_id])
 
     # the associated model
     model_id = mapped_column(Integer, ForeignKey("model.model_id"))
@@ -91,6 +131,237 @@ class ORMInstance(db.Model):
 
     tags = relationship("ORMSampleTag", lazy="dynamic")
 
+    # the log of all changes to the samples of this instance
+    sample_changes = relationship(
+        "ORMSampleChange",
+        lazy="dynamic",
+        cascade="all, delete-orphan",
+    )
+
+    def samples_changed(self, *samples, kind=CHANGE_MODIFIED):
+        """record a change of the given samples, the instance row is written right before the commit"""
+        now = datetime.utcnow()
+        for sample in samples:
+            change = ORMSampleChange()
+            change.instance_id = self.instance_id
+            change.sample_uuid = sample.sample_uuid
+            change.change_kind = kind
+            change.change_time = now
+            db.session.add(change)
+        if len(samples) > 0:
+            samples_version_changed(db.session, self.instance_id)
+
+    def samples_changed_where(self, *criteria, kind=CHANGE_MODIFIED):
+        """record a change of all samples of this instance matching the criteria with one statement"""
+        stmt = insert(ORMSampleChange).from_select(
+            ["instance_id", "sample_uuid", "change_kind", "change_time"],
+            select(
+                ORMSample.instance_id,
+                ORMSample.sample_uuid,
+                literal(kind),
+                literal(datetime.utcnow()),
+            ).where(ORMSample.instance_id == self.instance_id, *criteria),
+        )
+        db.session.execute(stmt)
+        instance_changed(db.session, self.instance_id)
+        samples_version_changed(db.session, self.instance_id)
+
+    def changes_since(self, since=None, since_time=None, settled_before=None, limit=None):
+        """collapse the logged changes after a cursor or a point in time into one kind per sample.
+
+        A sample created and modified within the range is reported as created.
+        Changes logged at or after settled_before are left for the next call,
+        they may belong to transactions that did not commit yet.
+
+        Returns:
+            (dict: sample_uuid -> kind, int: cursor of the last change, bool: more changes are left)
+        """
+        stmt = (
+            select(ORMSampleChange.change_id, ORMSampleChange.sample_uuid, ORMSampleChange.change_kind)
+            .where(ORMSampleChange.instance_id == self.instance_id)
+            .order_by(ORMSampleChange.change_id)
+        )
+        if since is not None:
+            stmt = stmt.where(ORMSampleChange.change_id > since)
+        if since_time is not None:
+            stmt = stmt.where(ORMSampleChange.change_time > since_time)
+        if settled_before is not None:
+            stmt = stmt.where(ORMSampleChange.change_time < settled_before)
+        if limit is not None:
+            stmt = stmt.limit(limit + 1)
+        rows = db.session.execute(stmt).all()
+
+        more = limit is not None and len(rows) > limit
+        if more:
+            rows = rows[:limit]
+
+        changes = dict()
+        cursor = since or 0
+        for change_id, sample_uuid, kind in rows:
+            if not (kind == CHANGE_MODIFIED and changes.get(sample_uuid) == CHANGE_CREATED):
+                changes[sample_uuid] = kind
+            cursor = change_id
+        return changes, cursor, more
+
+    def superseded_changes(self, before):
+        """select the ids of the logged changes older than before that a newer change of the same sample supersedes.
+
+        Deleting them keeps the newest change of every sample, so the final kind
+        of a sample in the change feed does not change. A feed resuming from a
+        cursor before a deleted creation reports the sample as modified instead.
+        """
+        newest = (
+            select(ORMSampleChange.sample_uuid, func.max(ORMSampleChange.change_id).label("change_id"))
+            .where(ORMSampleChange.instance_id == self.instance_id)
+            .group_by(ORMSampleChange.sample_uuid)
+            .subquery()
+        )
+        return (
+            select(ORMSampleChange.change_id)
+            .join(
+                newest,
+                and_(
+                    newest.c.sample_uuid == ORMSampleChange.sample_uuid,
+                    ORMSampleChange.change_id < newest.c.change_id,
+                ),
+            )
+            .where(ORMSampleChange.instance_id == self.instance_id, ORMSampleChange.change_time < before)
+        )
+
+    def absorb_samples(self, other):
+        """move all samples of the other instance to this one with a few bulk statements.
+
+        Labels marked as not mergeable and tag associations not marked as mergeable
+        are dropped, the tags are matched by name and the samples receive new uuids. Nothing is committed.
+
+        Returns:
+            int: the number of moved samples
+        """
+        other_samples = select(ORMSample.sample_id).where(ORMSample.instance_id == other.instance_id)
+
+        # drop the labels that must not be merged, the files go through the
+        # session so their blobs are removed as well
+        stmt_files = (
+            select(ORMFile)
+            .join(ORMSampleLabel, ORMSampleLabel.file_id == ORMFile.file_id)
+            .where(ORMSampleLabel.sample_id.in_(other_samples), ORMSampleLabel.mergeable.is_(False))
+        )
+        files = db.session.scalars(stmt_files).all()
+        db.session.execute(
+            delete(ORMSampleLabel)
+            .where(ORMSampleLabel.sample_id.in_(other_samples), ORMSampleLabel.mergeable.is_(False))
+            .execution_options(synchronize_session=False)
+        )
+        for file in files:
+            db.session.delete(file)
+
+        # drop the tag associations that must not be merged
+        db.session.execute(
+            delete(ORMAssociationTags)
+            .where(ORMAssociationTags.sample_id.in_(other_samples), ORMAssociationTags.mergeable.is_not(True))
+            .execution_options(synchronize_session=False)
+        )
+
+        # create the used tags that this instance does not know yet
+        own_tag = aliased(ORMSampleTag)
+        own_tags = select(own_tag.tag_name).where(own_tag.instance_id == self.instance_id)
+        db.session.execute(
+            insert(ORMSampleTag).from_select(
+                ["tag_name", "instance_id"],
+                select(ORMSampleTag.tag_name, literal(self.instance_id))
+                .where(
+                    ORMSampleTag.instance_id == other.instance_id,
+                    ORMSampleTag.tag_name.not_in(own_tags),
+                    exists().where(ORMAssociationTags.tag_id == ORMSampleTag.tag_id),
+                )
+                .distinct(),
+            )
+        )
+
+        # point the remaining associations to the tags of the same name
+        old_tag = aliased(ORMSampleTag)
+        new_tag = aliased(ORMSampleTag)
+        old_name = (
+            select(old_tag.tag_name)
+            .where(old_tag.tag_id == ORMAssociationTags.tag_id)
+            .correlate(ORMAssociationTags)
+            .scalar_subquery()
+        )
+        db.session.execute(
+            update(ORMAssociationTags)
+            .where(
+                ORMAssociationTags.sample_id.in_(other_samples),
+                ORMAssociationTags.tag_id.in_(
+                    select(ORMSampleTag.tag_id).where(ORMSampleTag.instance_id == other.instance_id)
+                ),
+            )
+            .values(
+                tag_id=select(new_tag.tag_id)
+                .where(new_tag.instance_id == self.instance_id, new_tag.tag_name == old_name)
+                .scalar_subquery()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            delete(ORMSampleTag)
+            .where(ORMSampleTag.instance_id == other.instance_id)
+            .execution_options(synchronize_session=False)
+        )
+
+        # transfer the ownership, a new uuid is needed in our hierarchical layout
+        sample_ids = db.session.scalars(other_samples).all()
+        if len(sample_ids) == 0:
+            return 0
+        other.samples_changed_where(kind=CHANGE_DELETED)
+
+        now = datetime.utcnow()
+        moved = [
+            {
+                "sample_id": sample_id,
+                "sample_uuid": uuid4().bytes,
+                "instance_id": self.instance_id,
+                "sample_etag": token_hex(16),
+                "sample_last_modified": now,
+            }
+            for sample_id in sample_ids
+        ]
+        db.session.execute(update(ORMSample), moved)
+        db.session.execute(
+            insert(ORMSampleChange),
+            [
+                {
+                    "instance_id": self.instance_id,
+                    "sample_uuid": sample["sample_uuid"],
+                    "change_kind": CHANGE_CREATED,
+                    "change_time": now,
+                }
+                for sample in moved
+            ],
+        )
+        instance_changed(db.session, self.instance_id)
+        samples_version_changed(db.session, self.instance_id)
+        return len(moved)
+
+    def samples_version(self):
+        """get the last-modified date and etag of the samples of this instance"""
+        return samples_versions([self])[self.instance_id]
+
+    def label_requests_version(self):
+        """version of the set of open label requests, changes whenever a request is added, answered or removed"""
+        stmt = select(
+            func.count(ORMLabelRequest.label_request_id),
+            func.sum(case((ORMLabelRequest.obsolete.is_(True), 0), else_=1)),
+            func.max(ORMLabelRequest.label_request_id),
+        ).where(ORMLabelRequest.label_request_instance_id == self.instance_id)
+        total, open_requests, last_id = db.session.execute(stmt).one()
+        return f"{total}-{open_requests or 0}-{last_id or 0}"
+
+    def etag(self, samples_etag=None):
+        """etag of the instance itself including the state of its samples"""
+        if samples_etag is None:
+            _, samples_etag = self.samples_version()
+        return self.instance_etag + "-" + samples_etag
+
 
 class ORMInstanceInferenceData(db.Model):
     __tablename__ = "inferencedata"
@@ -142,3 +413,28 @@ class ORMInstanceDescriptor(db.Model):
         Integer, ForeignKey("instance.instance_id")
     )
     instance = relationship("ORMInstance", back_populates="instance_descriptors")
+
+
+@event.listens_for(KoiSession, "before_commit")
+def bump_samples_versions(session):
+    """count up the samples version of the instances changed by the transaction.
+
+    The instance rows are written right before the commit, so they stay locked only
+    while committing and the versions move in the order the transactions commit.
+    """
+    changed = session.info.pop(SAMPLES_CHANGED, None)
+    if changed:
+        session.execute(
+            update(ORMInstance)
+            .where(ORMInstance.instance_id.in_(sorted(changed)))
+            .values(
+                instance_samples_version=ORMInstance.instance_samples_version + 1,
+                instance_samples_last_modified=datetime.utcnow(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+
+@event.listens_for(KoiSession, "after_rollback")
+def drop_samples_versions(session):
+    session.info.pop(SAMPLES_CHANGED, None)
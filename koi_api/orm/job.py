@@ -0,0 +1,85 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from sqlalchemy.orm import mapped_column, relationship
+from sqlalchemy import Boolean, Integer, String, Text, LargeBinary, DateTime, ForeignKey
+from koi_api.orm import db
+
+
+# phases of a background job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class ORMMergeJob(db.Model):
+    __tablename__ = "merge_job"
+
+    job_id = mapped_column(Integer, primary_key=True, unique=True)
+    job_uuid = mapped_column(LargeBinary(16))
+
+    job_phase = mapped_column(String(20), nullable=False)
+    job_created = mapped_column(DateTime, nullable=False)
+    job_last_modified = mapped_column(DateTime, nullable=False)
+    job_error = mapped_column(String(500))
+
+    # the process running the job and the last time it reported progress
+    job_owner = mapped_column(String(100))
+    job_heartbeat = mapped_column(DateTime)
+
+    # json list of the uuids of the instances to merge, the job resumes
+    # after the job_processed first entries
+    job_sources = mapped_column(Text, nullable=False)
+    job_total = mapped_column(Integer, nullable=False)
+    job_processed = mapped_column(Integer, nullable=False)
+    job_samples = mapped_column(Integer, nullable=False)
+
+    instance_id = mapped_column(Integer, ForeignKey("instance.instance_id"))
+    instance = relationship("ORMInstance")
+
+
+class ORMReconcileJob(db.Model):
+    __tablename__ = "reconcile_job"
+
+    job_id = mapped_column(Integer, primary_key=True, unique=True)
+    job_uuid = mapped_column(LargeBinary(16))
+
+    job_phase = mapped_column(String(20), nullable=False)
+    job_created = mapped_column(DateTime, nullable=False)
+    job_last_modified = mapped_column(DateTime, nullable=False)
+    job_error = mapped_column(String(500))
+
+    # the process running the job and the last time it reported progress
+    job_owner = mapped_column(String(100))
+    job_heartbeat = mapped_column(DateTime)
+
+    # remove the findings instead of only reporting them
+    job_remove = mapped_column(Boolean, nullable=False)
+
+    # the job resumes in step job_step after the key job_cursor
+    job_step = mapped_column(Integer, nullable=False)
+    job_cursor = mapped_column(String(500))
+
+    job_checked = mapped_column(Integer, nullable=False)
+    job_dangling_rows = mapped_column(Integer, nullable=False)
+    job_unreferenced_files = mapped_column(Integer, nullable=False)
+    job_missing_blobs = mapped_column(Integer, nullable=False)
+    job_orphan_blobs = mapped_column(Integer, nullable=False)
+    job_superseded_changes = mapped_column(Integer, nullable=False)
+    job_removed = mapped_column(Integer, nullable=False)
+
+    # json object with the first findings of each kind
+    job_report = mapped_column(Text, nullable=False)
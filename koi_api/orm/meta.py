@@ -0,0 +1,31 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from sqlalchemy.orm import mapped_column
+from sqlalchemy import String
+from koi_api.orm import db
+
+
+# key of the fingerprint of the roles and users seeded from the config
+META_SEED_FINGERPRINT = "seed_fingerprint"
+
+
+class ORMMeta(db.Model):
+    """key-value store for the state of the server itself"""
+
+    __tablename__ = "meta"
+
+    meta_key = mapped_column(String(100), primary_key=True)
+    meta_value = mapped_column(String(500))
@@ -14,10 +14,16 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 from sqlalchemy.orm import mapped_column, relationship
-from sqlalchemy import Integer, String, LargeBinary, ForeignKey, DateTime, Boolean
+from sqlalchemy import Integer, String, LargeBinary, ForeignKey, DateTime, Boolean, Index
 from koi_api.orm import db
 
 
+# kinds of changes recorded in the sample change log
+CHANGE_CREATED = 0
+CHANGE_MODIFIED = 1
+CHANGE_DELETED = 2
+
+
 class ORMAssociationTags(db.Model):
     __tablename__ = "tags_association"
     assoc_id = mapped_column(Integer, primary_key=True)
@@ -62,24 +68,6 @@ class ORMSample(db.Model):
 
     tags = relationship("ORMAssociationTags", back_populates="sample", lazy="dynamic")
 
-    def purge_for_merge(self):
-        # collect all labels that will be lost ofter merging
-        labels_to_pruge = self.label.filter_by(mergeable=False).all()
-        for label in labels_to_pruge:
-            db.session.delete(label)
-
-        # collect all associations that will be lost after merging
-        tags_assoc_to_prune = self.tags.filter_by(mergeable=False).all()
-        for tag in tags_assoc_to_prune:
-            db.session.delete(tag)
-        db.session.commit()
-
-        # drop all samples that have lost all associations
-        for tag in self.instance.tags:
-            if tag.samples is None:
-                db.session.delete(tag)
-        db.session.commit()
-
 
 class ORMSampleData(db.Model):
     __tablename__ = "sampledata"
@@ -130,3 +118,27 @@ class ORMSampleTag(db.Model):
     instance = relationship("ORMInstance", back_populates="tags")
 
     samples = relationship("ORMAssociationTags", back_populates="tag")
+
+
+class ORMSampleChange(db.Model):
+    """append-only log of the changes to the samples of an instance.
+
+    Writers only insert into this table, so they never lock the instance row.
+    The etag and last-modified date of the sample collection are derived from
+    the newest entry of an instance. Deleted samples stay in the log as tombstones.
+    Entries superseded by a newer entry of the same sample are deleted by
+    reconcile jobs once they are older than CHANGE_LOG_RETENTION_SECONDS.
+    """
+    __tablename__ = "sample_change"
+    __table_args__ = (
+        Index("idx_sample_change_instance_change", "instance_id", "change_id"),
+        Index("idx_sample_change_instance_time", "instance_id", "change_time"),
+    )
+
+    change_id = mapped_column(Integer, primary_key=True, unique=True)
+    instance_id = mapped_column(Integer, ForeignKey("instance.instance_id"))
+
+    # no foreign key, the uuid has to outlive a deleted sample
+    sample_uuid = mapped_column(LargeBinary(16))
+    change_kind = mapped_column(Integer, nullable=False)
+    change_time = mapped_column(DateTime, nullable=False)
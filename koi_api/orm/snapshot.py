@@ -0,0 +1,67 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from sqlalchemy.orm import mapped_column, relationship
+from sqlalchemy import Integer, String, LargeBinary, DateTime, ForeignKey, BigInteger
+from koi_api.orm import db
+
+
+class ORMSnapshot(db.Model):
+    """archive of all finalized samples of an instance at one version of its samples"""
+
+    __tablename__ = "snapshot"
+
+    snapshot_id = mapped_column(Integer, primary_key=True, unique=True)
+    snapshot_uuid = mapped_column(LargeBinary(16))
+
+    # the etag of the samples of the instance this snapshot was built from
+    snapshot_version = mapped_column(String(100), nullable=False)
+    snapshot_phase = mapped_column(String(20), nullable=False)
+    snapshot_created = mapped_column(DateTime, nullable=False)
+    snapshot_samples = mapped_column(Integer, nullable=False)
+    snapshot_error = mapped_column(String(500))
+
+    # the process building the snapshot and the time it started or last reported progress
+    snapshot_owner = mapped_column(String(100))
+    snapshot_heartbeat = mapped_column(DateTime)
+
+    instance_id = mapped_column(Integer, ForeignKey("instance.instance_id"))
+    instance = relationship("ORMInstance")
+
+    shards = relationship(
+        "ORMSnapshotShard",
+        back_populates="snapshot",
+        order_by="ORMSnapshotShard.shard_index",
+        cascade="all, delete-orphan",
+    )
+
+
+class ORMSnapshotShard(db.Model):
+    """one tar archive of a snapshot"""
+
+    __tablename__ = "snapshot_shard"
+
+    shard_id = mapped_column(Integer, primary_key=True, unique=True)
+    shard_index = mapped_column(Integer, nullable=False)
+
+    # uncompressed size of the archive in bytes
+    shard_size = mapped_column(BigInteger, nullable=False)
+    shard_samples = mapped_column(Integer, nullable=False)
+
+    snapshot_id = mapped_column(Integer, ForeignKey("snapshot.snapshot_id"))
+    snapshot = relationship("ORMSnapshot", back_populates="shards")
+
+    file_id = mapped_column(Integer, ForeignKey("file.file_id"))
+    file = relationship("ORMFile", cascade="all, delete")
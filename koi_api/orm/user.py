@@ -14,9 +14,9 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 from sqlalchemy.orm import mapped_column, relationship
-from sqlalchemy import Integer, String, LargeBinary, DateTime, Boolean, ForeignKey, select
+from sqlalchemy import Integer, String, LargeBinary, DateTime, Boolean, ForeignKey, select, union_all, literal
 from koi_api.orm import db
-from koi_api.orm.access import ORMAccessGeneral
+from koi_api.orm.access import ORMAccessGeneral, ORMAccessModel, ORMAccessInstance
 from koi_api.orm.role import ORMUserRoleGeneral
 
 
@@ -100,6 +100,28 @@ class ORMUser(db.Model):
                 return False
         return True
 
+    def permission_fingerprint(self, model=None, instance=None):
+        """identify the roles of this user on the model and instance with one query"""
+        stmts = []
+        if model is not None:
+            stmts.append(
+                select(literal("m"), ORMAccessModel.role_id).where(
+                    ORMAccessModel.user_id == self.user_id,
+                    ORMAccessModel.model_id == model.model_id,
+                )
+            )
+        if instance is not None:
+            stmts.append(
+                select(literal("i"), ORMAccessInstance.role_id).where(
+                    ORMAccessInstance.user_id == self.user_id,
+                    ORMAccessInstance.instance_id == instance.instance_id,
+                )
+            )
+        if len(stmts) == 0:
+            return ""
+        roles = db.session.execute(union_all(*stmts)).all()
+        return ",".join(sorted(kind + str(role_id) for kind, role_id in roles))
+
 
 class ORMToken(db.Model):
     __tablename__ = "token"
@@ -14,7 +14,10 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 from koi_api.persistence.core import PersistenceHandler
-from sqlalchemy import event
+from koi_api.persistence.stats import stats
+from sqlalchemy import event, select, inspect
+from sqlalchemy.orm import object_session
+from koi_api.orm import KoiSession, DEFER_COMMIT, STORED_FILES, REMOVED_FILES
 from koi_api.orm.file import ORMFile
 
 
@@ -34,8 +37,77 @@ persistence = PersistenceSingleton()
 
 @event.listens_for(ORMFile, "after_delete")
 def cascaded_file_remove(mapper, connection, target):
-    persistence.remove_file(target)
+    if target.file_url is None:
+        return
+
+    # keep the blob as long as other entries are linked to it, the locks make a
+    # concurrent link_file of the same blob wait until this transaction ends
+    stmt = select(ORMFile.file_id).where(ORMFile.file_url == target.file_url).limit(1).with_for_update()
+    if connection.scalar(stmt) is not None:
+        return
+
+    session = object_session(target)
+    if session is None:
+        persistence.remove_file(target)
+        return
+    # the transaction may still be rolled back, keep the blob until it commits
+    session.info.setdefault(REMOVED_FILES, []).append(target)
+
+
+@event.listens_for(KoiSession, "after_commit")
+def remove_released_blobs(session):
+    for file in session.info.pop(REMOVED_FILES, []):
+        try:
+            persistence.remove_file(file)
+        except FileNotFoundError:
+            # removed by a concurrent transaction releasing the same blob
+            pass
+
+
+@event.listens_for(KoiSession, "after_rollback")
+def keep_released_blobs(session):
+    session.info.pop(REMOVED_FILES, None)
+
+
+def release_file(session, entry):
+    """delete a replaced file or the row holding it, the blob is removed once the session commits.
+
+    Replacing the file of a relationship only drops the foreign key, without
+    this the old row and its blob would be kept forever.
+    """
+    if entry is not None and inspect(entry).persistent:
+        session.delete(entry)
+
+
+@event.listens_for(KoiSession, "transient_to_pending")
+def track_stored_file(session, target):
+    if isinstance(target, ORMFile) and session.info.get(DEFER_COMMIT, False):
+        session.info.setdefault(STORED_FILES, []).append(target)
+
+
+def begin_deferred(session):
+    """defer all commits of the session until end_deferred is called"""
+    session.info[DEFER_COMMIT] = True
+    session.info[STORED_FILES] = []
+
+
+def end_deferred(session, commit):
+    """commit or roll back everything since begin_deferred and settle the files on disk"""
+    session.info[DEFER_COMMIT] = False
+    stored = session.info.pop(STORED_FILES, [])
+    if commit:
+        # the released blobs are removed after the commit
+        session.commit()
+    else:
+        session.rollback()
+        for file in stored:
+            try:
+                persistence.remove_file(file)
+            except FileNotFoundError:
+                # the resource cleaned up after itself already
+                pass
 
 
 def init_app(app):
     persistence.init_app(app)
+    stats.init_app(app)
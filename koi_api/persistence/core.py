@@ -13,47 +13,256 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
+from sqlalchemy import select, inspect
+from koi_api.orm import db
 from koi_api.orm.file import ORMFile
+from koi_api.persistence.stats import stats, CountingFile, OP_READ, OP_WRITE, OP_REMOVE
+from koi_api.persistence.stats import CODEC_GZIP, CODEC_INLINE, CODEC_RAW
 import gzip
+import hashlib
+import io
+import time
 from uuid import uuid4
 import os
 
 
+# size of the chunks copied when storing a stream
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# suffixes of the urls of gzip compressed blobs and of blobs stored as they are
+GZIP_SUFFIX = ".dat"
+RAW_SUFFIX = ".raw"
+
+
+class MeteredGzipReader(gzip.GzipFile):
+    """reader of a stored file recording the read when closed.
+
+    The time spent in read and seek beyond reading the file is decompression.
+    """
+
+    def __init__(self, path, url):
+        self._url = url
+        self._raw = CountingFile(open(path, "rb"))
+        self._size = 0
+        self._seconds = 0.0
+        super().__init__(filename="", mode="rb", fileobj=self._raw)
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = super().read(size)
+        self._seconds += time.perf_counter() - start
+        self._size += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        start = time.perf_counter()
+        position = super().seek(offset, whence)
+        self._seconds += time.perf_counter() - start
+        return position
+
+    def close(self):
+        if self._raw.closed:
+            return
+        super().close()
+        self._raw.close()
+        stats.record(
+            OP_READ, self._url, self._size, self._raw.bytes, self._raw.seconds, max(0.0, self._seconds - self._raw.seconds)
+        )
+
+
+class MeteredRawReader(io.FileIO):
+    """reader of a blob stored uncompressed recording the read when closed, seeking reads nothing"""
+
+    def __init__(self, path, url):
+        super().__init__(path, "rb")
+        self._url = url
+        self._size = 0
+        self._seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = super().read(size)
+        self._seconds += time.perf_counter() - start
+        self._size += len(data)
+        return data
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        stats.record(OP_READ, self._url, self._size, self._size, self._seconds, codec=CODEC_RAW)
+
+
 class PersistenceHandler:
     def __init__(self):
         self._base_path = None
         self._compress = None
+        self._inline_size = 0
 
     def init_app(self, app):
         base_path = app.config["FILEPERSISTENCE_BASE_URI"]
         compress = app.config["FILEPERSISTENCE_COMPRESS"]
         self._base_path = base_path
         self._compress = compress
+        self._inline_size = app.config["FILEPERSISTENCE_INLINE_SIZE"]
         directory = os.path.dirname(self._base_path)
         if not os.path.exists(directory):
             os.makedirs(directory)
 
+    def store_inline(self, data):
+        """keep small files in the database row, reading them needs no file access"""
+        newFile = ORMFile()
+        newFile.file_inline = data
+        newFile.file_digest = hashlib.sha256(data).hexdigest()
+        stats.record(OP_WRITE, None, len(data), len(data), codec=CODEC_INLINE)
+        return newFile
+
     def get_file(self, file: ORMFile):
+        if file.file_url is None:
+            stats.record(OP_READ, None, len(file.file_inline), len(file.file_inline), codec=CODEC_INLINE)
+            return file.file_inline
+
         path = os.path.join(self._base_path, file.file_url)
 
-        f = gzip.open(path, mode="rb", compresslevel=9)
-        data = f.read()
-        f.close()
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            stored = f.read()
+        read = time.perf_counter()
+        if file.file_url.endswith(RAW_SUFFIX):
+            stats.record(OP_READ, file.file_url, len(stored), len(stored), read - start, codec=CODEC_RAW)
+            return stored
+        data = gzip.decompress(stored)
 
+        stats.record(OP_READ, file.file_url, len(data), len(stored), read - start, time.perf_counter() - read)
         return data
 
+    def open_file(self, file: ORMFile):
+        """open a file for reading in chunks, the caller has to close it"""
+        if file.file_url is None:
+            stats.record(OP_READ, None, len(file.file_inline), len(file.file_inline), codec=CODEC_INLINE)
+            return io.BytesIO(file.file_inline)
+        path = os.path.join(self._base_path, file.file_url)
+        if file.file_url.endswith(RAW_SUFFIX):
+            return MeteredRawReader(path, file.file_url)
+        return MeteredGzipReader(path, file.file_url)
+
     def store_file(self, data):
+        if len(data) < self._inline_size:
+            return self.store_inline(data)
+
         newFile = ORMFile()
 
-        newPath = uuid4().hex + ".dat"
+        newPath = uuid4().hex + GZIP_SUFFIX
         newFile.file_url = newPath
 
+        newFile.file_digest = hashlib.sha256(data).hexdigest()
+
+        path = os.path.join(self._base_path, newPath)
+        start = time.perf_counter()
+        stored = gzip.compress(data, compresslevel=9)
+        compressed = time.perf_counter()
+        with open(path, "wb") as f:
+            f.write(stored)
+
+        stats.record(
+            OP_WRITE, newPath, len(data), len(stored), time.perf_counter() - compressed, compressed - start
+        )
+        return newFile
+
+    def store_stream(self, stream, compress=True):
+        """store the content of a file-like object without reading it into memory at once.
+
+        Without compression the blob can be read from any offset without reading
+        the content before it, for example to answer range requests.
+        """
+        # a stream ending before the inline size is stored inline
+        head = stream.read(self._inline_size) if self._inline_size > 0 else b""
+        if len(head) < self._inline_size:
+            return self.store_inline(head)
+
+        newFile = ORMFile()
+
+        newPath = uuid4().hex + (GZIP_SUFFIX if compress else RAW_SUFFIX)
+        newFile.file_url = newPath
+
+        digest = hashlib.sha256()
+
         path = os.path.join(self._base_path, newPath)
-        f = gzip.open(path, mode="wb", compresslevel=9)
-        f.write(data)
+        raw = CountingFile(open(path, "wb"))
+        f = gzip.GzipFile(filename="", mode="wb", compresslevel=9, fileobj=raw) if compress else raw
+        size = 0
+        seconds = 0.0
+        chunk = head or stream.read(STREAM_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            start = time.perf_counter()
+            f.write(chunk)
+            seconds += time.perf_counter() - start
+            size += len(chunk)
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+        start = time.perf_counter()
         f.close()
+        raw.close()
+        seconds += time.perf_counter() - start
 
+        codec = CODEC_GZIP if compress else CODEC_RAW
+        stats.record(OP_WRITE, newPath, size, raw.bytes, raw.seconds, seconds - raw.seconds, codec=codec)
+        newFile.file_digest = digest.hexdigest()
+        return newFile
+
+    def digest_file(self, file: ORMFile):
+        """compute the digest of a file stored before digests were recorded"""
+        if file.file_url is None:
+            return hashlib.sha256(file.file_inline).hexdigest()
+        digest = hashlib.sha256()
+
+        f = self.open_file(file)
+        chunk = f.read(STREAM_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(STREAM_CHUNK_SIZE)
+        f.close()
+
+        return digest.hexdigest()
+
+    def link_file(self, file: ORMFile):
+        """create a new file entry sharing the blob of an existing one.
+
+        The rows of the blob stay locked until the transaction ends, a concurrent
+        removal of the last of them waits and then sees the new entry. Raises
+        FileNotFoundError if all of them were removed meanwhile.
+        """
+        if file.file_url is not None and inspect(file).persistent:
+            stmt = select(ORMFile.file_id).where(ORMFile.file_url == file.file_url).with_for_update()
+            if len(db.session.scalars(stmt).all()) == 0:
+                raise FileNotFoundError(file.file_url)
+
+        newFile = ORMFile()
+        newFile.file_url = file.file_url
+        newFile.file_digest = file.file_digest
+        newFile.file_inline = file.file_inline
         return newFile
 
     def remove_file(self, file: ORMFile):
-        os.remove(os.path.join(self._base_path, file.file_url))
+        if file.file_url is None:
+            # inline files go with their row
+            return
+        self.remove_blob(file.file_url)
+
+    def remove_blob(self, url):
+        start = time.perf_counter()
+        os.remove(os.path.join(self._base_path, url))
+        stats.record(OP_REMOVE, url, io_seconds=time.perf_counter() - start)
+
+    def has_blob(self, url):
+        return os.path.isfile(os.path.join(self._base_path, url))
+
+    def list_blobs(self, prefix):
+        """get the url and modification time of all blobs whose url starts with prefix, ordered by url"""
+        blobs = []
+        with os.scandir(self._base_path) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.name.endswith((GZIP_SUFFIX, RAW_SUFFIX)) and entry.is_file():
+                    blobs.append((entry.name, entry.stat().st_mtime))
+        blobs.sort()
+        return blobs
@@ -0,0 +1,168 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import current_app, has_app_context
+from koi_api.common.metrics import metrics
+from koi_api.common.string_constants import BODY_ADMIN as BA
+
+# kinds of blob store operations
+OP_READ = "read"
+OP_WRITE = "write"
+OP_REMOVE = "remove"
+
+# blobs are stored gzip compressed, small files uncompressed in the database and
+# blobs read from any offset, like snapshot shards, uncompressed on disk
+CODEC_GZIP = "gzip"
+CODEC_INLINE = "inline"
+CODEC_RAW = "raw"
+
+
+class CountingFile:
+    """file object counting the bytes and the time of the reads and writes of the underlying file"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.raw.read(size)
+        self.seconds += time.perf_counter() - start
+        self.bytes += len(data)
+        return data
+
+    def write(self, data):
+        start = time.perf_counter()
+        written = self.raw.write(data)
+        self.seconds += time.perf_counter() - start
+        self.bytes += len(data)
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class PersistenceStats:
+    """records the blob store operations in the metrics and keeps the last slow ones.
+
+    The time of an operation is split into the file io and the compression,
+    only these count towards the slow thresholds. For a streamed read the time
+    the caller spends between two reads is left out.
+    """
+
+    def __init__(self):
+        self._slow = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self.thresholds = {}
+
+    def init_app(self, app):
+        self.thresholds = {
+            OP_READ: app.config["PERSISTENCE_SLOW_READ_SECONDS"],
+            OP_WRITE: app.config["PERSISTENCE_SLOW_WRITE_SECONDS"],
+            OP_REMOVE: app.config["PERSISTENCE_SLOW_WRITE_SECONDS"],
+        }
+        with self._lock:
+            self._slow = deque(self._slow, maxlen=app.config["PERSISTENCE_SLOW_LOG_SIZE"])
+
+    def record(self, op, url, raw_bytes=0, stored_bytes=0, io_seconds=0.0, codec_seconds=0.0, codec=CODEC_GZIP):
+        labels = (("op", op),)
+        metrics.inc("koi_persistence_operations_total", labels)
+        metrics.observe("koi_persistence_io_seconds", labels, io_seconds)
+        if op == OP_READ:
+            metrics.inc("koi_persistence_read_bytes_total", (("codec", codec),), raw_bytes)
+            metrics.inc("koi_persistence_stored_read_bytes_total", (("codec", codec),), stored_bytes)
+            metrics.observe("koi_persistence_codec_seconds", (("op", "decompress"), ("codec", codec)), codec_seconds)
+        elif op == OP_WRITE:
+            metrics.inc("koi_persistence_written_bytes_total", (("codec", codec),), raw_bytes)
+            metrics.inc("koi_persistence_stored_written_bytes_total", (("codec", codec),), stored_bytes)
+            metrics.observe("koi_persistence_codec_seconds", (("op", "compress"), ("codec", codec)), codec_seconds)
+
+        seconds = io_seconds + codec_seconds
+        threshold = self.thresholds.get(op)
+        if threshold is None or seconds < threshold:
+            return
+
+        metrics.inc("koi_persistence_slow_operations_total", labels)
+        entry = {
+            BA.PERSISTENCE_OP: op,
+            BA.PERSISTENCE_FILE: url,
+            BA.PERSISTENCE_SECONDS: seconds,
+            BA.PERSISTENCE_IO_SECONDS: io_seconds,
+            BA.PERSISTENCE_CODEC_SECONDS: codec_seconds,
+            BA.PERSISTENCE_RAW_BYTES: raw_bytes,
+            BA.PERSISTENCE_STORED_BYTES: stored_bytes,
+            BA.PERSISTENCE_TIME: datetime.utcnow(),
+        }
+        with self._lock:
+            self._slow.append(entry)
+        if has_app_context():
+            current_app.logger.warning(
+                "slow persistence %s of %s: %.3fs (io %.3fs, %s %.3fs), %d bytes, %d stored",
+                op,
+                url,
+                seconds,
+                io_seconds,
+                codec,
+                codec_seconds,
+                raw_bytes,
+                stored_bytes,
+            )
+
+    def slow(self):
+        with self._lock:
+            return list(self._slow)
+
+    def summary(self):
+        """totals per operation and compression ratios per codec from the metrics of the process"""
+        counters, histograms = metrics.collect()
+
+        def total(name, labels):
+            hist = histograms.get((name, labels))
+            if hist is not None:
+                return hist[-2]
+            return counters.get((name, labels), 0)
+
+        operations = dict()
+        for op in [OP_READ, OP_WRITE, OP_REMOVE]:
+            labels = (("op", op),)
+            operations[op] = {
+                BA.PERSISTENCE_COUNT: total("koi_persistence_operations_total", labels),
+                BA.PERSISTENCE_SLOW_COUNT: total("koi_persistence_slow_operations_total", labels),
+                BA.PERSISTENCE_IO_SECONDS: total("koi_persistence_io_seconds", labels),
+            }
+
+        codecs = dict()
+        for codec in sorted({dict(labels)["codec"] for _, labels in counters if "codec" in dict(labels)}):
+            labels = (("codec", codec),)
+            raw = total("koi_persistence_written_bytes_total", labels)
+            stored = total("koi_persistence_stored_written_bytes_total", labels)
+            codecs[codec] = {
+                BA.PERSISTENCE_READ_BYTES: total("koi_persistence_read_bytes_total", labels),
+                BA.PERSISTENCE_STORED_READ_BYTES: total("koi_persistence_stored_read_bytes_total", labels),
+                BA.PERSISTENCE_WRITTEN_BYTES: raw,
+                BA.PERSISTENCE_STORED_WRITTEN_BYTES: stored,
+                BA.PERSISTENCE_RATIO: raw / stored if stored > 0 else None,
+                BA.PERSISTENCE_COMPRESS_SECONDS: total("koi_persistence_codec_seconds", (("op", "compress"),) + labels),
+                BA.PERSISTENCE_DECOMPRESS_SECONDS: total("koi_persistence_codec_seconds", (("op", "decompress"),) + labels),
+            }
+        return operations, codecs
+
+
+stats = PersistenceStats()
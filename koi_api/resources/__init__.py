@@ -32,9 +32,11 @@ from koi_api.resources.instance import (
     APIInstanceDescriptorCollection,
     APIInstanceDescriptorFile,
     APIInstanceMerge,
+    APIInstanceMergeJob,
 )
 from koi_api.resources.sample import (
     APISample,
+    APISampleChanges,
     APISampleCollection,
     APISampleData,
     APISampleDataFile,
@@ -42,8 +44,10 @@ from koi_api.resources.sample import (
     APISampleDataCollection,
     APISampleLabel,
     APISampleLabelCollection,
+    APISampleUpload,
+    APISampleFinalize,
 )
-from koi_api.resources.sample_tags import APISampleTag, APISampleTagCollection
+from koi_api.resources.sample_tags import APISampleTag, APISampleTagCollection, APISampleTagBulk
 from koi_api.resources.instance_tags import APIInstanceTag
 from koi_api.resources.access import (
     APIGeneralAccess,
@@ -67,8 +71,20 @@ from koi_api.resources.parameters import (
     APIModelParameter,
     APIModelParameterCollection,
 )
-from koi_api.resources.label_request import APILabelRequest, APILabelRequestCollection
+from koi_api.resources.label_request import APILabelRequest, APILabelRequestCollection, APILabelRequestBulk
+from koi_api.resources.snapshot import APIInstanceSnapshot, APIInstanceSnapshotShard
+from koi_api.resources.notify import APIInstanceNotify
+from koi_api.resources.admin import (
+    APIAdminPool,
+    APIAdminPersistence,
+    APIAdminProfile,
+    APIAdminProfileCollection,
+    APIAdminReconcile,
+    APIAdminReconcileJob,
+)
+from koi_api.resources.metrics import APIMetrics
 from koi_api.resources.health import APIHealth
+from koi_api.resources.batch import APIBatch
 
 
 api = Api()
@@ -112,6 +128,19 @@ def init_app(app):
         APIInstanceMerge,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/merge",
     )
+    api.add_resource(
+        APIInstanceMergeJob,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/merge/<string:job_uuid>",
+    )
+    api.add_resource(
+        APIInstanceSnapshot,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/snapshot",
+    )
+    api.add_resource(
+        APIInstanceSnapshotShard,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/snapshot/<string:snapshot_uuid>"
+        "/shard/<int:shard_index>",
+    )
     api.add_resource(
         APIInstanceTrainingData,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/training",
@@ -150,11 +179,34 @@ def init_app(app):
         APISample,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/sample",
     )
+    api.add_resource(
+        APISampleChanges,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/changes",
+    )
+    api.add_resource(
+        APIInstanceNotify,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/notify",
+    )
     api.add_resource(
         APISampleCollection,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/sample/<string:sample_uuid>",
     )
 
+    api.add_resource(
+        APISampleUpload,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/sample_upload",
+    )
+
+    api.add_resource(
+        APISampleFinalize,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/sample_finalize",
+    )
+
+    api.add_resource(
+        APISampleTagBulk,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/sample_tags",
+    )
+
     api.add_resource(
         APISampleTag,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/sample/<string:sample_uuid>/tags",
@@ -204,6 +256,10 @@ def init_app(app):
         APILabelRequest,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/label_request",
     )
+    api.add_resource(
+        APILabelRequestBulk,
+        "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/label_request_bulk",
+    )
     api.add_resource(
         APILabelRequestCollection,
         "/api/model/<string:model_uuid>/instance/<string:instance_uuid>/label_request/<string:request_uuid>",
@@ -226,4 +282,12 @@ def init_app(app):
     )
 
     api.add_resource(APIHealth, "/health")
+    api.add_resource(APIMetrics, "/metrics")
+    api.add_resource(APIBatch, "/api/batch")
+    api.add_resource(APIAdminPool, "/api/admin/pool")
+    api.add_resource(APIAdminPersistence, "/api/admin/persistence")
+    api.add_resource(APIAdminProfile, "/api/admin/profile")
+    api.add_resource(APIAdminProfileCollection, "/api/admin/profile/<int:profile_id>")
+    api.add_resource(APIAdminReconcile, "/api/admin/reconcile")
+    api.add_resource(APIAdminReconcileJob, "/api/admin/reconcile/<string:job_uuid>")
     api.init_app(app)
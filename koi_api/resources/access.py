@@ -48,9 +48,9 @@ class APIGeneralAccess(BaseResource):
 
         response = [
             {
-                BA.ACCESS_UUID: UUID(bytes=acc.access_uuid).hex,
-                BU.USER_UUID: UUID(bytes=acc.user.user_uuid).hex,
-                BR.ROLE_UUID: UUID(bytes=acc.role.role_uuid).hex,
+                BA.ACCESS_UUID: acc.access_uuid.hex(),
+                BU.USER_UUID: acc.user.user_uuid.hex(),
+                BR.ROLE_UUID: acc.role.role_uuid.hex(),
             }
             for acc in granted_users
         ]
@@ -118,8 +118,8 @@ class APIGeneralAccess(BaseResource):
 
         response = {
             BA.ACCESS_UUID: new_uuid.hex,
-            BR.ROLE_UUID: UUID(bytes=query_role.role_uuid).hex,
-            BU.USER_UUID: UUID(bytes=query_user.user_uuid).hex,
+            BR.ROLE_UUID: query_role.role_uuid.hex(),
+            BU.USER_UUID: query_user.user_uuid.hex(),
         }
 
         return SUCCESS(response)
@@ -150,9 +150,9 @@ class APIGeneralAccessCollection(BaseResource):
         query_role = access.role
 
         response = {
-            BA.ACCESS_UUID: UUID(bytes=access.access_uuid).hex,
-            BU.USER_UUID: UUID(bytes=query_user.user_uuid).hex,
-            BR.ROLE_UUID: UUID(bytes=query_role.role_uuid).hex,
+            BA.ACCESS_UUID: access.access_uuid.hex(),
+            BU.USER_UUID: query_user.user_uuid.hex(),
+            BR.ROLE_UUID: query_role.role_uuid.hex(),
         }
 
         return SUCCESS(response)
@@ -196,9 +196,9 @@ class APIModelAccess(BaseResource):
 
         response = [
             {
-                BA.ACCESS_UUID: UUID(bytes=ar.access_uuid).hex,
-                BU.USER_UUID: UUID(bytes=ar.user.user_uuid).hex,
-                BR.ROLE_UUID: UUID(bytes=ar.role.role_uuid).hex,
+                BA.ACCESS_UUID: ar.access_uuid.hex(),
+                BU.USER_UUID: ar.user.user_uuid.hex(),
+                BR.ROLE_UUID: ar.role.role_uuid.hex(),
             }
             for ar in access_rights
         ]
@@ -268,8 +268,8 @@ class APIModelAccess(BaseResource):
 
         response = {
             BA.ACCESS_UUID: new_uuid.hex,
-            BU.USER_UUID: UUID(bytes=granted_user.user_uuid).hex,
-            BR.ROLE_UUID: UUID(bytes=role.role_uuid).hex,
+            BU.USER_UUID: granted_user.user_uuid.hex(),
+            BR.ROLE_UUID: role.role_uuid.hex(),
         }
         return SUCCESS(response)
 
@@ -301,9 +301,9 @@ class APIModelAccessCollection(BaseResource):
 
         # build the response
         response = {
-            BA.ACCESS_UUID: UUID(bytes=access.access_uuid).hex,
-            BU.USER_UUID: UUID(bytes=access.user.user_uuid).hex,
-            BR.ROLE_UUID: UUID(bytes=access.role.role_uuid).hex,
+            BA.ACCESS_UUID: access.access_uuid.hex(),
+            BU.USER_UUID: access.user.user_uuid.hex(),
+            BR.ROLE_UUID: access.role.role_uuid.hex(),
         }
         return SUCCESS(response)
 
@@ -356,9 +356,9 @@ class APIInstanceAccess(BaseResource):
 
         response = [
             {
-                BA.ACCESS_UUID: UUID(bytes=acc.access_uuid).hex,
-                BU.USER_UUID: UUID(bytes=acc.user.user_uuid).hex,
-                BR.ROLE_UUID: UUID(bytes=acc.role.role_uuid).hex,
+                BA.ACCESS_UUID: acc.access_uuid.hex(),
+                BU.USER_UUID: acc.user.user_uuid.hex(),
+                BR.ROLE_UUID: acc.role.role_uuid.hex(),
             }
             for acc in granted_users
         ]
@@ -461,9 +461,9 @@ class APIInstanceAccessCollection(BaseResource):
 
         # construct the response
         response = {
-            BA.ACCESS_UUID: UUID(bytes=access.access_uuid).hex,
-            BU.USER_UUID: UUID(bytes=access.user.user_uuid).hex,
-            BR.ROLE_UUID: UUID(bytes=access.role.role_uuid).hex,
+            BA.ACCESS_UUID: access.access_uuid.hex(),
+            BU.USER_UUID: access.user.user_uuid.hex(),
+            BR.ROLE_UUID: access.role.role_uuid.hex(),
         }
 
         return SUCCESS(response)
@@ -0,0 +1,297 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import json
+import os
+from uuid import UUID
+from flask import Response, request
+from sqlalchemy import select
+from koi_api.orm import db, pool_status, replicas
+from koi_api.orm.job import ORMReconcileJob, JOB_QUEUED, JOB_RUNNING
+from koi_api.jobs.reconcile import new_reconcile_job
+from koi_api.resources.base import BaseResource, authenticated, user_access, json_request, paged, ADMIN_RIGHTS
+from koi_api.common.profiler import profiler, dump, render
+from koi_api.persistence.stats import stats
+from koi_api.common.return_codes import ERR_BADR, ERR_FORB, ERR_NOFO, SUCCESS
+from koi_api.common.string_constants import BODY_ADMIN as BA, BODY_JOB as BJ
+
+# orders of the text output of a profile, see pstats.SortKey
+PROFILE_SORTS = ["cumulative", "tottime", "calls", "ncalls", "time", "name", "filename"]
+
+
+def profile_body(entry):
+    return {
+        BA.PROFILE_ID: entry["id"],
+        BA.PROFILE_RESOURCE: entry["resource"],
+        BA.PROFILE_METHOD: entry["method"],
+        BA.PROFILE_PATH: entry["path"],
+        BA.PROFILE_STATUS: entry["status"],
+        BA.PROFILE_DURATION: entry["duration"],
+        BA.PROFILE_QUERIES: entry["queries"],
+        BA.PROFILE_TRIGGER: entry["trigger"],
+        BA.PROFILE_CREATED: entry["created"].isoformat(),
+    }
+
+
+def reconcile_job_body(job):
+    return {
+        BJ.JOB_UUID: job.job_uuid.hex(),
+        BJ.JOB_PHASE: job.job_phase,
+        BA.RECONCILE_REMOVE: job.job_remove,
+        BA.RECONCILE_STEP: job.job_step,
+        BA.RECONCILE_CHECKED: job.job_checked,
+        BA.RECONCILE_DANGLING_ROWS: job.job_dangling_rows,
+        BA.RECONCILE_UNREFERENCED_FILES: job.job_unreferenced_files,
+        BA.RECONCILE_MISSING_BLOBS: job.job_missing_blobs,
+        BA.RECONCILE_ORPHAN_BLOBS: job.job_orphan_blobs,
+        BA.RECONCILE_SUPERSEDED_CHANGES: job.job_superseded_changes,
+        BA.RECONCILE_REMOVED: job.job_removed,
+        BA.RECONCILE_REPORT: json.loads(job.job_report),
+        BJ.JOB_ERROR: job.job_error,
+        BJ.JOB_CREATED: job.job_created.isoformat(),
+        BJ.JOB_LAST_MODIFIED: job.job_last_modified.isoformat(),
+    }
+
+
+class APIAdminPool(BaseResource):
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def get(self, me):
+        """Get the statistics of the connection pools of the process answering the request"""
+        pools = {key or "default": pool_status(engine) for key, engine in db.engines.items()}
+        for index, engine in enumerate(replicas.engines):
+            pools["replica" + str(index)] = pool_status(engine)
+        return SUCCESS(
+            {
+                BA.ADMIN_PID: os.getpid(),
+                BA.ADMIN_POOLS: pools,
+                BA.ADMIN_REPLICA_FALLBACKS: replicas.fallbacks,
+            }
+        )
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def post(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def put(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def delete(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
+class APIAdminPersistence(BaseResource):
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def get(self, me):
+        """Get the file operations of the process answering the request.
+
+        Returns the count, the slow count and the io time per operation, the
+        raw and stored bytes, the compression ratio and the compression time
+        per codec, the slow thresholds and the last slow operations.
+        """
+        operations, codecs = stats.summary()
+        slow = [{**entry, BA.PERSISTENCE_TIME: entry[BA.PERSISTENCE_TIME].isoformat()} for entry in stats.slow()]
+        return SUCCESS(
+            {
+                BA.ADMIN_PID: os.getpid(),
+                BA.PERSISTENCE_OPERATIONS: operations,
+                BA.PERSISTENCE_CODECS: codecs,
+                BA.PERSISTENCE_THRESHOLDS: stats.thresholds,
+                BA.PERSISTENCE_SLOW: slow,
+            }
+        )
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def post(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def put(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def delete(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
+class APIAdminProfile(BaseResource):
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def get(self, me):
+        """Get the request profiles kept by the process answering the request, the newest first"""
+        return SUCCESS([profile_body(entry) for entry in reversed(profiler.profiles())])
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def post(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def put(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def delete(self, me):
+        """Drop all profiles of the process answering the request"""
+        profiler.clear()
+        return SUCCESS()
+
+
+class APIAdminProfileCollection(BaseResource):
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def get(self, me, profile_id):
+        """Download a profile.
+
+        By default the profile is sent in the binary format of pstats, e.g. for
+        pstats.Stats(path) or snakeviz. With format=text the pstats table is
+        sent, ordered by sort (default cumulative) and cut after limit rows.
+        """
+        entry = profiler.get(profile_id)
+        if entry is None:
+            return ERR_NOFO("profile unknown")
+
+        if request.args.get(BA.PROFILE_FORMAT) == "text":
+            sort = request.args.get(BA.PROFILE_SORT, "cumulative")
+            if sort not in PROFILE_SORTS:
+                return ERR_BADR("illegal param: " + BA.PROFILE_SORT)
+            try:
+                limit = int(request.args.get(BA.PROFILE_LIMIT, 50))
+            except ValueError:
+                return ERR_BADR("illegal param: " + BA.PROFILE_LIMIT)
+            return Response(render(entry, sort, limit), mimetype="text/plain")
+
+        rsp = Response(dump(entry), mimetype="application/octet-stream")
+        rsp.headers["Content-Disposition"] = "attachment; filename=profile-%d.prof" % profile_id
+        return rsp
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def post(self, me, profile_id):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def put(self, me, profile_id):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def delete(self, me, profile_id):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
+class APIAdminReconcile(BaseResource):
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    @paged
+    def get(self, me, page_offset, page_limit):
+        """List the reconcile jobs, the newest first"""
+        stmt = select(ORMReconcileJob).order_by(ORMReconcileJob.job_id.desc()).offset(page_offset).limit(page_limit)
+        jobs = db.session.scalars(stmt).all()
+
+        return SUCCESS([reconcile_job_body(job) for job in jobs])
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    @json_request
+    def post(self, me, json_object):
+        """Submit a job comparing the file table with the blobs and return its state.
+
+        The job reports holder rows and files no longer referenced, files
+        without a blob, blobs without a file and logged sample changes
+        superseded by a newer change of their sample. With remove set to true
+        all but the files without a blob are removed.
+        """
+        if not isinstance(json_object, dict) or not isinstance(json_object.get(BA.RECONCILE_REMOVE, False), bool):
+            return ERR_BADR("illegal field: " + BA.RECONCILE_REMOVE)
+
+        stmt = select(ORMReconcileJob.job_id).where(ORMReconcileJob.job_phase.in_([JOB_QUEUED, JOB_RUNNING]))
+        if db.session.scalars(stmt).first() is not None:
+            return ERR_BADR("a reconcile job is running already")
+
+        job = new_reconcile_job(json_object.get(BA.RECONCILE_REMOVE, False))
+        db.session.commit()
+
+        return SUCCESS(reconcile_job_body(job))
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def put(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def delete(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
+class APIAdminReconcileJob(BaseResource):
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def get(self, me, job_uuid):
+        """Report the phase, progress and findings of a reconcile job"""
+        try:
+            job_uuid = UUID(job_uuid).bytes
+        except ValueError:
+            return ERR_BADR("job_uuid malformed")
+        stmt = select(ORMReconcileJob).where(ORMReconcileJob.job_uuid == job_uuid)
+        job = db.session.scalars(stmt).one_or_none()
+        if job is None:
+            return ERR_NOFO("job unknown")
+
+        return SUCCESS(reconcile_job_body(job))
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def post(self, me, job_uuid):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def put(self, me, job_uuid):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @user_access(ADMIN_RIGHTS)
+    def delete(self, me, job_uuid):
+        """Forbidden action"""
+        return ERR_FORB()
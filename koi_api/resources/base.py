@@ -13,13 +13,14 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
+from flask import g, Response, current_app
 from flask_restful import Resource, request
 from datetime import datetime, timedelta
 import functools
 import re
 from uuid import UUID
-from sqlalchemy import select
-from koi_api.orm import db
+from sqlalchemy import select, inspect
+from koi_api.orm import db, replicas, DEFER_COMMIT, READ_REPLICA
 from koi_api.orm.user import ORMToken, ORMUser
 from koi_api.orm.model import ORMModel
 from koi_api.orm.instance import ORMInstance, ORMInstanceDescriptor
@@ -33,13 +34,70 @@ from koi_api.common.string_constants import (
     BODY_USER as BU,
     BODY_MODEL as BM,
     BODY_INSTANCE as BI,
+    BODY_ROLE as BR,
 )
 from koi_api.common.return_codes import ERR_AUTH, SUCCESS, ERR_BADR, ERR_FORB, ERR_NOFO
+from koi_api.common.response_cache import cache, valid_seconds
+from koi_api.common.profiler import profiler, TRIGGER_HEADER
+
+
+# names in flask.g used to share state between the sub-requests of a batch
+BATCH_USER = "koi_batch_user"
+BATCH_CACHE = "koi_batch_cache"
+
+
+def batch_cached(key, load):
+    """resolve an object only once for all sub-requests of a batch.
+    Outside of a batch, load is called every time.
+    """
+    cache = g.get(BATCH_CACHE)
+    if cache is None:
+        return load()
+    obj = cache.get(key)
+    if obj is not None:
+        state = inspect(obj)
+        if not (state.deleted or state.was_deleted):
+            return obj
+    obj = load()
+    if obj is not None:
+        cache[key] = obj
+    return obj
+
+
+# status codes of reads from a replica that are repeated on the primary
+REPLICA_RETRY = [401, 404]
+
+# general rights needed for the server administration endpoints and for profiling requests
+ADMIN_RIGHTS = [BR.ROLE_EDIT_USERS, BR.ROLE_EDIT_ROLES]
 
 
 class BaseResource(Resource):
     MAX_PAGE = 100
 
+    def dispatch_request(self, *args, **kwargs):
+        trigger = profiler.trigger()
+        if trigger == TRIGGER_HEADER and not self.is_admin():
+            trigger = None
+        if trigger is None:
+            return self.dispatch_replica(*args, **kwargs)
+        return profiler.run(lambda: self.dispatch_replica(*args, **kwargs), type(self).__name__, trigger)
+
+    def dispatch_replica(self, *args, **kwargs):
+        rsp = super().dispatch_request(*args, **kwargs)
+
+        # the replica may not have received a new token or resource yet
+        if (
+            isinstance(rsp, Response)
+            and rsp.status_code in REPLICA_RETRY
+            and READ_REPLICA in db.session.info
+            and current_app.config["REPLICA_FALLBACK"]
+        ):
+            db.session.rollback()
+            db.session.info.pop(READ_REPLICA)
+            replicas.fallback()
+            rsp = super().dispatch_request(*args, **kwargs)
+        return rsp
+
     def check_token(self, token_value):
         # get the token with the matching value
         stmt = select(ORMToken).where(ORMToken.token_value == token_value)
@@ -59,7 +117,15 @@ class BaseResource(Resource):
                 # the token is valid, so the user is authenticated
                 return True, token.user, False
 
+    def is_admin(self):
+        auth, _, me = self.authenticate()
+        return auth and me.has_rights(ADMIN_RIGHTS)
+
     def authenticate(self):
+        if BATCH_USER in g:
+            # the batch request authenticated the user already
+            return True, SUCCESS(), g.get(BATCH_USER)
+
         token_value = None
         if HEADER_TOKEN in request.headers:
             # parse the token representation from the header
@@ -162,7 +228,10 @@ def model_access(rights):
             stmt_model = select(ORMModel).where(
                 ORMModel.model_uuid == UUID(kwargs[BM.MODEL_UUID]).bytes
             )
-            model = db.session.scalars(stmt_model).one_or_none()
+            model = batch_cached(
+                (ORMModel, kwargs[BM.MODEL_UUID]),
+                lambda: db.session.scalars(stmt_model).one_or_none(),
+            )
 
             if model is None:
                 return ERR_NOFO("model unknown")
@@ -196,7 +265,10 @@ def instance_access(rights):
                 ORMInstance.instance_uuid == UUID(kwargs[BI.INSTANCE_UUID]).bytes,
                 ORMInstance.model_id == model.model_id,
             )
-            instance = db.session.scalars(stmt_inst).one_or_none()
+            instance = batch_cached(
+                (ORMInstance, model.model_id, kwargs[BI.INSTANCE_UUID]),
+                lambda: db.session.scalars(stmt_inst).one_or_none(),
+            )
 
             if instance is None:
                 return ERR_NOFO("instance unknown")
@@ -342,6 +414,45 @@ def descriptor_access(func):
     return wrapperD
 
 
+def cached_response(version):
+    """serve a GET from the response cache as long as the parent resource is unchanged.
+    The cache key consists of the path, the query, the parent version and the roles of the caller.
+
+    Args:
+        version (function): called with the arguments of the handler, returns the etag of the parent
+    """
+
+    def inner(func):
+        @functools.wraps(func)
+        def wrapperC(self, *args, **kwargs):
+            # uncommitted state of a batch must not leak into the cache
+            if not cache.enabled or db.session.info.get(DEFER_COMMIT, False):
+                return func(self, *args, **kwargs)
+
+            key = (
+                request.path,
+                request.query_string,
+                version(**kwargs),
+                kwargs["me"].permission_fingerprint(kwargs.get("model"), kwargs.get("instance")),
+            )
+            entry = cache.get(key)
+            if entry is not None:
+                body, headers, valid = entry
+                rsp = Response(body, 200, headers)
+                rsp.expires = datetime.utcnow() + timedelta(seconds=valid)
+                return rsp.make_conditional(request.environ)
+
+            rsp = func(self, *args, **kwargs)
+            if rsp.status_code == 200:
+                headers = [(k, v) for k, v in rsp.headers.items() if k not in ["Expires", "Content-Length"]]
+                cache.put(key, rsp.get_data(), headers, valid_seconds(rsp, datetime.utcnow()))
+            return rsp
+
+        return wrapperC
+
+    return inner
+
+
 def json_request(func):
     @functools.wraps(func)
     def wrapperJ(self, *args, **kwargs):
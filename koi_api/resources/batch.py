@@ -0,0 +1,129 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from flask import current_app, g
+from base64 import b64decode, b64encode
+from binascii import Error as B64Error
+from urllib.parse import urlsplit
+from werkzeug.exceptions import HTTPException
+from koi_api.resources.base import BaseResource, authenticated, json_request, BATCH_USER, BATCH_CACHE
+from koi_api.orm import db
+from koi_api.persistence import begin_deferred, end_deferred
+from koi_api.common.string_constants import BODY_BATCH as BB
+from koi_api.common.return_codes import ERR_BADR, ERR_FORB, SUCCESS
+
+BATCH_METHODS = ["GET", "POST", "PUT", "DELETE"]
+
+
+class APIBatch(BaseResource):
+    MAX_REQUESTS = 100
+
+    @authenticated
+    @json_request
+    def post(self, me, json_object):
+        """Run an ordered list of sub-requests in one transaction.
+
+        Each sub-request names a method, a path below /api and either a json body
+        or base64 encoded raw data. The user is authenticated once and the resolved
+        models and instances are shared between the sub-requests. The first failing
+        sub-request rolls back all previous ones.
+        """
+        if not isinstance(json_object, dict) or not isinstance(json_object.get(BB.BATCH_REQUESTS), list):
+            return ERR_BADR("missing field: " + BB.BATCH_REQUESTS)
+        operations = json_object[BB.BATCH_REQUESTS]
+        if len(operations) > APIBatch.MAX_REQUESTS:
+            return ERR_BADR("too many requests in batch")
+
+        # check all operations before anything is executed
+        adapter = current_app.url_map.bind("")
+        for op in operations:
+            if not isinstance(op, dict) or op.get(BB.BATCH_METHOD) not in BATCH_METHODS:
+                return ERR_BADR("illegal method")
+            if not isinstance(op.get(BB.BATCH_PATH), str):
+                return ERR_BADR("missing field: " + BB.BATCH_PATH)
+            if BB.BATCH_BODY in op and BB.BATCH_DATA in op:
+                return ERR_BADR("either body or data expected")
+            try:
+                endpoint, _ = adapter.match(urlsplit(op[BB.BATCH_PATH]).path, op[BB.BATCH_METHOD])
+            except HTTPException:
+                return ERR_BADR("unknown path: " + op[BB.BATCH_PATH])
+            if endpoint == self.endpoint:
+                return ERR_BADR("batches can not be nested")
+
+        g.setdefault(BATCH_USER, me)
+        g.setdefault(BATCH_CACHE, dict())
+        begin_deferred(db.session)
+        results = []
+        try:
+            for op in operations:
+                result = self.dispatch_operation(adapter, op)
+                results.append(result)
+                if result[BB.BATCH_STATUS] >= 400:
+                    end_deferred(db.session, commit=False)
+                    return ERR_BADR(results)
+        except BaseException:
+            end_deferred(db.session, commit=False)
+            raise
+        finally:
+            g.pop(BATCH_USER, None)
+            g.pop(BATCH_CACHE, None)
+
+        end_deferred(db.session, commit=True)
+        return SUCCESS(results)
+
+    def dispatch_operation(self, adapter, op):
+        url = urlsplit(op[BB.BATCH_PATH])
+        endpoint, view_args = adapter.match(url.path, op[BB.BATCH_METHOD])
+
+        context = {"method": op[BB.BATCH_METHOD], "query_string": url.query}
+        if BB.BATCH_BODY in op:
+            context["json"] = op[BB.BATCH_BODY]
+        elif BB.BATCH_DATA in op:
+            try:
+                context["data"] = b64decode(op[BB.BATCH_DATA], validate=True)
+            except (B64Error, TypeError):
+                return {BB.BATCH_STATUS: 400, BB.BATCH_BODY: "malformed data"}
+
+        # the request context shares the app context and therefore g and the session
+        with current_app.test_request_context(url.path, **context):
+            try:
+                rsp = current_app.view_functions[endpoint](**view_args)
+            except HTTPException as e:
+                return {BB.BATCH_STATUS: e.code, BB.BATCH_BODY: e.description}
+
+        result = {BB.BATCH_STATUS: rsp.status_code}
+        if rsp.is_json:
+            result[BB.BATCH_BODY] = rsp.get_json()
+        else:
+            # files are sent as passthrough responses, read them anyway
+            rsp.direct_passthrough = False
+            result[BB.BATCH_DATA] = b64encode(rsp.get_data()).decode()
+        rsp.close()
+        return result
+
+    @authenticated
+    def get(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    def put(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    def delete(self, me):
+        """Forbidden action"""
+        return ERR_FORB()
@@ -13,7 +13,6 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
-from koi_api.orm.sample import ORMAssociationTags, ORMSampleTag
 from flask.helpers import make_response
 from koi_api.orm.parameters import ORMInstanceParameter
 from koi_api.orm.model import ORMModel
@@ -31,10 +30,15 @@ from koi_api.resources.base import (
     instance_access,
     descriptor_access,
     json_request,
+    cached_response,
 )
+from sqlalchemy import select
 from koi_api.orm import db
-from koi_api.persistence import persistence
+from koi_api.orm.job import ORMMergeJob
+from koi_api.jobs.merge import new_merge_job
+from koi_api.persistence import persistence, release_file
 from koi_api.orm.instance import (
+    samples_versions,
     ORMInstance,
     ORMInstanceInferenceData,
     ORMInstanceTrainingData,
@@ -42,8 +46,8 @@ from koi_api.orm.instance import (
 )
 from koi_api.orm.access import ORMAccessInstance
 from koi_api.orm.role import ORMUserRoleInstance
-from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, SUCCESS, ERR_BADR
-from koi_api.common.string_constants import BODY_INSTANCE as BI, BODY_ROLE as BR
+from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, SUCCESS, ERR_BADR, not_modified
+from koi_api.common.string_constants import BODY_INSTANCE as BI, BODY_ROLE as BR, BODY_JOB as BJ
 from koi_api.common.name_generator import gen_name
 from koi_api.resources.lifetime import (
     LT_INSTANCE,
@@ -59,6 +63,7 @@ class APIInstanceDescriptor(BaseResource):
     @authenticated
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
+    @cached_response(lambda instance, **_: instance.instance_etag)
     def get(
         self, model, model_uuid, me, instance, instance_uuid, page_offset, page_limit
     ):
@@ -68,9 +73,9 @@ class APIInstanceDescriptor(BaseResource):
 
         response = [
             {
-                BI.INSTANCE_DESCRIPTOR_UUID: UUID(bytes=descriptor.descriptor_uuid).hex,
+                BI.INSTANCE_DESCRIPTOR_UUID: descriptor.descriptor_uuid.hex(),
                 BI.INSTANCE_DESCRIPTOR_KEY: descriptor.descriptor_key,
-                BI.INSTANCE_DESCRIPTOR_KEY_HAS_FILE: descriptor.file is not None,
+                BI.INSTANCE_DESCRIPTOR_KEY_HAS_FILE: descriptor.descriptor_file_id is not None,
             }
             for descriptor in descriptors
         ]
@@ -169,7 +174,7 @@ class APIInstanceDescriptorCollection(BaseResource):
         descriptor,
     ):
         response = {
-            BI.INSTANCE_DESCRIPTOR_UUID: UUID(bytes=descriptor.descriptor_uuid).hex,
+            BI.INSTANCE_DESCRIPTOR_UUID: descriptor.descriptor_uuid.hex(),
             BI.INSTANCE_DESCRIPTOR_KEY: descriptor.descriptor_key,
             BI.INSTANCE_DESCRIPTOR_KEY_HAS_FILE: descriptor.file is not None,
         }
@@ -211,7 +216,7 @@ class APIInstanceDescriptorCollection(BaseResource):
         db.session.commit()
 
         response = {
-            BI.INSTANCE_DESCRIPTOR_UUID: UUID(bytes=descriptor.descriptor_uuid).hex,
+            BI.INSTANCE_DESCRIPTOR_UUID: descriptor.descriptor_uuid.hex(),
             BI.INSTANCE_DESCRIPTOR_KEY: descriptor.descriptor_key,
         }
 
@@ -268,6 +273,11 @@ class APIInstanceDescriptorFile(BaseResource):
         if descriptor.file is None:
             return ERR_NOFO("no data specified")
         else:
+            # answer conditional requests without reading the blob
+            rsp = not_modified(instance.instance_etag, instance.instance_last_modified)
+            if rsp is not None:
+                return rsp
+
             data_raw = persistence.get_file(descriptor.file)
             data_raw = BytesIO(data_raw)
             data_raw.seek(0)
@@ -299,9 +309,9 @@ class APIInstanceDescriptorFile(BaseResource):
         descriptor,
         me,
     ):
-        # TODO: delete old descriptor file if already set
         data_raw = request.data
         file_pers = persistence.store_file(data_raw)
+        release_file(db.session, descriptor.file)
         descriptor.file = file_pers
         db.session.add(file_pers)
 
@@ -376,10 +386,11 @@ class APIInstance(BaseResource):
             .limit(page_limit)
         )
         instances = query.all()
+        versions = samples_versions(instances)
 
         response = [
             {
-                BI.INSTANCE_UUID: UUID(bytes=instance.instance_uuid).hex,
+                BI.INSTANCE_UUID: instance.instance_uuid.hex(),
                 BI.INSTANCE_NAME: instance.instance_name,
                 BI.INSTANCE_DESCRIPTION: instance.instance_description,
                 BI.INSTANCE_HAS_INFERENCE: instance.inference_data is not None,
@@ -388,10 +399,10 @@ class APIInstance(BaseResource):
                 BI.INSTANCE_COULD_TRAIN: instance.instance_finalized
                 and (
                     instance.instance_last_modified
-                    < instance.instance_samples_last_modified
+                    < versions[instance.instance_id][0]
                 ),
                 BI.INSTANCE_LAST_MODIFIED: instance.instance_last_modified.isoformat(),
-                BI.INSTANCE_SAMPLES_LAST_MODIFIED: instance.instance_samples_last_modified.isoformat(),
+                BI.INSTANCE_SAMPLES_LAST_MODIFIED: versions[instance.instance_id][0].isoformat(),
                 BI.INSTANCE_HAS_REQUESTS: instance.label_requests.filter_by(obsolete=False).count() > 0,
             }
             for instance in instances
@@ -424,6 +435,7 @@ class APIInstance(BaseResource):
         new_inst.instance_etag = token_hex(16)
         new_inst.instance_samples_last_modified = datetime.utcnow()
         new_inst.instance_samples_etag = token_hex(16)
+        new_inst.instance_samples_version = 0
 
         model.model_instances_last_modified = datetime.utcnow()
         model.model_instances_etag = token_hex(16)
@@ -464,7 +476,7 @@ class APIInstance(BaseResource):
 
         return SUCCESS(
             {
-                BI.INSTANCE_UUID: UUID(bytes=new_inst.instance_uuid).hex,
+                BI.INSTANCE_UUID: new_inst.instance_uuid.hex(),
                 BI.INSTANCE_NAME: new_inst.instance_name,
                 BI.INSTANCE_DESCRIPTION: new_inst.instance_description,
                 BI.INSTANCE_HAS_INFERENCE: False,
@@ -503,21 +515,23 @@ class APIInstanceCollection(BaseResource):
         valid = LT_INSTANCE
         if instance.instance_finalized:
             valid = LT_INSTANCE_FINALIZED
+        samples_last_modified, samples_etag = instance.samples_version()
         return SUCCESS(
             "",
-            last_modified=instance.instance_last_modified,
+            last_modified=max(instance.instance_last_modified, samples_last_modified),
             valid_seconds=valid,
-            etag=instance.instance_etag,
+            etag=instance.etag(samples_etag),
         )
 
     @authenticated
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
     def get(self, model_uuid, model, instance_uuid, instance, me):
+        samples_last_modified, samples_etag = instance.samples_version()
 
         # build the response
         response = {
-            BI.INSTANCE_UUID: UUID(bytes=instance.instance_uuid).hex,
+            BI.INSTANCE_UUID: instance.instance_uuid.hex(),
             BI.INSTANCE_NAME: instance.instance_name,
             BI.INSTANCE_DESCRIPTION: instance.instance_description,
             BI.INSTANCE_HAS_INFERENCE: instance.inference_data is not None,
@@ -526,10 +540,10 @@ class APIInstanceCollection(BaseResource):
             BI.INSTANCE_COULD_TRAIN: instance.instance_finalized
             and (
                 instance.instance_last_modified
-                < instance.instance_samples_last_modified
+                < samples_last_modified
             ),
             BI.INSTANCE_LAST_MODIFIED: instance.instance_last_modified.isoformat(),
-            BI.INSTANCE_SAMPLES_LAST_MODIFIED: instance.instance_samples_last_modified.isoformat(),
+            BI.INSTANCE_SAMPLES_LAST_MODIFIED: samples_last_modified.isoformat(),
             BI.INSTANCE_HAS_REQUESTS: instance.label_requests.filter_by(obsolete=False).count() > 0,
         }
 
@@ -539,9 +553,9 @@ class APIInstanceCollection(BaseResource):
 
         return SUCCESS(
             response,
-            last_modified=instance.instance_last_modified,
+            last_modified=max(instance.instance_last_modified, samples_last_modified),
             valid_seconds=valid,
-            etag=instance.instance_etag,
+            etag=instance.etag(samples_etag),
         )
 
     @authenticated
@@ -621,6 +635,11 @@ class APIInstanceInferenceData(BaseResource):
             return ERR_NOFO()
 
         else:
+            # answer conditional requests without reading the blob
+            rsp = not_modified(last_modified=instance.inference_data.data_last_modified)
+            if rsp is not None:
+                return rsp
+
             data = persistence.get_file(instance.inference_data.file)
             data = BytesIO(data)
             data.seek(0)
@@ -642,7 +661,7 @@ class APIInstanceInferenceData(BaseResource):
 
             db.session.add(file_pers)
 
-            # TODO: prevent existing inferencedata to become orphaned
+            release_file(db.session, instance.inference_data)
             newRequest = ORMInstanceInferenceData()
             newRequest.file = file_pers
             newRequest.data_uuid = uuid4().bytes
@@ -699,6 +718,11 @@ class APIInstanceTrainingData(BaseResource):
             return ERR_NOFO()
 
         else:
+            # answer conditional requests without reading the blob
+            rsp = not_modified(last_modified=instance.training_data.data_last_modified)
+            if rsp is not None:
+                return rsp
+
             data = persistence.get_file(instance.training_data.file)
             data = BytesIO(data)
             data.seek(0)
@@ -717,7 +741,7 @@ class APIInstanceTrainingData(BaseResource):
 
             new_uuid = uuid4()
 
-            # TODO: prevent existing inferencedata to become orphaned
+            release_file(db.session, instance.training_data)
             newRequest = ORMInstanceTrainingData()
             newRequest.file = file_pers
             newRequest.data_uuid = new_uuid.bytes
@@ -750,133 +774,97 @@ class APIInstanceTrainingData(BaseResource):
         return ERR_FORB()
 
 
+def merge_job_body(job):
+    return {
+        BJ.JOB_UUID: job.job_uuid.hex(),
+        BJ.JOB_PHASE: job.job_phase,
+        BJ.JOB_TOTAL: job.job_total,
+        BJ.JOB_PROCESSED: job.job_processed,
+        BJ.JOB_SAMPLES: job.job_samples,
+        BJ.JOB_ERROR: job.job_error,
+        BJ.JOB_CREATED: job.job_created.isoformat(),
+        BJ.JOB_LAST_MODIFIED: job.job_last_modified.isoformat(),
+    }
+
+
 class APIInstanceMerge(BaseResource):
     @authenticated
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_EDIT_INSTANCE, BR.ROLE_SEE_INSTANCE])
     @json_request
     def post(self, model_uuid, model, instance_uuid, instance, me, json_object):
+        """Submit a job merging the given instances into this one and return its state"""
         # only finalized instances can be used for merging
         if not instance.instance_finalized:
             return ERR_FORB("instance has to be finalized!")
 
-        # collect all known descriptors
-        known_descriptors = dict()
+        if not isinstance(json_object, dict) or not isinstance(json_object.get(BI.INSTANCE_UUID), list):
+            return ERR_BADR("missing field: " + BI.INSTANCE_UUID)
+        try:
+            [UUID(u) for u in json_object[BI.INSTANCE_UUID]]
+        except (ValueError, TypeError, AttributeError):
+            return ERR_BADR("instance_uuid malformed")
 
-        descriptors = instance.instance_descriptors.all()
+        job = new_merge_job(instance, json_object[BI.INSTANCE_UUID])
+        db.session.commit()
 
-        for desc in descriptors:
-            key = desc.descriptor_key
-            data_raw = persistence.get_file(desc.file)
-            if key not in known_descriptors.keys():
-                known_descriptors[key] = [
-                    data_raw,
-                ]
-            else:
-                known_descriptors[key].append(data_raw)
-
-        new_descriptors = dict()
-
-        # check the instances for merging
-        for inst_uuid in json_object[BI.INSTANCE_UUID]:
-            inst = ORMInstance.query.filter_by(
-                instance_uuid=UUID(inst_uuid).bytes
-            ).one_or_none()
-
-            # check if the instance uuid is valid
-            if inst is None:
-                continue
-
-            # check if the instance is not already merged
-            if inst.instance_merged_id is not None:
-                continue
-
-            # collect the descriptor of this instance and check if we already have them
-            descriptors = inst.instance_descriptors.all()
-
-            for desc in descriptors:
-                if desc.file is None:
-                    continue
-
-                key = desc.descriptor_key
-                data_raw = persistence.get_file(desc.file)
-
-                if key in known_descriptors.keys():
-                    if data_raw in known_descriptors[key]:
-                        continue
-
-                if key not in new_descriptors.keys():
-                    new_descriptors[key] = [
-                        data_raw,
-                    ]
-                else:
-                    if data_raw not in new_descriptors[key]:
-                        new_descriptors[key].append(data_raw)
-
-            # transfer all samples to the new merged instance
-            samples = inst.samples.all()
-
-            for sample in samples:
-                # throw away unmergeable labels!
-                sample.purge_for_merge()
-
-                # transfer ownership of the sample
-                sample.instance = instance
-
-                # generate a new uuid as this is needed in our hirachical layout
-                sample.sample_uuid = uuid4().bytes
-
-            # move all tags to the new instance that are not already there
-            tags_to_move = inst.tags.all()
-            for tag in tags_to_move:
-                existing_tags = instance.tags.all()
-                matched = False
-                for ext_tag in existing_tags:
-                    if ext_tag.tag_name == tag.tag_name:
-                        matched = True
-                        break
-
-                if not matched:
-                    new_tag = ORMSampleTag()
-                    new_tag.instance = instance
-                    new_tag.tag_name = tag.tag_name
-                    db.session.add(new_tag)
-
-            # get all associations from the merging instance that are mergeable
-            associations = (
-                ORMAssociationTags.query.filter_by(mergeable=True)
-                .join(ORMAssociationTags.tag)
-                .filter_by(instance_id=inst.instance_id)
-                .all()
-            )
+        return SUCCESS(merge_job_body(job))
 
-            # get the list of all known tags from the target instance
-            existing_tags = instance.tags.all()
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    @paged
+    def get(self, model_uuid, model, instance_uuid, instance, me, page_offset, page_limit):
+        """List the merge jobs of this instance"""
+        stmt = (
+            select(ORMMergeJob)
+            .where(ORMMergeJob.instance_id == instance.instance_id)
+            .order_by(ORMMergeJob.job_id)
+            .offset(page_offset)
+            .limit(page_limit)
+        )
+        jobs = db.session.scalars(stmt).all()
 
-            for assoc in associations:
-                for ext_tag in existing_tags:
-                    if assoc.tag.tag_name == ext_tag.tag_name:
-                        assoc.tag = ext_tag
-                        break
-            db.session.commit()
+        return SUCCESS([merge_job_body(job) for job in jobs])
 
-            # mark the current instance as merged
-            inst.instance_merged = instance
 
-        # add the new descriptors to the merged instance
-        for key, values in new_descriptors.items():
-            for value in values:
-                new_desc = ORMInstanceDescriptor()
-                new_desc.descriptor_key = key
-                new_desc.descriptor_instance = instance
-                new_desc.descriptor_uuid = uuid4().bytes
+class APIInstanceMergeJob(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, job_uuid, me):
+        """Report the phase and progress of a merge job"""
+        try:
+            job_uuid = UUID(job_uuid).bytes
+        except ValueError:
+            return ERR_BADR("job_uuid malformed")
+        stmt = select(ORMMergeJob).where(
+            ORMMergeJob.job_uuid == job_uuid,
+            ORMMergeJob.instance_id == instance.instance_id,
+        )
+        job = db.session.scalars(stmt).one_or_none()
+        if job is None:
+            return ERR_NOFO("job unknown")
 
-                file_pers = persistence.store_file(value)
+        return SUCCESS(merge_job_body(job))
 
-                db.session.add(file_pers)
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, job_uuid, me):
+        """Forbidden action"""
+        return ERR_FORB()
 
-                new_desc.descriptor_file = file_pers
-                db.session.add(new_desc)
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def put(self, model_uuid, model, instance_uuid, instance, job_uuid, me):
+        """Forbidden action"""
+        return ERR_FORB()
 
-        db.session.commit()
-        return SUCCESS()
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, job_uuid, me):
+        """Forbidden action"""
+        return ERR_FORB()
@@ -20,9 +20,10 @@ from koi_api.resources.base import (
     authenticated,
     model_access,
     instance_access,
+    cached_response,
 )
 from koi_api.orm.sample import ORMSampleTag
-from koi_api.common.return_codes import ERR_FORB, SUCCESS
+from koi_api.common.return_codes import ERR_FORB, SUCCESS, not_modified
 from koi_api.common.string_constants import BODY_ROLE as BR, BODY_TAG as BT
 from koi_api.resources.lifetime import LT_COLLECTION
 
@@ -32,21 +33,28 @@ class APIInstanceTag(BaseResource):
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
     def head(self, model_uuid, model, instance_uuid, instance, me):
+        last_modified, etag = instance.samples_version()
         return SUCCESS(
             "",
-            last_modified=instance.instance_samples_last_modified,
+            last_modified=last_modified,
             valid_seconds=LT_COLLECTION,
-            etag=instance.instance_etag,
+            etag=etag,
         )
 
     @authenticated
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
+    @cached_response(lambda instance, **_: instance.samples_version()[1])
     def get(
         self, model_uuid, model, instance_uuid, instance, me,
     ):
         """
         """
+        last_modified, etag = instance.samples_version()
+        rsp = not_modified(etag, last_modified)
+        if rsp is not None:
+            return rsp
+
         stmt_tags = select(ORMSampleTag).where(
             ORMSampleTag.instance_id == instance.instance_id
         )
@@ -56,9 +64,9 @@ class APIInstanceTag(BaseResource):
 
         return SUCCESS(
             response,
-            last_modified=instance.instance_samples_last_modified,
+            last_modified=last_modified,
             valid_seconds=LT_COLLECTION,
-            etag=instance.instance_samples_etag,
+            etag=etag,
         )
 
     @authenticated
@@ -16,12 +16,19 @@
 from flask_restful import request
 from uuid import uuid4, UUID
 from datetime import datetime
+from secrets import token_hex
+from zipfile import BadZipFile
+import tarfile
+from sqlalchemy import select, insert
+from sqlalchemy.orm import joinedload
 from koi_api.resources.base import BaseResource, authenticated, paged
 from koi_api.resources.base import instance_access, json_request, model_access, label_request_filter
+from koi_api.resources.sample import iter_upload_entries
 from koi_api.orm import db
 from koi_api.persistence import persistence
 from koi_api.orm.sample import ORMSample, ORMSampleLabel
 from koi_api.orm.label_request import ORMLabelRequest
+from koi_api.common.notifier import instance_changed
 from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, SUCCESS, ERR_BADR
 from koi_api.common.string_constants import BODY_SAMPLE as BS, BODY_ROLE as BR, BODY_INSTANCE as BI
 
@@ -48,14 +55,14 @@ class APILabelRequest(BaseResource):
             label_requests = label_requests.filter_by(
                 obsolete=min(1, max(0, filter_obsolete))
             )
-        label_requests.offset(page_offset).limit(page_limit)
-        label_requests = label_requests.all()
+        label_requests = label_requests.options(joinedload(ORMLabelRequest.sample))
+        label_requests = label_requests.offset(page_offset).limit(page_limit).all()
 
         response = [
             {
-                BS.SAMPLE_LABEL_REQUEST_UUID: UUID(bytes=fr.label_request_uuid).hex,
-                BS.SAMPLE_UUID: UUID(bytes=fr.sample.sample_uuid).hex,
-                BI.INSTANCE_UUID: UUID(bytes=fr.instance.instance_uuid).hex,
+                BS.SAMPLE_LABEL_REQUEST_UUID: fr.label_request_uuid.hex(),
+                BS.SAMPLE_UUID: fr.sample.sample_uuid.hex(),
+                BI.INSTANCE_UUID: instance.instance_uuid.hex(),
                 BS.SAMPLE_OBSOLETE: fr.obsolete,
             }
             for fr in label_requests
@@ -92,9 +99,9 @@ class APILabelRequest(BaseResource):
         db.session.commit()
 
         response = {
-            BS.SAMPLE_LABEL_REQUEST_UUID: UUID(bytes=new_request.label_request_uuid).hex,
-            BS.SAMPLE_UUID: UUID(bytes=new_request.sample.sample_uuid).hex,
-            BI.INSTANCE_UUID: UUID(bytes=new_request.instance.instance_uuid).hex,
+            BS.SAMPLE_LABEL_REQUEST_UUID: new_request.label_request_uuid.hex(),
+            BS.SAMPLE_UUID: new_request.sample.sample_uuid.hex(),
+            BI.INSTANCE_UUID: new_request.instance.instance_uuid.hex(),
             BS.SAMPLE_OBSOLETE: new_request.obsolete,
         }
 
@@ -143,9 +150,9 @@ class APILabelRequestCollection(BaseResource):
             return ERR_NOFO("unknown label request")
 
         response = {
-            BS.SAMPLE_LABEL_REQUEST_UUID: UUID(bytes=label_request.label_request_uuid).hex,
-            BS.SAMPLE_UUID: UUID(bytes=label_request.sample.sample_uuid).hex,
-            BI.INSTANCE_UUID: UUID(bytes=label_request.instance.instance_uuid).hex,
+            BS.SAMPLE_LABEL_REQUEST_UUID: label_request.label_request_uuid.hex(),
+            BS.SAMPLE_UUID: label_request.sample.sample_uuid.hex(),
+            BI.INSTANCE_UUID: label_request.instance.instance_uuid.hex(),
             BS.SAMPLE_OBSOLETE: label_request.obsolete,
         }
 
@@ -180,11 +187,18 @@ class APILabelRequestCollection(BaseResource):
         new_data.label_last_modified = datetime.utcnow()
         new_data.sample_id = label_request.sample.sample_id
         new_data.label_uuid = new_uuid.bytes
+        # mark this label as not mergeable if the sample is already finalized
+        new_data.mergeable = not label_request.sample.sample_finalized
 
         db.session.add(new_data)
 
         label_request.obsolete = 1
 
+        # the sample has a new label
+        label_request.sample.sample_last_modified = datetime.utcnow()
+        label_request.sample.sample_etag = token_hex(16)
+        instance.samples_changed(label_request.sample)
+
         db.session.commit()
 
         return SUCCESS()
@@ -236,3 +250,155 @@ class APILabelRequestCollection(BaseResource):
         db.session.commit()
 
         return SUCCESS()
+
+
+class APILabelRequestBulk(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE, BR.ROLE_REQUEST_LABEL])
+    @json_request
+    def post(self, model_uuid, model, instance_uuid, instance, me, json_object):
+        """Create a label request for every sample uuid in the sample_uuid list of the body."""
+        if not isinstance(json_object, dict) or BS.SAMPLE_UUID not in json_object:
+            return ERR_BADR("missing field: " + BS.SAMPLE_UUID)
+        uuids = json_object[BS.SAMPLE_UUID]
+        if not isinstance(uuids, list):
+            return ERR_BADR("Expected a list of sample uuids")
+        try:
+            uuids = [UUID(u).bytes for u in uuids]
+        except (ValueError, TypeError, AttributeError):
+            return ERR_BADR("sample_uuid malformed")
+
+        # validate all samples with one query
+        stmt_samples = select(ORMSample.sample_uuid, ORMSample.sample_id).where(
+            ORMSample.instance_id == instance.instance_id,
+            ORMSample.sample_uuid.in_(set(uuids)),
+        )
+        samples = {row.sample_uuid: row.sample_id for row in db.session.execute(stmt_samples)}
+        for s_uuid in uuids:
+            if s_uuid not in samples:
+                return ERR_NOFO("unknown sample: " + s_uuid.hex())
+
+        new_requests = [
+            {
+                "label_request_uuid": uuid4().bytes,
+                "obsolete": False,
+                "label_request_instance_id": instance.instance_id,
+                "label_request_sample_id": samples[s_uuid],
+                "sample_uuid": s_uuid,
+            }
+            for s_uuid in uuids
+        ]
+        if len(new_requests) > 0:
+            db.session.execute(
+                insert(ORMLabelRequest),
+                [{k: v for k, v in r.items() if k != "sample_uuid"} for r in new_requests],
+            )
+            instance_changed(db.session, instance.instance_id)
+        db.session.commit()
+
+        response = [
+            {
+                BS.SAMPLE_LABEL_REQUEST_UUID: r["label_request_uuid"].hex(),
+                BS.SAMPLE_UUID: r["sample_uuid"].hex(),
+                BI.INSTANCE_UUID: instance.instance_uuid.hex(),
+                BS.SAMPLE_OBSOLETE: r["obsolete"],
+            }
+            for r in new_requests
+        ]
+
+        return SUCCESS(response)
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE, BR.ROLE_RESPONSE_LABEL])
+    def put(self, model_uuid, model, instance_uuid, instance, me):
+        """Answer many label requests at once.
+
+        The body is a zip or tar archive or a multipart form with one entry per
+        answer, named by the uuid of the label request. Every entry becomes a
+        new label of the requested sample and closes the request. Each request
+        may appear only once and must not be answered already. All answers are
+        written in one transaction.
+        """
+        stored = []
+
+        def discard(message, code=ERR_BADR):
+            for entry in stored:
+                persistence.remove_file(entry[1])
+            return code(message)
+
+        seen = set()
+        try:
+            for name, stream in iter_upload_entries():
+                try:
+                    request_uuid = UUID(name.strip("/"))
+                except ValueError:
+                    return discard("malformed entry name: " + name)
+                # a second entry would answer the same request twice
+                if request_uuid in seen:
+                    return discard("duplicate entry: " + name)
+                seen.add(request_uuid)
+                stored.append((request_uuid.bytes, persistence.store_stream(stream)))
+        except (ValueError, BadZipFile, tarfile.TarError) as e:
+            return discard(str(e))
+
+        if len(stored) == 0:
+            return ERR_BADR("no entries found")
+
+        # resolve all requests and their samples with one query, the requests stay
+        # locked so a concurrent answer waits and then sees them answered
+        stmt_requests = (
+            select(ORMLabelRequest, ORMSample)
+            .join(ORMLabelRequest.sample)
+            .where(
+                ORMLabelRequest.label_request_instance_id == instance.instance_id,
+                ORMLabelRequest.label_request_uuid.in_({entry[0] for entry in stored}),
+            )
+            .with_for_update(of=ORMLabelRequest)
+        )
+        requests = {lr.label_request_uuid: (lr, sample) for lr, sample in db.session.execute(stmt_requests)}
+        for request_uuid, _ in stored:
+            if request_uuid not in requests:
+                return discard("unknown label request: " + request_uuid.hex(), ERR_NOFO)
+            if requests[request_uuid][0].obsolete:
+                return discard("label request answered already: " + request_uuid.hex())
+
+        now = datetime.utcnow()
+        changed = dict()
+        for request_uuid, file_pers in stored:
+            label_request, sample = requests[request_uuid]
+            db.session.add(file_pers)
+
+            new_label = ORMSampleLabel()
+            new_label.file = file_pers
+            new_label.label_uuid = uuid4().bytes
+            new_label.label_last_modified = now
+            new_label.label_etag = token_hex(16)
+            new_label.sample_id = sample.sample_id
+            new_label.mergeable = not sample.sample_finalized
+            db.session.add(new_label)
+
+            label_request.obsolete = 1
+            changed[sample.sample_id] = sample
+
+        for sample in changed.values():
+            sample.sample_last_modified = now
+            sample.sample_etag = token_hex(16)
+        instance.samples_changed(*changed.values())
+
+        db.session.commit()
+
+        return SUCCESS()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me):
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        return ERR_FORB()
@@ -29,6 +29,9 @@ LT_INSTANCE_DESCRIPTOR = 1
 LT_SAMPLE = 1
 LT_SAMPLE_FINALIZED = 3
 
+# lifetime of snapshot archives, they never change once built
+LT_SNAPSHOT = 3600
+
 # lifetime of inference data
 LT_INFERENCE_DATA = 5
 
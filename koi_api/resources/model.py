@@ -17,12 +17,12 @@ from secrets import token_hex
 from flask_restful import request
 from flask import send_file
 from io import BytesIO
-from uuid import uuid4, UUID
+from uuid import uuid4
 from zipfile import ZipFile, BadZipFile
 from re import compile
 from datetime import datetime
 from koi_api.orm import db
-from koi_api.persistence import persistence
+from koi_api.persistence import persistence, release_file
 from koi_api.orm.parameters import ORMModelParameter
 from koi_api.orm.model import (
     ORMModel,
@@ -40,7 +40,7 @@ from koi_api.resources.base import (
 )
 from koi_api.orm.access import ORMAccessModel
 from koi_api.orm.role import ORMUserRoleModel
-from koi_api.common.return_codes import ERR_FORB, SUCCESS, ERR_NOFO, ERR_BADR
+from koi_api.common.return_codes import ERR_FORB, SUCCESS, ERR_NOFO, ERR_BADR, not_modified
 from koi_api.common.string_constants import BODY_MODEL as BM
 from koi_api.common.string_constants import BODY_ROLE as BR
 from koi_api.common.name_generator import gen_name
@@ -71,7 +71,7 @@ class APIModel(BaseResource):
         # construct the response
         response = [
             {
-                BM.MODEL_UUID: UUID(bytes=model.model_uuid).hex,
+                BM.MODEL_UUID: model.model_uuid.hex(),
                 BM.MODEL_NAME: model.model_name,
                 BM.MODEL_DESCRIPTION: model.model_description,
                 BM.MODEL_HAS_CODE: model.code is not None,
@@ -128,7 +128,7 @@ class APIModel(BaseResource):
 
         # return the new models id
         response = {
-            BM.MODEL_UUID: UUID(bytes=new_model.model_uuid).hex,
+            BM.MODEL_UUID: new_model.model_uuid.hex(),
             BM.MODEL_NAME: new_model.model_name,
             BM.MODEL_DESCRIPTION: new_model.model_description,
             BM.MODEL_HAS_CODE: False,
@@ -172,7 +172,7 @@ class APIModelCollection(BaseResource):
 
         # construct the response
         response = {
-            BM.MODEL_UUID: UUID(bytes=model.model_uuid).hex,
+            BM.MODEL_UUID: model.model_uuid.hex(),
             BM.MODEL_NAME: model.model_name,
             BM.MODEL_DESCRIPTION: model.model_description,
             BM.MODEL_HAS_CODE: model.code is not None,
@@ -269,6 +269,11 @@ class APIModelCode(BaseResource):
         if model.code is None or model.code.file is None:
             return ERR_NOFO("no code specified")
         else:
+            # answer conditional requests without reading the blob
+            rsp = not_modified(last_modified=model.model_last_modified)
+            if rsp is not None:
+                return rsp
+
             data = persistence.get_file(model.code.file)
             data = BytesIO(data)
             data.seek(0)
@@ -331,7 +336,7 @@ class APIModelCode(BaseResource):
                         new_param.param_constraint = ""
                     db.session.add(new_param)
 
-            # TODO: prevent existing code to become orphaned
+            release_file(db.session, model.code)
             db.session.add(file_pers)
             newCode = ORMModelCode()
             newCode.file = file_pers
@@ -382,7 +387,7 @@ class APIModelVisualPlugin(BaseResource):
 
         db.session.add(file_pers)
 
-        # TODO: prevent existing plugin to become orphaned
+        release_file(db.session, model.visual_plugin)
         newVisual = ORMModelVisualPlugin()
         newVisual.file = file_pers
         db.session.add(newVisual)
@@ -430,7 +435,7 @@ class APIModelRequestPlugin(BaseResource):
 
         db.session.add(file_pers)
 
-        # TODO: prevent existing plugin to become orphaned
+        release_file(db.session, model.request_plugin)
         newRequest = ORMModelLabelRequestPlugin()
         newRequest.file = file_pers
         db.session.add(newRequest)
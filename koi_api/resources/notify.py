@@ -0,0 +1,107 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import time
+from flask import current_app
+from flask_restful import request
+from koi_api.orm import db, DEFER_COMMIT
+from koi_api.orm.instance import ORMInstance
+from koi_api.common.notifier import notifier
+from koi_api.resources.base import BaseResource, authenticated, model_access, instance_access
+from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, ERR_BADR, SUCCESS
+from koi_api.common.string_constants import BODY_NOTIFY as BN, BODY_ROLE as BR
+
+
+class APIInstanceNotify(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me):
+        """Wait until the samples or the open label requests of the instance differ from the given versions
+
+        Args:
+            samples ([string]): etag of the samples known to the caller
+            label_requests ([string]): version of the label requests known to the caller
+            timeout ([float]): seconds to wait at most, limited by NOTIFY_MAX_TIMEOUT
+
+        Returns:
+            [object]: the current versions and whether they differ from the given ones
+        """
+        known_samples = request.args.get(BN.NOTIFY_SAMPLES, None)
+        known_requests = request.args.get(BN.NOTIFY_LABEL_REQUESTS, None)
+        max_timeout = current_app.config["NOTIFY_MAX_TIMEOUT"]
+        try:
+            timeout = float(request.args.get(BN.NOTIFY_TIMEOUT, max_timeout))
+        except ValueError:
+            return ERR_BADR("illegal param")
+        timeout = min(max(timeout, 0), max_timeout)
+
+        # requests of a batch share one transaction and can not wait
+        if db.session.info.get(DEFER_COMMIT, False):
+            timeout = 0
+
+        recheck = current_app.config["NOTIFY_RECHECK_SECONDS"]
+        instance_id = instance.instance_id
+        deadline = time.monotonic() + timeout
+        while True:
+            # read the generation first, a commit after it wakes the wait below
+            generation = notifier.generation(instance_id)
+
+            instance = db.session.get(ORMInstance, instance_id)
+            if instance is None:
+                return ERR_NOFO("instance unknown")
+            _, samples = instance.samples_version()
+            label_requests = instance.label_requests_version()
+
+            changed = (known_samples is not None and known_samples != samples) or (
+                known_requests is not None and known_requests != label_requests
+            )
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                break
+
+            # end the transaction, it returns the connection to the pool while waiting
+            # and lets the next check see changes committed by other processes
+            db.session.rollback()
+            notifier.wait(instance_id, generation, min(remaining, recheck))
+
+        return SUCCESS(
+            {
+                BN.NOTIFY_SAMPLES: samples,
+                BN.NOTIFY_LABEL_REQUESTS: label_requests,
+                BN.NOTIFY_CHANGED: changed,
+            }
+        )
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def put(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
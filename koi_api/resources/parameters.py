@@ -37,7 +37,7 @@ class APIModelParameter(BaseResource):
 
         response = [
             {
-                BP.PARAM_UUID: UUID(bytes=param.param_uuid).hex,
+                BP.PARAM_UUID: param.param_uuid.hex(),
                 BP.PARAM_NAME: param.param_name,
                 BP.PARAM_DESCRIPTION: param.param_description,
                 BP.PARAM_CONSTRAINT: param.param_constraint,
@@ -80,7 +80,7 @@ class APIModelParameterCollection(BaseResource):
             return ERR_NOFO()
 
         response = {
-            BP.PARAM_UUID: UUID(bytes=param.param_uuid).hex,
+            BP.PARAM_UUID: param.param_uuid.hex(),
             BP.PARAM_NAME: param.param_name,
             BP.PARAM_DESCRIPTION: param.param_description,
             BP.PARAM_CONSTRAINT: param.param_constraint,
@@ -116,7 +116,7 @@ class APIInstanceParameter(BaseResource):
         ).all()
         response = [
             {
-                BP.PARAM_UUID_VALUE: UUID(bytes=param.param_uuid).hex,
+                BP.PARAM_UUID_VALUE: param.param_uuid.hex(),
                 BP.PARAM_UUID: UUID(bytes=param.model_param.param_uuid),
                 BP.PARAM_VALUE: param.param_value,
                 BP.PARAM_NAME: param.model_param.param_name,
@@ -204,8 +204,8 @@ class APIInstanceParameterCollection(BaseResource):
             return ERR_NOFO("parameter is unknown")
 
         response = {
-            BP.PARAM_UUID: UUID(bytes=param.model_param.param_uuid).hex,
-            BP.PARAM_UUID_VALUE: UUID(bytes=param.param_uuid).hex,
+            BP.PARAM_UUID: param.model_param.param_uuid.hex(),
+            BP.PARAM_UUID_VALUE: param.param_uuid.hex(),
             BP.PARAM_VALUE: param.param_value,
         }
         return SUCCESS(response)
@@ -35,7 +35,7 @@ class APIUserRoleGeneral(BaseResource):
         # construct the response
         response = [
             {
-                BR.ROLE_UUID: UUID(bytes=r.role_uuid).hex,
+                BR.ROLE_UUID: r.role_uuid.hex(),
                 BR.ROLE_NAME: r.role_name,
                 BR.ROLE_DESCRIPTION: r.role_description,
                 BR.ROLE_GRANT_ACCESS: int(r.grant_access),
@@ -147,7 +147,7 @@ class APIUserRoleGeneralCollection(BaseResource):
             return ERR_NOFO()
 
         response = {
-            BR.ROLE_UUID: UUID(bytes=r.role_uuid).hex,
+            BR.ROLE_UUID: r.role_uuid.hex(),
             BR.ROLE_NAME: r.role_name,
             BR.ROLE_DESCRIPTION: r.role_description,
             BR.ROLE_GRANT_ACCESS: int(r.grant_access),
@@ -243,7 +243,7 @@ class APIUserRoleModel(BaseResource):
         # construct the response
         response = [
             {
-                BR.ROLE_UUID: UUID(bytes=r.role_uuid).hex,
+                BR.ROLE_UUID: r.role_uuid.hex(),
                 BR.ROLE_NAME: r.role_name,
                 BR.ROLE_DESCRIPTION: r.role_description,
                 BR.ROLE_SEE_MODEL: int(r.can_see),
@@ -363,7 +363,7 @@ class APIUserRoleModelCollection(BaseResource):
             return ERR_NOFO()
 
         response = {
-            BR.ROLE_UUID: UUID(bytes=r.role_uuid).hex,
+            BR.ROLE_UUID: r.role_uuid.hex(),
             BR.ROLE_NAME: r.role_name,
             BR.ROLE_DESCRIPTION: r.role_description,
             BR.ROLE_SEE_MODEL: r.can_see,
@@ -470,7 +470,7 @@ class APIUserRoleInstance(BaseResource):
         # construct the response
         response = [
             {
-                BR.ROLE_UUID: UUID(bytes=r.role_uuid).hex,
+                BR.ROLE_UUID: r.role_uuid.hex(),
                 BR.ROLE_NAME: r.role_name,
                 BR.ROLE_DESCRIPTION: r.role_description,
                 BR.ROLE_SEE_INSTANCE: int(r.can_see),
@@ -628,7 +628,7 @@ class APIUserRoleInstanceCollection(BaseResource):
             return ERR_NOFO()
 
         response = {
-            BR.ROLE_UUID: UUID(bytes=r.role_uuid).hex,
+            BR.ROLE_UUID: r.role_uuid.hex(),
             BR.ROLE_NAME: r.role_name,
             BR.ROLE_DESCRIPTION: r.role_description,
             BR.ROLE_SEE_INSTANCE: int(r.can_see),
@@ -15,9 +15,14 @@
 
 from secrets import token_hex
 from flask_restful import request
-from flask import send_file
+from flask import send_file, current_app
 from io import BytesIO
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from zipfile import ZipFile, BadZipFile
+from tempfile import SpooledTemporaryFile
+import shutil
+import tarfile
+from sqlalchemy import select, update, literal, cast, String
 from koi_api.orm import db
 from koi_api.resources.base import (
     BaseResource,
@@ -26,12 +31,13 @@ from koi_api.resources.base import (
     instance_access,
     sample_label_access,
 )
-from koi_api.resources.base import paged, sample_access, sample_data_access, json_request, sample_filter
+from koi_api.resources.base import paged, sample_access, sample_data_access, json_request, sample_filter, cached_response
 from uuid import UUID, uuid4
-from koi_api.orm.sample import ORMSample, ORMSampleData, ORMSampleLabel, ORMSampleTag
-from koi_api.persistence import persistence
-from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, ERR_BADR, SUCCESS
-from koi_api.common.string_constants import BODY_SAMPLE as BS, BODY_ROLE as BR
+from koi_api.orm.sample import ORMSample, ORMSampleData, ORMSampleLabel, ORMSampleTag, ORMAssociationTags
+from koi_api.orm.sample import CHANGE_CREATED, CHANGE_MODIFIED, CHANGE_DELETED
+from koi_api.persistence import persistence, release_file
+from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, ERR_BADR, SUCCESS, not_modified
+from koi_api.common.string_constants import BODY_SAMPLE as BS, BODY_ROLE as BR, BODY_CHANGES as BC
 from koi_api.resources.lifetime import LT_COLLECTION, LT_SAMPLE, LT_SAMPLE_FINALIZED
 
 
@@ -42,11 +48,12 @@ class APISample(BaseResource):
     def head(
         self, model_uuid, model, instance_uuid, instance, me,
     ):
+        last_modified, etag = instance.samples_version()
         return SUCCESS(
             "",
-            last_modified=instance.instance_samples_last_modified,
+            last_modified=last_modified,
             valid_seconds=LT_COLLECTION,
-            etag=instance.instance_samples_etag,
+            etag=etag,
         )
 
     @authenticated
@@ -54,6 +61,7 @@ class APISample(BaseResource):
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
     @sample_filter
+    @cached_response(lambda instance, **_: instance.samples_version()[1])
     def get(
         self,
         model_uuid,
@@ -102,13 +110,18 @@ class APISample(BaseResource):
                 )
             )
 
+        last_modified, etag = instance.samples_version()
+        rsp = not_modified(etag, last_modified)
+        if rsp is not None:
+            return rsp
+
         # paging
         stmt_sample = stmt_sample.offset(page_offset).limit(page_limit)
         samples = stmt_sample.all()
 
         response = [
             {
-                BS.SAMPLE_UUID: UUID(bytes=sample.sample_uuid).hex,
+                BS.SAMPLE_UUID: sample.sample_uuid.hex(),
                 BS.SAMPLE_FINALIZED: sample.sample_finalized,
             }
             for sample in samples
@@ -116,9 +129,9 @@ class APISample(BaseResource):
 
         return SUCCESS(
             response,
-            last_modified=instance.instance_samples_last_modified,
+            last_modified=last_modified,
             valid_seconds=LT_COLLECTION,
-            etag=instance.instance_samples_etag,
+            etag=etag,
         )
 
     @authenticated
@@ -150,13 +163,12 @@ class APISample(BaseResource):
 
         db.session.add(new_sample)
 
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(new_sample, kind=CHANGE_CREATED)
 
         db.session.commit()
         return SUCCESS(
             {
-                BS.SAMPLE_UUID: UUID(bytes=new_sample.sample_uuid).hex,
+                BS.SAMPLE_UUID: new_sample.sample_uuid.hex(),
                 BS.SAMPLE_FINALIZED: new_sample.sample_finalized,
             },
             last_modified=new_sample.sample_last_modified,
@@ -179,6 +191,80 @@ class APISample(BaseResource):
         return ERR_FORB()
 
 
+class APISampleChanges(BaseResource):
+    @authenticated
+    @paged
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me, page_offset, page_limit):
+        """Get the uuids of the samples created, modified or deleted after a cursor or a point in time
+
+        Args:
+            since ([int]): cursor returned by the previous call, omitted to start at the first change
+            since_time ([string]): ISO 8601 date, only changes after it are reported
+            page_limit ([int]): maximum number of logged changes read, the offset is replaced by the cursor
+
+        Returns:
+            [object]: uuids by kind of change, the cursor for the next call and whether more changes are left
+        """
+        since = request.args.get(BC.CHANGES_SINCE, None)
+        since_time = request.args.get(BC.CHANGES_SINCE_TIME, None)
+        try:
+            if since is not None:
+                since = int(since)
+            if since_time is not None:
+                since_time = datetime.fromisoformat(since_time)
+        except ValueError:
+            return ERR_BADR("illegal param")
+
+        # the change log stores naive dates in utc
+        if since_time is not None and since_time.tzinfo is not None:
+            since_time = since_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+        settle = current_app.config["CHANGE_FEED_SETTLE_SECONDS"]
+        settled_before = datetime.utcnow() - timedelta(seconds=settle) if settle > 0 else None
+
+        changes, cursor, more = instance.changes_since(since, since_time, settled_before, page_limit)
+
+        body = {
+            BC.CHANGES_CURSOR: cursor,
+            BC.CHANGES_MORE: more,
+            BC.CHANGES_CREATED: [],
+            BC.CHANGES_MODIFIED: [],
+            BC.CHANGES_DELETED: [],
+        }
+        kinds = {
+            CHANGE_CREATED: BC.CHANGES_CREATED,
+            CHANGE_MODIFIED: BC.CHANGES_MODIFIED,
+            CHANGE_DELETED: BC.CHANGES_DELETED,
+        }
+        for sample_uuid, kind in changes.items():
+            body[kinds[kind]].append(sample_uuid.hex())
+
+        return SUCCESS(body)
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def put(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
 class APISampleCollection(BaseResource):
     @authenticated
     @model_access([BR.ROLE_SEE_MODEL])
@@ -201,7 +287,7 @@ class APISampleCollection(BaseResource):
     @sample_access
     def get(self, model_uuid, model, instance_uuid, instance, sample_uuid, sample, me):
         response = {
-            BS.SAMPLE_UUID: UUID(bytes=sample.sample_uuid).hex,
+            BS.SAMPLE_UUID: sample.sample_uuid.hex(),
             BS.SAMPLE_FINALIZED: sample.sample_finalized,
         }
 
@@ -253,9 +339,7 @@ class APISampleCollection(BaseResource):
                 return ERR_BADR("illegal param: " + BS.SAMPLE_FINALIZED)
 
         if modified:
-            instance.instance_samples_last_modified = datetime.utcnow()
-            instance.instance_samples_etag = token_hex(16)
-            instance.instance_etag = token_hex(16)  # propagate the change to the instance forcing an cache invalidation
+            instance.samples_changed(sample)
             sample.sample_last_modified = datetime.utcnow()
             sample.sample_etag = token_hex(16)
 
@@ -284,8 +368,7 @@ class APISampleCollection(BaseResource):
         Returns:
             http-status: success
         """
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_etag = token_hex(16)
+        instance.samples_changed(sample, kind=CHANGE_DELETED)
         db.session.delete(sample)
         db.session.commit()
         return SUCCESS()
@@ -321,6 +404,7 @@ class APISampleData(BaseResource):
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
     @sample_access
+    @cached_response(lambda sample, **_: sample.sample_etag)
     def get(
         self,
         model_uuid,
@@ -338,8 +422,8 @@ class APISampleData(BaseResource):
 
         response = [
             {
-                BS.SAMPLE_DATA_UUID: UUID(bytes=d.data_uuid).hex,
-                BS.SAMPLE_HAS_FILE: d.file is not None,
+                BS.SAMPLE_DATA_UUID: d.data_uuid.hex(),
+                BS.SAMPLE_HAS_FILE: d.file_id is not None,
                 BS.SAMPLE_KEY: d.data_key,
             }
             for d in data
@@ -386,8 +470,7 @@ class APISampleData(BaseResource):
         sample.sample_etag = token_hex(16)
         new_data.data_last_modified = datetime.utcnow()
         new_data.data_etag = token_hex(16)
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
 
         db.session.add(new_data)
         db.session.commit()
@@ -465,7 +548,7 @@ class APISampleDataCollection(BaseResource):
         me,
     ):
         response = {
-            BS.SAMPLE_DATA_UUID: UUID(bytes=data.data_uuid).hex,
+            BS.SAMPLE_DATA_UUID: data.data_uuid.hex(),
             BS.SAMPLE_HAS_FILE: data.file is not None,
             BS.SAMPLE_KEY: data.data_key,
         }
@@ -527,8 +610,7 @@ class APISampleDataCollection(BaseResource):
                 sample.sample_etag = token_hex(16)
                 data.data_last_modified = datetime.utcnow()
                 data.data_etag = token_hex(16)
-                instance.instance_samples_last_modified = datetime.utcnow()
-                instance.instance_samples_etag = token_hex(16)
+                instance.samples_changed(sample)
 
         db.session.commit()
         return SUCCESS()
@@ -555,8 +637,7 @@ class APISampleDataCollection(BaseResource):
 
         sample.sample_last_modified = datetime.utcnow()
         sample.sample_etag = token_hex(16)
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
 
         db.session.delete(data)
         db.session.commit()
@@ -596,6 +677,7 @@ class APISampleLabel(BaseResource):
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
     @sample_access
+    @cached_response(lambda sample, **_: sample.sample_etag)
     def get(
         self,
         model_uuid,
@@ -612,8 +694,8 @@ class APISampleLabel(BaseResource):
         data = sample.label.offset(page_offset).limit(page_limit).all()
         response = [
             {
-                BS.SAMPLE_LABEL_UUID: UUID(bytes=d.label_uuid).hex,
-                BS.SAMPLE_HAS_FILE: d.file is not None,
+                BS.SAMPLE_LABEL_UUID: d.label_uuid.hex(),
+                BS.SAMPLE_HAS_FILE: d.file_id is not None,
                 BS.SAMPLE_KEY: d.label_key,
             }
             for d in data
@@ -668,8 +750,7 @@ class APISampleLabel(BaseResource):
         sample.sample_etag = token_hex(16)
         new_label.label_last_modified = datetime.utcnow()
         new_label.label_etag = token_hex(16)
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
         db.session.add(new_label)
         db.session.commit()
 
@@ -746,7 +827,7 @@ class APISampleLabelCollection(BaseResource):
         label,
     ):
         response = {
-            BS.SAMPLE_LABEL_UUID: UUID(bytes=label.label_uuid).hex,
+            BS.SAMPLE_LABEL_UUID: label.label_uuid.hex(),
             BS.SAMPLE_HAS_FILE: label.file is not None,
             BS.SAMPLE_KEY: label.label_key,
         }
@@ -801,8 +882,7 @@ class APISampleLabelCollection(BaseResource):
         if BS.SAMPLE_KEY in json_object:
             if label.label_key != json_object[BS.SAMPLE_KEY]:
                 label.label_key = json_object[BS.SAMPLE_KEY]
-                instance.instance_samples_last_modified = datetime.utcnow()
-                instance.instance_samples_etag = token_hex(16)
+                instance.samples_changed(sample)
                 sample.sample_last_modified = datetime.utcnow()
                 sample.sample_etag = token_hex(16)
                 label.label_last_modified = datetime.utcnow()
@@ -831,8 +911,7 @@ class APISampleLabelCollection(BaseResource):
         db.session.delete(label)
         sample.sample_last_modified = datetime.utcnow()
         sample.sample_etag = token_hex(16)
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
         db.session.commit()
         return SUCCESS()
 
@@ -887,6 +966,11 @@ class APISampleDataFile(BaseResource):
         if data.file is None:
             return ERR_NOFO("no data specified")
 
+        # answer conditional requests without reading the blob
+        rsp = not_modified(data.data_etag, data.data_last_modified)
+        if rsp is not None:
+            return rsp
+
         data_raw = persistence.get_file(data.file)
         data_raw = BytesIO(data_raw)
         data_raw.seek(0)
@@ -930,9 +1014,9 @@ class APISampleDataFile(BaseResource):
         sample.sample_etag = token_hex(16)
         data.data_last_modified = datetime.utcnow()
         data.data_etag = token_hex(16)
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
 
+        release_file(db.session, data.file)
         data.file = file_pers
         db.session.commit()
 
@@ -1025,6 +1109,11 @@ class APISampleLabelFile(BaseResource):
         if label.file is None:
             return ERR_NOFO("no data specified")
 
+        # answer conditional requests without reading the blob
+        rsp = not_modified(label.label_etag, label.label_last_modified)
+        if rsp is not None:
+            return rsp
+
         data_raw = persistence.get_file(label.file)
         data_raw = BytesIO(data_raw)
         data_raw.seek(0)
@@ -1058,14 +1147,14 @@ class APISampleLabelFile(BaseResource):
 
         db.session.add(file_pers)
 
+        release_file(db.session, label.file)
         label.file = file_pers
 
         sample.sample_last_modified = datetime.utcnow()
         sample.sample_etag = token_hex(16)
         label.label_last_modified = datetime.utcnow()
         label.label_etag = token_hex(16)
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
 
         db.session.commit()
 
@@ -1108,3 +1197,320 @@ class APISampleLabelFile(BaseResource):
         me,
     ):
         return ERR_FORB()
+
+
+# content types accepted by the bulk upload
+UPLOAD_ZIP_TYPES = ["application/zip", "application/x-zip-compressed"]
+UPLOAD_TAR_TYPES = ["application/x-tar", "application/gzip", "application/x-gzip", "application/x-bzip2", "application/x-xz"]
+UPLOAD_MULTIPART = "multipart/form-data"
+
+# zip archives need random access, so they are spooled to disk above this size
+UPLOAD_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def iter_upload_entries():
+    """yield (name, stream) for every file in the body of a bulk upload.
+
+    Raises:
+        ValueError: if the content type is not supported
+    """
+    mimetype = request.mimetype
+    if mimetype == UPLOAD_MULTIPART:
+        for name, storage in request.files.items(multi=True):
+            yield name, storage.stream
+    elif mimetype in UPLOAD_ZIP_TYPES:
+        with SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE) as spool:
+            shutil.copyfileobj(request.stream, spool)
+            spool.seek(0)
+            with ZipFile(spool, "r") as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    with archive.open(info) as entry:
+                        yield info.filename, entry
+    elif mimetype in UPLOAD_TAR_TYPES:
+        # tar archives can be read strictly sequentially
+        with tarfile.open(fileobj=request.stream, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                yield member.name, archive.extractfile(member)
+    else:
+        raise ValueError("unsupported content type: " + mimetype)
+
+
+def parse_upload_name(name):
+    """split an entry name of the form <sample_uuid>/<data|label>/<key>.
+
+    Returns None if the name does not follow this layout.
+    """
+    parts = name.strip("/").split("/", 2)
+    if len(parts) != 3 or parts[1] not in [BS.SAMPLE_DATA, BS.SAMPLE_LABEL] or parts[2] == "":
+        return None
+    try:
+        sample_uuid = UUID(parts[0])
+    except ValueError:
+        return None
+    return sample_uuid.bytes, parts[1], parts[2]
+
+
+class APISampleUpload(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE, BR.ROLE_ADD_SAMPLE])
+    def post(self, model_uuid, model, instance_uuid, instance, me):
+        """Upload the files of many samples at once.
+
+        The body is either a zip or tar archive or a multipart form. Every entry
+        is named <sample_uuid>/data/<key> or <sample_uuid>/label/<key>. Entries are
+        attached to the data or label with the given key, which is created if
+        the sample has none yet. Each name may appear only once. All entries are
+        committed in one transaction.
+
+        Args:
+            model_uuid (string): model uuid from the url
+            model (ORMModel): model object
+            instance_uuid (string): instance uuid from the url
+            instance (ORMInstance): instance object
+            me (ORMUser): authenticated user calling this function
+
+        Returns:
+            list: one object per entry with the sample uuid, key and the data or label uuid
+        """
+        # stream every entry to the blob store before touching the database
+        stored = []
+
+        def discard(message, code=ERR_BADR):
+            for entry in stored:
+                persistence.remove_file(entry[3])
+            return code(message)
+
+        seen = set()
+        try:
+            for name, stream in iter_upload_entries():
+                parsed = parse_upload_name(name)
+                if parsed is None:
+                    return discard("malformed entry name: " + name)
+                # a second file for the same key would replace the first one within this upload
+                if parsed in seen:
+                    return discard("duplicate entry: " + name)
+                seen.add(parsed)
+                stored.append(parsed + (persistence.store_stream(stream),))
+        except (ValueError, BadZipFile, tarfile.TarError) as e:
+            return discard(str(e))
+
+        if len(stored) == 0:
+            return ERR_BADR("no entries found")
+
+        # resolve all addressed samples with one query
+        stmt_samples = select(ORMSample).where(
+            ORMSample.instance_id == instance.instance_id,
+            ORMSample.sample_uuid.in_({entry[0] for entry in stored}),
+        )
+        samples = {s.sample_uuid: s for s in db.session.scalars(stmt_samples)}
+
+        for sample_uuid, kind, _, _ in stored:
+            if sample_uuid not in samples:
+                return discard("unknown sample: " + sample_uuid.hex(), ERR_NOFO)
+            if kind == BS.SAMPLE_DATA and samples[sample_uuid].sample_finalized:
+                return discard("sample is finalized: " + sample_uuid.hex())
+
+        # get the existing data and labels for the addressed keys
+        sample_ids = [s.sample_id for s in samples.values()]
+        keys = {entry[2] for entry in stored}
+        stmt_data = select(ORMSampleData).where(
+            ORMSampleData.sample_id.in_(sample_ids), ORMSampleData.data_key.in_(keys)
+        )
+        stmt_label = select(ORMSampleLabel).where(
+            ORMSampleLabel.sample_id.in_(sample_ids), ORMSampleLabel.label_key.in_(keys)
+        )
+        existing = {
+            BS.SAMPLE_DATA: {(d.sample_id, d.data_key): d for d in db.session.scalars(stmt_data)},
+            BS.SAMPLE_LABEL: {(lb.sample_id, lb.label_key): lb for lb in db.session.scalars(stmt_label)},
+        }
+
+        now = datetime.utcnow()
+        response = []
+        for sample_uuid, kind, key, file_pers in stored:
+            sample = samples[sample_uuid]
+            db.session.add(file_pers)
+
+            target = existing[kind].get((sample.sample_id, key))
+            if kind == BS.SAMPLE_DATA:
+                if target is None:
+                    target = ORMSampleData()
+                    target.sample = sample
+                    target.data_uuid = uuid4().bytes
+                    target.data_key = key
+                    db.session.add(target)
+                    existing[kind][(sample.sample_id, key)] = target
+                release_file(db.session, target.file)
+                target.file = file_pers
+                target.data_last_modified = now
+                target.data_etag = token_hex(16)
+                target_uuid = target.data_uuid
+            else:
+                if target is None:
+                    target = ORMSampleLabel()
+                    target.sample = sample
+                    target.label_uuid = uuid4().bytes
+                    target.label_key = key
+                    # mark this label as not mergeable if the sample is already finalized
+                    target.mergeable = not sample.sample_finalized
+                    db.session.add(target)
+                    existing[kind][(sample.sample_id, key)] = target
+                release_file(db.session, target.file)
+                target.file = file_pers
+                target.label_last_modified = now
+                target.label_etag = token_hex(16)
+                target_uuid = target.label_uuid
+
+            response.append(
+                {
+                    BS.SAMPLE_UUID: sample_uuid.hex(),
+                    BS.SAMPLE_KEY: key,
+                    (BS.SAMPLE_DATA_UUID if kind == BS.SAMPLE_DATA else BS.SAMPLE_LABEL_UUID): target_uuid.hex(),
+                }
+            )
+
+        for sample in samples.values():
+            sample.sample_last_modified = now
+            sample.sample_etag = token_hex(16)
+        instance.samples_changed(*samples.values())
+
+        db.session.commit()
+
+        return SUCCESS(response)
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def put(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
+class APISampleFinalize(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE, BR.ROLE_EDIT_INSTANCE])
+    @sample_filter
+    @json_request
+    def put(
+        self,
+        model_uuid,
+        model,
+        instance_uuid,
+        instance,
+        me,
+        filter_include,
+        filter_exclude,
+        json_object,
+    ):
+        """Finalize or unfinalize all matching samples with a single update.
+
+        The samples are selected by the tag filters from the query string and an
+        optional list of uuids in the sample_uuid field of the body.
+
+        Args:
+            model_uuid (string): model uuid from the url
+            model (ORMModel): model object
+            instance_uuid (string): instance uuid from the url
+            instance (ORMInstance): instance object
+            me (ORMUser): authenticated user calling this function
+            filter_include ([string]): tags a sample needs to have
+            filter_exclude ([string]): tags a sample must not have
+            json_object (dict): the request body
+
+        Returns:
+            object: the number of changed samples
+        """
+        if BS.SAMPLE_FINALIZED not in json_object:
+            return ERR_BADR("missing field: " + BS.SAMPLE_FINALIZED)
+        try:
+            _finalized = min(1, max(0, int(json_object[BS.SAMPLE_FINALIZED])))
+        except (ValueError, TypeError):
+            return ERR_BADR("illegal param: " + BS.SAMPLE_FINALIZED)
+
+        criteria = [
+            ORMSample.instance_id == instance.instance_id,
+            ORMSample.sample_finalized != _finalized,
+        ]
+
+        if BS.SAMPLE_UUID in json_object:
+            uuids = json_object[BS.SAMPLE_UUID]
+            if not isinstance(uuids, list):
+                return ERR_BADR("Expected a list of sample uuids")
+            try:
+                uuids = [UUID(u).bytes for u in uuids]
+            except (ValueError, TypeError, AttributeError):
+                return ERR_BADR("sample_uuid malformed")
+            criteria.append(ORMSample.sample_uuid.in_(uuids))
+
+        def tagged(tags):
+            return (
+                select(ORMAssociationTags.sample_id)
+                .join(ORMAssociationTags.tag)
+                .where(ORMSampleTag.instance_id == instance.instance_id, ORMSampleTag.tag_name.in_(tags))
+            )
+
+        if len(filter_include) > 0:
+            criteria.append(ORMSample.sample_id.in_(tagged(filter_include)))
+        if len(filter_exclude) > 0:
+            criteria.append(ORMSample.sample_id.not_in(tagged(filter_exclude)))
+
+        # log the samples about to change before changing them
+        instance.samples_changed_where(*criteria)
+
+        etag = token_hex(16)
+        stmt = (
+            update(ORMSample)
+            .where(*criteria)
+            .values(
+                sample_finalized=_finalized,
+                sample_last_modified=datetime.utcnow(),
+                # keep the etags of the samples distinct from each other
+                sample_etag=literal(etag) + cast(ORMSample.sample_id, String),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        count = db.session.execute(stmt).rowcount
+
+        db.session.commit()
+
+        return SUCCESS({BS.SAMPLE_COUNT: count})
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
@@ -15,6 +15,9 @@
 
 from datetime import datetime
 from secrets import token_hex
+from uuid import UUID
+from sqlalchemy import select, insert, delete, update, exists, tuple_, literal, cast, String
+from sqlalchemy.orm import joinedload
 from koi_api.orm import db
 from koi_api.resources.base import (
     BaseResource,
@@ -22,13 +25,37 @@ from koi_api.resources.base import (
     model_access,
     instance_access,
 )
-from koi_api.resources.base import sample_access, json_request
-from koi_api.orm.sample import ORMAssociationTags, ORMSampleTag
-from koi_api.common.return_codes import ERR_FORB, SUCCESS, ERR_BADR
-from koi_api.common.string_constants import BODY_ROLE as BR, BODY_TAG as BT
+from koi_api.resources.base import sample_access, json_request, cached_response
+from koi_api.orm.sample import ORMAssociationTags, ORMSampleTag, ORMSample
+from koi_api.common.return_codes import ERR_FORB, SUCCESS, ERR_BADR, ERR_NOFO
+from koi_api.common.string_constants import BODY_ROLE as BR, BODY_TAG as BT, BODY_SAMPLE as BS
 from koi_api.resources.lifetime import LT_COLLECTION
 
 
+def delete_orphaned_tags(instance):
+    """drop all tags of the instance that are not assigned to any sample"""
+    stmt = (
+        delete(ORMSampleTag)
+        .where(
+            ORMSampleTag.instance_id == instance.instance_id,
+            ~exists().where(ORMAssociationTags.tag_id == ORMSampleTag.tag_id),
+        )
+        .execution_options(synchronize_session="fetch")
+    )
+    db.session.execute(stmt)
+
+
+def check_tag(tag):
+    """check that a tag from a request is a dict with a valid name, returns an error response or None"""
+    if not isinstance(tag, dict):
+        return ERR_BADR("Expected a tag to be a dict")
+    if BT.TAG_NAME not in tag.keys():
+        return ERR_BADR("Expected a tag to have a 'name' key")
+    if not isinstance(tag[BT.TAG_NAME], str):
+        return ERR_BADR("Expected a tag name to be a string")
+    return None
+
+
 class APISampleTag(BaseResource):
     @authenticated
     @model_access([BR.ROLE_SEE_MODEL])
@@ -46,12 +73,13 @@ class APISampleTag(BaseResource):
     @model_access([BR.ROLE_SEE_MODEL])
     @instance_access([BR.ROLE_SEE_INSTANCE])
     @sample_access
+    @cached_response(lambda sample, **_: sample.sample_etag)
     def get(
         self, model_uuid, model, instance_uuid, instance, sample_uuid, sample, me,
     ):
         """
         """
-        tags = sample.tags
+        tags = sample.tags.options(joinedload(ORMAssociationTags.tag))
 
         response = [{BT.TAG_NAME: tag.tag.tag_name} for tag in tags]
 
@@ -85,65 +113,54 @@ class APISampleTag(BaseResource):
         if not isinstance(json_object, list):
             return ERR_BADR("Expected a list of tags")
 
-        # go through all tags in the json_list
+        # check all tags before changing anything
         for tag in json_object:
-            # check that the tag is a dict with teh valid format
-            if not isinstance(tag, dict):
-                return ERR_BADR("Expected a tag to be a dict")
-            if BT.TAG_NAME not in tag.keys():
-                return ERR_BADR("Expected a tag to have a 'name' key")
-            if not isinstance(tag[BT.TAG_NAME], str):
-                return ERR_BADR("Expected a tag name to be a string")
+            error = check_tag(tag)
+            if error is not None:
+                return error
+
+        # get all tags currently registered and the names assigned to this sample
+        all_tags = {t.tag_name: t for t in instance.tags}
+        stmt_assigned = (
+            select(ORMSampleTag.tag_name)
+            .join(ORMSampleTag.samples)
+            .where(ORMAssociationTags.sample_id == sample.sample_id)
+        )
+        assigned = set(db.session.scalars(stmt_assigned))
 
-            # get all tags currently registered
-            all_tags = {t.tag_name: t for t in instance.tags}
+        for tag in json_object:
+            # check that the current tag is not already asigned
+            if tag[BT.TAG_NAME] in assigned:
+                continue
 
             # is the current tag known?
-            if tag[BT.TAG_NAME] in all_tags.keys():
-                current_tag = all_tags[tag[BT.TAG_NAME]]
-
-                # check that the current tag is not already asigned
-                sample_tags = [t.tag for t in sample.tags]
-                if current_tag not in sample_tags:
-                    # generate new association between sample and tag
-                    new_assoc = ORMAssociationTags()
-                    new_assoc.sample = sample
-                    new_assoc.tag = current_tag
-
-                    # check if this association is to be kept when merging?
-                    if sample.sample_finalized:
-                        new_assoc.mergeable = False
-                    else:
-                        new_assoc.mergeable = True
-
-                    db.session.add(new_assoc)
-                    changed = True
+            current_tag = all_tags.get(tag[BT.TAG_NAME])
+            if current_tag is None:
+                # create a new tag
+                current_tag = ORMSampleTag()
+                current_tag.tag_name = tag[BT.TAG_NAME]
+                current_tag.instance = instance
+                db.session.add(current_tag)
+                all_tags[current_tag.tag_name] = current_tag
+
+            # generate new association between sample and tag
+            new_assoc = ORMAssociationTags()
+            new_assoc.sample = sample
+            new_assoc.tag = current_tag
+
+            # check if this association is to be kept when merging?
+            if sample.sample_finalized:
+                new_assoc.mergeable = False
             else:
+                new_assoc.mergeable = True
 
-                # create a new tag and associate it
-                new_tag = ORMSampleTag()
-                new_tag.tag_name = tag[BT.TAG_NAME]
-                new_tag.instance = instance
-                db.session.add(new_tag)
-
-                # generate new association between sample and tag
-                new_assoc = ORMAssociationTags()
-                new_assoc.sample = sample
-                new_assoc.tag = new_tag
+            db.session.add(new_assoc)
+            assigned.add(current_tag.tag_name)
 
-                # check if this association is to be kept when merging?
-                if sample.sample_finalized:
-                    new_assoc.mergeable = False
-                else:
-                    new_assoc.mergeable = True
-
-                db.session.add(new_assoc)
-
-                changed = True
+            changed = True
 
         if changed:
-            instance.instance_samples_last_modified = datetime.utcnow()
-            instance.instance_samples_etag = token_hex(16)
+            instance.samples_changed(sample)
             sample.sample_last_modified = datetime.utcnow()
             sample.sample_etag = token_hex(16)
             db.session.commit()
@@ -185,12 +202,9 @@ class APISampleTag(BaseResource):
         tags = sample.tags
         for tag_assoc in tags:
             db.session.delete(tag_assoc)
-        for tag in instance.tags:
-            if len(tag.samples) == 0:
-                db.session.delete(tag)
+        delete_orphaned_tags(instance)
 
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
         sample.sample_last_modified = datetime.utcnow()
         sample.sample_etag = token_hex(16)
         db.session.commit()
@@ -213,12 +227,9 @@ class APISampleTagCollection(BaseResource):
             if t.tag.tag_name == tag:
                 db.session.delete(t)
 
-        for tag in instance.tags:
-            if len(tag.samples) == 0:
-                db.session.delete(tag)
+        delete_orphaned_tags(instance)
 
-        instance.instance_samples_last_modified = datetime.utcnow()
-        instance.instance_samples_etag = token_hex(16)
+        instance.samples_changed(sample)
         sample.sample_last_modified = datetime.utcnow()
         sample.sample_etag = token_hex(16)
         db.session.commit()
@@ -275,3 +286,150 @@ class APISampleTagCollection(BaseResource):
         tag
     ):
         return ERR_FORB()
+
+
+class APISampleTagBulk(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    @json_request
+    def put(
+        self,
+        model_uuid,
+        model,
+        instance_uuid,
+        instance,
+        me,
+        json_object,
+    ):
+        """Add and remove tags of many samples at once.
+
+        The body holds the lists "add" and "remove" of objects with a sample_uuid
+        and a tag name. Removals are applied before additions.
+        """
+        if not isinstance(json_object, dict):
+            return ERR_BADR("Expected an object with the fields add and remove")
+
+        # parse and check all pairs
+        pairs = dict()
+        for field in [BT.TAG_ADD, BT.TAG_REMOVE]:
+            entries = json_object.get(field, [])
+            if not isinstance(entries, list):
+                return ERR_BADR("Expected a list of tags in " + field)
+            pairs[field] = set()
+            for entry in entries:
+                error = check_tag(entry)
+                if error is not None:
+                    return error
+                try:
+                    sample_uuid = UUID(entry[BS.SAMPLE_UUID]).bytes
+                except (KeyError, ValueError, TypeError, AttributeError):
+                    return ERR_BADR("Expected a tag to have a valid 'sample_uuid'")
+                pairs[field].add((sample_uuid, entry[BT.TAG_NAME]))
+
+        if len(pairs[BT.TAG_ADD]) == 0 and len(pairs[BT.TAG_REMOVE]) == 0:
+            return SUCCESS()
+
+        # resolve all samples with one query
+        all_pairs = pairs[BT.TAG_ADD] | pairs[BT.TAG_REMOVE]
+        stmt_samples = select(ORMSample.sample_uuid, ORMSample.sample_id, ORMSample.sample_finalized).where(
+            ORMSample.instance_id == instance.instance_id,
+            ORMSample.sample_uuid.in_({p[0] for p in all_pairs}),
+        )
+        samples = {row.sample_uuid: row for row in db.session.execute(stmt_samples)}
+        for sample_uuid, _ in all_pairs:
+            if sample_uuid not in samples:
+                return ERR_NOFO("unknown sample: " + sample_uuid.hex())
+
+        # resolve all tag names with one query
+        stmt_tags = select(ORMSampleTag.tag_name, ORMSampleTag.tag_id).where(
+            ORMSampleTag.instance_id == instance.instance_id,
+            ORMSampleTag.tag_name.in_({p[1] for p in all_pairs}),
+        )
+        tags = {row.tag_name: row.tag_id for row in db.session.execute(stmt_tags)}
+
+        changed = set()
+
+        # remove the present associations in one statement
+        remove = {(samples[s].sample_id, tags[t]) for s, t in pairs[BT.TAG_REMOVE] if t in tags}
+        if len(remove) > 0:
+            stmt_present = select(ORMAssociationTags.sample_id, ORMAssociationTags.tag_id).where(
+                tuple_(ORMAssociationTags.sample_id, ORMAssociationTags.tag_id).in_(remove)
+            )
+            remove = {tuple(row) for row in db.session.execute(stmt_present)}
+        if len(remove) > 0:
+            stmt_remove = delete(ORMAssociationTags).where(
+                tuple_(ORMAssociationTags.sample_id, ORMAssociationTags.tag_id).in_(remove)
+            ).execution_options(synchronize_session=False)
+            db.session.execute(stmt_remove)
+            changed.update(r[0] for r in remove)
+
+        if len(pairs[BT.TAG_ADD]) > 0:
+            # create the unknown tags
+            new_names = {t for _, t in pairs[BT.TAG_ADD] if t not in tags}
+            if len(new_names) > 0:
+                db.session.execute(
+                    insert(ORMSampleTag),
+                    [{"tag_name": name, "instance_id": instance.instance_id} for name in new_names],
+                )
+                tags = {row.tag_name: row.tag_id for row in db.session.execute(stmt_tags)}
+
+            # insert the associations which are not present yet in one statement
+            add = {(samples[s].sample_id, tags[t]) for s, t in pairs[BT.TAG_ADD]}
+            stmt_existing = select(ORMAssociationTags.sample_id, ORMAssociationTags.tag_id).where(
+                tuple_(ORMAssociationTags.sample_id, ORMAssociationTags.tag_id).in_(add)
+            )
+            add -= {tuple(row) for row in db.session.execute(stmt_existing)}
+            finalized = {row.sample_id for row in samples.values() if row.sample_finalized}
+            if len(add) > 0:
+                db.session.execute(
+                    insert(ORMAssociationTags),
+                    [
+                        # associations added after finalizing are not kept when merging
+                        {"sample_id": sample_id, "tag_id": tag_id, "mergeable": sample_id not in finalized}
+                        for sample_id, tag_id in add
+                    ],
+                )
+                changed.update(a[0] for a in add)
+
+        if len(remove) > 0:
+            delete_orphaned_tags(instance)
+
+        if len(changed) > 0:
+            now = datetime.utcnow()
+            etag = token_hex(16)
+            db.session.execute(
+                update(ORMSample)
+                .where(ORMSample.sample_id.in_(changed))
+                .values(
+                    sample_last_modified=now,
+                    sample_etag=literal(etag) + cast(ORMSample.sample_id, String),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            instance.samples_changed_where(ORMSample.sample_id.in_(changed))
+
+        db.session.commit()
+
+        return SUCCESS({BS.SAMPLE_COUNT: len(changed)})
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
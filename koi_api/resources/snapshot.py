@@ -0,0 +1,185 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from uuid import UUID
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+from sqlalchemy import select
+from koi_api.orm import db
+from koi_api.orm.job import JOB_DONE, JOB_FAILED
+from koi_api.orm.snapshot import ORMSnapshot, ORMSnapshotShard
+from koi_api.jobs.snapshot import new_snapshot
+from koi_api.persistence import persistence
+from koi_api.resources.base import BaseResource, authenticated, model_access, instance_access
+from koi_api.common.return_codes import ERR_FORB, ERR_NOFO, ERR_BADR, SUCCESS
+from koi_api.common.string_constants import BODY_SNAPSHOT as BSN, BODY_ROLE as BR
+from koi_api.resources.lifetime import LT_COLLECTION, LT_SNAPSHOT
+
+
+def snapshot_body(snapshot):
+    if snapshot is None:
+        return None
+    return {
+        BSN.SNAPSHOT_UUID: snapshot.snapshot_uuid.hex(),
+        BSN.SNAPSHOT_VERSION: snapshot.snapshot_version,
+        BSN.SNAPSHOT_PHASE: snapshot.snapshot_phase,
+        BSN.SNAPSHOT_SAMPLES: snapshot.snapshot_samples,
+        BSN.SNAPSHOT_ERROR: snapshot.snapshot_error,
+        BSN.SNAPSHOT_CREATED: snapshot.snapshot_created.isoformat(),
+        BSN.SNAPSHOT_SHARDS: [
+            {
+                BSN.SHARD_INDEX: shard.shard_index,
+                BSN.SHARD_SIZE: shard.shard_size,
+                BSN.SHARD_SAMPLES: shard.shard_samples,
+            }
+            for shard in snapshot.shards
+        ],
+    }
+
+
+class APIInstanceSnapshot(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, me):
+        """Report the snapshot of the current samples of the instance and the newest finished snapshot.
+
+        Reading builds nothing, the current snapshot is null until a POST scheduled it.
+        """
+        _, version = instance.samples_version()
+
+        stmt = (
+            select(ORMSnapshot)
+            .where(ORMSnapshot.instance_id == instance.instance_id, ORMSnapshot.snapshot_version == version)
+            .order_by(ORMSnapshot.snapshot_id.desc())
+            .limit(1)
+        )
+        current = db.session.scalars(stmt).one_or_none()
+
+        stmt_ready = (
+            select(ORMSnapshot)
+            .where(ORMSnapshot.instance_id == instance.instance_id, ORMSnapshot.snapshot_phase == JOB_DONE)
+            .order_by(ORMSnapshot.snapshot_id.desc())
+            .limit(1)
+        )
+        ready = db.session.scalars(stmt_ready).one_or_none()
+        if current is None and ready is None:
+            return ERR_NOFO("no snapshot built yet")
+
+        return SUCCESS(
+            {
+                BSN.SNAPSHOT_VERSION: version,
+                BSN.SNAPSHOT_CURRENT: snapshot_body(current),
+                BSN.SNAPSHOT_READY: snapshot_body(ready),
+            },
+            valid_seconds=LT_COLLECTION,
+        )
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, me):
+        """Schedule a snapshot of the current samples unless one exists or is being built already.
+        A failed build is started again.
+        """
+        _, version = instance.samples_version()
+
+        stmt = (
+            select(ORMSnapshot)
+            .where(ORMSnapshot.instance_id == instance.instance_id, ORMSnapshot.snapshot_version == version)
+            .order_by(ORMSnapshot.snapshot_id.desc())
+            .limit(1)
+        )
+        current = db.session.scalars(stmt).one_or_none()
+        if current is None or current.snapshot_phase == JOB_FAILED:
+            current = new_snapshot(instance, version)
+            db.session.commit()
+            db.session.refresh(current)
+
+        return SUCCESS(snapshot_body(current))
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def put(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+
+class APIInstanceSnapshotShard(BaseResource):
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def get(self, model_uuid, model, instance_uuid, instance, snapshot_uuid, shard_index, me):
+        """Download one tar archive of a finished snapshot, supports Range and conditional requests"""
+        try:
+            snapshot_uuid = UUID(snapshot_uuid).bytes
+        except ValueError:
+            return ERR_BADR("snapshot_uuid malformed")
+
+        stmt = (
+            select(ORMSnapshotShard, ORMSnapshot)
+            .join(ORMSnapshotShard.snapshot)
+            .where(
+                ORMSnapshot.snapshot_uuid == snapshot_uuid,
+                ORMSnapshot.instance_id == instance.instance_id,
+                ORMSnapshot.snapshot_phase == JOB_DONE,
+                ORMSnapshotShard.shard_index == shard_index,
+            )
+        )
+        row = db.session.execute(stmt).one_or_none()
+        if row is None:
+            return ERR_NOFO("shard unknown")
+        shard, snapshot = row
+
+        # the archive is streamed, werkzeug seeks into the uncompressed blob to answer range requests
+        rsp = Response(
+            wrap_file(request.environ, persistence.open_file(shard.file)),
+            mimetype="application/x-tar",
+            direct_passthrough=True,
+        )
+        rsp.content_length = shard.shard_size
+        rsp.last_modified = snapshot.snapshot_created
+        rsp.set_etag(snapshot.snapshot_uuid.hex() + "-" + str(shard.shard_index))
+        rsp.cache_control.max_age = LT_SNAPSHOT
+        return rsp.make_conditional(request, accept_ranges=True, complete_length=shard.shard_size)
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def post(self, model_uuid, model, instance_uuid, instance, snapshot_uuid, shard_index, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def put(self, model_uuid, model, instance_uuid, instance, snapshot_uuid, shard_index, me):
+        """Forbidden action"""
+        return ERR_FORB()
+
+    @authenticated
+    @model_access([BR.ROLE_SEE_MODEL])
+    @instance_access([BR.ROLE_SEE_INSTANCE])
+    def delete(self, model_uuid, model, instance_uuid, instance, snapshot_uuid, shard_index, me):
+        """Forbidden action"""
+        return ERR_FORB()
@@ -16,7 +16,7 @@
 from flask_restful import request
 import secrets
 from sqlalchemy import select
-from uuid import uuid4, UUID
+from uuid import uuid4
 from hashlib import sha256
 from datetime import datetime, timedelta
 from koi_api.common.return_codes import (
@@ -54,7 +54,7 @@ class APIUser(BaseResource):
         stmt_users = select(ORMUser).offset(page_offset).limit(page_limit)
         users = db.session.scalars(stmt_users).all()
 
-        return SUCCESS([{BU.USER_UUID: UUID(bytes=u.user_uuid).hex, BU.USER_NAME: u.user_name} for u in users])
+        return SUCCESS([{BU.USER_UUID: u.user_uuid.hex(), BU.USER_NAME: u.user_name} for u in users])
 
     @authenticated
     @user_access([BR.ROLE_EDIT_USERS])
@@ -115,7 +115,7 @@ class APIUserCollection(BaseResource):
 
         return SUCCESS(
             {
-                BU.USER_UUID: UUID(bytes=user.user_uuid).hex,
+                BU.USER_UUID: user.user_uuid.hex(),
                 BU.USER_NAME: user.user_name,
                 BU.USER_ESSENTIAL: user.is_essential,
                 BU.USER_CREATED: user.user_created.isoformat(),
@@ -276,7 +276,7 @@ class APILogin(BaseResource):
 
         # respond
         return SUCCESS(
-            {BU.USER_UUID: UUID(bytes=user.user_uuid).hex, BG.TOKEN: token_value, BG.EXPIRES: token_valid.isoformat()}
+            {BU.USER_UUID: user.user_uuid.hex(), BG.TOKEN: token_value, BG.EXPIRES: token_valid.isoformat()}
         )
 
     def put(self):
@@ -0,0 +1,188 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+import hashlib
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from uuid import uuid4
+from sqlalchemy import select, insert, update, text
+from koi_api.orm import db
+from koi_api.orm.meta import ORMMeta, META_SEED_FINGERPRINT
+from koi_api.orm.role import ORMUserRoleGeneral, ORMUserRoleModel, ORMUserRoleInstance
+from koi_api.orm.user import ORMUser
+from koi_api.orm.access import ORMAccessGeneral
+from koi_api.resources.user import hash_password
+
+
+# pair the config keys with their appropriate ORM-constructors
+SEED_ROLES = [
+    ("INITIAL_INSTANCE_ROLES", ORMUserRoleInstance),
+    ("INITIAL_MODEL_ROLES", ORMUserRoleModel),
+    ("INITIAL_GENERAL_ROLES", ORMUserRoleGeneral),
+    ("ADDITIONAL_GENERAL_ROLES", ORMUserRoleGeneral),
+]
+SEED_USERS = ["INITIAL_USERS", "ADDITIONAL_USERS"]
+
+SEED_LOCK_NAME = "koi_seed"
+SEED_LOCK_KEY = 0x6B6F69
+SEED_LOCK_TIMEOUT = 60
+
+
+def seed_fingerprint(config):
+    """digest of all config entries the database is seeded from"""
+    seed = {key: config.get(key) for key, _ in SEED_ROLES}
+    seed.update({key: config.get(key) for key in SEED_USERS})
+    return hashlib.sha256(json.dumps(seed, sort_keys=True, default=str).encode("utf8")).hexdigest()
+
+
+def stored_fingerprint():
+    return db.session.scalar(select(ORMMeta.meta_value).where(ORMMeta.meta_key == META_SEED_FINGERPRINT))
+
+
+@contextmanager
+def seed_lock():
+    """hold a database wide lock while seeding, so concurrently starting workers seed one after another.
+
+    The lock lives on its own connection, it has to outlast the commit of the seeding session.
+    """
+    with db.engine.connect() as conn:
+        dialect = conn.dialect.name
+        if dialect == "mysql":
+            acquired = conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"), {"name": SEED_LOCK_NAME, "timeout": SEED_LOCK_TIMEOUT}
+            ).scalar()
+            if acquired != 1:
+                raise RuntimeError("could not acquire the seed lock")
+        elif dialect == "postgresql":
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SEED_LOCK_KEY})
+        try:
+            yield
+        finally:
+            if dialect == "mysql":
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SEED_LOCK_NAME})
+            elif dialect == "postgresql":
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SEED_LOCK_KEY})
+
+
+def seed_roles(config):
+    """add missing roles and update the description and privileges of the known ones"""
+    for role_type, role_object in SEED_ROLES:
+        # a role named twice is seeded once from its last entry
+        roles = list({r["name"]: r for r in config.get(role_type, [])}.values())
+        if len(roles) == 0:
+            continue
+
+        stmt = select(role_object.role_name, role_object.role_id).where(
+            role_object.role_name.in_([r["name"] for r in roles])
+        )
+        known = dict(db.session.execute(stmt).all())
+
+        # do not update the uuid and the name of known roles
+        updates = []
+        inserts = []
+        for role in roles:
+            values = {"role_description": role["description"], "is_essential": role["is_essential"]}
+            values.update(role["priviledges"])
+            if role["name"] in known:
+                values["role_id"] = known[role["name"]]
+                updates.append(values)
+            else:
+                values["role_name"] = role["name"]
+                values["role_uuid"] = uuid4().bytes
+                inserts.append(values)
+
+        if len(updates) > 0:
+            db.session.execute(update(role_object), updates)
+        if len(inserts) > 0:
+            db.session.execute(insert(role_object), inserts)
+
+
+def seed_users(config):
+    """add missing users and their general roles, existing users are not edited"""
+    users = [user for user_type in SEED_USERS for user in config.get(user_type, [])]
+    if len(users) == 0:
+        return
+
+    names = [u["name"] for u in users]
+    known = set(db.session.scalars(select(ORMUser.user_name).where(ORMUser.user_name.in_(names))))
+    now = datetime.utcnow()
+    new_users = []
+    for user in users:
+        if user["name"] in known:
+            continue
+        known.add(user["name"])
+        new_users.append(
+            {
+                "user_name": user["name"],
+                "user_uuid": uuid4().bytes,
+                "user_hash": hash_password(user["password"]),
+                "user_created": now,
+                "is_essential": user["is_essential"],
+            }
+        )
+    if len(new_users) > 0:
+        db.session.execute(insert(ORMUser), new_users)
+
+    stmt = select(ORMUser.user_name, ORMUser.user_id).where(ORMUser.user_name.in_(names))
+    user_ids = dict(db.session.execute(stmt).all())
+    role_names = {r for u in users for r in u["general_roles"]}
+    stmt = select(ORMUserRoleGeneral.role_name, ORMUserRoleGeneral.role_id).where(
+        ORMUserRoleGeneral.role_name.in_(role_names)
+    )
+    role_ids = dict(db.session.execute(stmt).all())
+    stmt = select(ORMAccessGeneral.user_id, ORMAccessGeneral.role_id).where(
+        ORMAccessGeneral.user_id.in_(user_ids.values())
+    )
+    assigned = {tuple(row) for row in db.session.execute(stmt)}
+
+    # for each role assigned to a user, add it if not present
+    new_access = []
+    for user in users:
+        for role_name in user["general_roles"]:
+            # roles unknown to the database are skipped
+            if role_name not in role_ids:
+                continue
+            pair = (user_ids[user["name"]], role_ids[role_name])
+            if pair in assigned:
+                continue
+            assigned.add(pair)
+            new_access.append({"user_id": pair[0], "role_id": pair[1], "access_uuid": uuid4().bytes})
+    if len(new_access) > 0:
+        db.session.execute(insert(ORMAccessGeneral), new_access)
+
+
+def seed_database(config):
+    """seed the roles and users of the config unless the database was seeded from the same config already.
+
+    Returns:
+        bool: True if the database was seeded
+    """
+    fingerprint = seed_fingerprint(config)
+    if stored_fingerprint() == fingerprint:
+        return False
+    db.session.rollback()
+
+    with seed_lock():
+        # another worker may have seeded while this one waited for the lock
+        if stored_fingerprint() == fingerprint:
+            db.session.rollback()
+            return False
+
+        seed_roles(config)
+        seed_users(config)
+        db.session.merge(ORMMeta(meta_key=META_SEED_FINGERPRINT, meta_value=fingerprint))
+        db.session.commit()
+    return True
@@ -0,0 +1,116 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+"""Serve koi_api with several processes sharing one socket.
+
+Install the server with ``pip install koi-api[serve]`` and run::
+
+    koi-serve --port 8080 --workers 4 --threads 8
+
+Every worker process creates its own app and connection pool. The pool
+holds one connection per thread unless ``KOI_DB_POOL_SIZE`` is set, so the
+database has to accept ``workers * (threads + DB_MAX_OVERFLOW)`` connections.
+Every worker resumes the jobs abandoned by a stopped process once their
+lease expired. Workers that exit are restarted, SIGTERM and SIGINT stop all
+of them.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="koi-serve", description="serve koi_api with several processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("KOI_WORKERS", 1)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("KOI_THREADS", 8)))
+    parser.add_argument("--max-request-body-size", type=int, default=8589934592)
+    return parser.parse_args(argv)
+
+
+def run_worker(sock, args):
+    from waitress import serve
+    from koi_api import create_app
+
+    os.environ.setdefault("KOI_DB_POOL_SIZE", str(args.threads))
+
+    app = create_app()
+    if app is None:
+        sys.exit("database unreachable")
+
+    serve(app, sockets=[sock], threads=args.threads, max_request_body_size=args.max_request_body_size)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sock = socket.create_server((args.host, args.port))
+
+    # without fork everything runs in this process
+    if args.workers <= 1 or not hasattr(os, "fork"):
+        run_worker(sock, args)
+        return
+
+    children = dict()
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(sock, args)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                code = 1
+            os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    while len(children) > 0:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            # do not restart a failing worker in a tight loop
+            time.sleep(1)
+            spawn(index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from flask.testing import FlaskClient
+from typing import Tuple
+import marshal
+import os
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+from koi_api.orm import db, dispose_engines, engine_options, fork_apps, replicas
+from koi_api.serve import parse_args
+from koi_api.common.profiler import profiler
+from koi_api.persistence.stats import stats
+from . import make_empty_model, make_empty_instance
+
+
+def test_pool(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+
+    ret = client.get("/api/admin/pool", headers=header)
+    assert ret.status_code == 200
+    body = ret.get_json()
+    assert body["pid"] == os.getpid()
+    assert "pool" in body["pools"]["default"]
+
+    ret = client.delete("/api/admin/pool", headers=header)
+    assert ret.status_code == 405
+
+    # guests are no administrators
+    ret = client.post("/api/login", json={"user_name": "guest", "password": "guest"})
+    guest = {"Authorization": f"Bearer {ret.get_json()['token']}"}
+    ret = client.get("/api/admin/pool", headers=guest)
+    assert ret.status_code == 405
+    assert "pools" not in (ret.get_json() or {})
+
+
+def test_persistence_stats(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    ret = client.get("/api/admin/persistence", headers=header)
+    assert ret.status_code == 200
+    before = ret.get_json()
+    assert before["thresholds"]["read"] == 0.5
+
+    # every operation is slow with a threshold of zero
+    thresholds = stats.thresholds
+    stats.thresholds = {op: 0.0 for op in thresholds}
+    try:
+        ret = client.post(f"{base}/sample", headers=header, json={})
+        url = f"{base}/sample/{ret.get_json()['sample_uuid']}"
+        ret = client.post(f"{url}/data", headers=header, json={"key": "image"})
+        url = f"{url}/data/{ret.get_json()['data_uuid']}/file"
+        ret = client.post(url, headers=header, data=b"a" * 10000)
+        assert ret.status_code == 200
+        ret = client.get(url, headers=header)
+        assert ret.get_data() == b"a" * 10000
+    finally:
+        stats.thresholds = thresholds
+
+    ret = client.get("/api/admin/persistence", headers=header)
+    body = ret.get_json()
+    for op in ["read", "write"]:
+        assert body["operations"][op]["count"] > before["operations"][op]["count"]
+        assert body["operations"][op]["slow_count"] > before["operations"][op]["slow_count"]
+    gzip = body["codecs"]["gzip"]
+    assert gzip["written_bytes"] - before["codecs"].get("gzip", {}).get("written_bytes", 0) >= 10000
+    assert gzip["ratio"] > 1
+    slow = [entry for entry in body["slow"] if entry["raw_bytes"] == 10000]
+    assert [entry["op"] for entry in slow[-2:]] == ["write", "read"]
+    assert slow[-1]["stored_bytes"] < 10000
+
+    ret = client.get("/metrics")
+    assert b'koi_persistence_codec_seconds_count{op="compress",codec="gzip"}' in ret.get_data()
+
+    # guests are no administrators
+    ret = client.post("/api/login", json={"user_name": "guest", "password": "guest"})
+    guest = {"Authorization": f"Bearer {ret.get_json()['token']}"}
+    ret = client.get("/api/admin/persistence", headers=guest)
+    assert ret.status_code == 405
+
+
+def test_profile(app, auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    client.delete("/api/admin/profile", headers=header)
+
+    # admins profile a request with the header
+    ret = client.get("/api/model", headers={**header, "X-Profile": "1"})
+    assert ret.status_code == 200
+    profile_id = int(ret.headers["X-Profile-Id"])
+
+    ret = client.get("/api/admin/profile", headers=header)
+    assert ret.status_code == 200
+    profiles = ret.get_json()
+    assert len(profiles) == 1
+    assert profiles[0]["profile_id"] == profile_id
+    assert profiles[0]["resource"] == "APIModel"
+    assert profiles[0]["method"] == "GET"
+    assert profiles[0]["status"] == 200
+    assert profiles[0]["trigger"] == "header"
+    assert profiles[0]["queries"] > 0
+
+    # the download loads with pstats, the text is a pstats table
+    ret = client.get(f"/api/admin/profile/{profile_id}", headers=header)
+    assert ret.status_code == 200
+    assert len(marshal.loads(ret.get_data())) > 0
+    ret = client.get(f"/api/admin/profile/{profile_id}?format=text&sort=tottime&limit=5", headers=header)
+    assert ret.status_code == 200
+    assert b"tottime" in ret.get_data()
+    ret = client.get(f"/api/admin/profile/{profile_id}?format=text&sort=nope", headers=header)
+    assert ret.status_code == 400
+    ret = client.get(f"/api/admin/profile/{profile_id + 1000}", headers=header)
+    assert ret.status_code == 404
+
+    # guests can not profile or read the profiles
+    ret = client.post("/api/login", json={"user_name": "guest", "password": "guest"})
+    guest = {"Authorization": f"Bearer {ret.get_json()['token']}"}
+    ret = client.get("/api/model", headers={**guest, "X-Profile": "1"})
+    assert "X-Profile-Id" not in ret.headers
+    ret = client.get("/api/admin/profile", headers=guest)
+    assert ret.status_code == 405
+
+    # sampled requests are profiled for everyone, the buffer keeps the newest
+    profiler.sample_rate = 1.0
+    profiler.resize(2)
+    try:
+        for _ in range(3):
+            ret = client.get("/api/model", headers=guest)
+            assert "X-Profile-Id" in ret.headers
+    finally:
+        profiler.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        profiler.resize(app.config["PROFILE_BUFFER_SIZE"])
+    profiles = profiler.profiles()
+    assert len(profiles) == 2
+    assert [p["trigger"] for p in profiles] == ["sample", "sample"]
+    assert profiles[-1]["id"] == int(ret.headers["X-Profile-Id"])
+
+    ret = client.delete("/api/admin/profile", headers=header)
+    assert ret.status_code == 200
+    assert profiler.profiles() == []
+
+
+def test_engine_options():
+    config = {
+        "SQLALCHEMY_DATABASE_URI": "mysql+pymysql://koi:koi@db/koi",
+        "SQLALCHEMY_ENGINE_OPTIONS": {"pool_recycle": 60},
+        "DB_POOL_SIZE": "8",
+        "DB_MAX_OVERFLOW": 2,
+        "DB_POOL_RECYCLE": 3600,
+        "DB_POOL_TIMEOUT": 30,
+        "DB_POOL_PRE_PING": True,
+    }
+    options = engine_options(config)
+    assert options == {
+        "pool_pre_ping": True,
+        "pool_size": 8,
+        "max_overflow": 2,
+        "pool_recycle": 60,
+        "pool_timeout": 30.0,
+    }
+
+    config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    assert engine_options(config) == {"pool_recycle": 60, "pool_pre_ping": True}
+
+
+def test_dispose_engines(app, monkeypatch):
+    # one hook serves every application, a forked child drops the pooled connections of all of them
+    assert app in fork_apps
+    disposed = []
+    with app.app_context():
+        for engine in db.engines.values():
+            monkeypatch.setattr(engine, "dispose", lambda close=True, engine=engine: disposed.append((engine, close)))
+        expected = [(engine, False) for engine in db.engines.values()]
+    dispose_engines()
+    assert disposed == expected
+
+
+def test_serve_args():
+    args = parse_args(["--workers", "4", "--threads", "2"])
+    assert args.workers == 4
+    assert args.threads == 2
+    assert args.port == 8080
+
+
+def test_read_replica(app, auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+
+    # a replica sharing the connection of the in-memory primary
+    with app.app_context():
+        connection = db.engine.raw_connection().driver_connection
+    replica = create_engine("sqlite://", creator=lambda: connection, poolclass=StaticPool)
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(replica, "before_cursor_execute", record)
+    replicas.engines = [replica]
+    try:
+        ret = client.get("/api/model", headers=header)
+        assert ret.status_code == 200
+        assert len(statements) > 0
+        assert all(s.lstrip().upper().startswith("SELECT") for s in statements)
+
+        # writes and the reads of writing requests stay on the primary
+        statements.clear()
+        ret = client.post("/api/model", headers=header, json={})
+        assert ret.status_code == 200
+        assert statements == []
+
+        # an empty replica lags behind, the request is repeated on the primary
+        lagging = create_engine("sqlite://", poolclass=StaticPool)
+        db.metadata.create_all(lagging)
+        replicas.engines = [lagging]
+        fallbacks = replicas.fallbacks
+        ret = client.get("/api/model", headers=header)
+        assert ret.status_code == 200
+        assert len(ret.get_json()) > 0
+        assert replicas.fallbacks == fallbacks + 1
+
+        # fallbacks counted by several threads at once are not lost
+        threads = [threading.Thread(target=lambda: [replicas.fallback() for _ in range(1000)]) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert replicas.fallbacks == fallbacks + 4001
+    finally:
+        replicas.engines = []
+        event.remove(replica, "before_cursor_execute", record)
+
+
+def test_reconcile(app, auth_client: Tuple[FlaskClient, dict]):
+    from uuid import uuid4
+    from koi_api.orm.file import ORMFile
+    from koi_api.orm.instance import ORMInstanceTrainingData
+    from koi_api.orm.model import ORMModelCode
+    from koi_api.persistence import persistence
+
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+    instance["finalized"] = True
+    ret = client.put(base, headers=header, json=instance)
+    assert ret.status_code == 200
+
+    def training_file():
+        with app.app_context():
+            instance_data = db.session.query(ORMInstanceTrainingData).order_by(ORMInstanceTrainingData.data_id.desc()).first()
+            return instance_data.data_id, instance_data.file.file_url
+
+    # replacing the training data releases the old row and its blob
+    ret = client.post(f"{base}/training", headers=header, data=b"a" * 2000)
+    assert ret.status_code == 200
+    old_id, old_url = training_file()
+    ret = client.post(f"{base}/training", headers=header, data=b"b" * 2000)
+    assert ret.status_code == 200
+    with app.app_context():
+        assert db.session.get(ORMInstanceTrainingData, old_id) is None
+        assert not persistence.has_blob(old_url)
+        assert persistence.has_blob(training_file()[1])
+
+    # blobs left behind by earlier test runs would crowd the capped report
+    ret = client.post("/api/admin/reconcile", headers=header, json={"remove": True})
+    assert ret.status_code == 200
+
+    # a blob without row older than the grace time, a file and a code row without reference
+    orphan = uuid4().hex + ".dat"
+    path = os.path.join(app.config["FILEPERSISTENCE_BASE_URI"], orphan)
+    with open(path, "wb") as f:
+        f.write(b"orphan")
+    os.utime(path, (0, 0))
+    with app.app_context():
+        file = persistence.store_file(b"c" * 2000)
+        db.session.add(file)
+        code = ORMModelCode()
+        code.file = persistence.store_file(b"d" * 2000)
+        db.session.add(code)
+        db.session.commit()
+        file_id, file_url, code_id, code_url = file.file_id, file.file_url, code.code_id, code.file.file_url
+
+    ret = client.post("/api/admin/reconcile", headers=header, json={"remove": "yes"})
+    assert ret.status_code == 400
+
+    # the jobs run inline in the tests, they are done once the response is sent
+    ret = client.post("/api/admin/reconcile", headers=header, json={})
+    assert ret.status_code == 200
+    job = ret.get_json()
+    assert job["phase"] == "done"
+    assert job["removed"] == 0
+    assert {"url": orphan} in job["report"]["orphan_blobs"]
+    assert {"table": "file", "id": file_id} in job["report"]["unreferenced_files"]
+    assert {"table": "modelcode", "id": code_id} in job["report"]["dangling_rows"]
+    assert os.path.exists(path)
+
+    ret = client.post("/api/admin/reconcile", headers=header, json={"remove": True})
+    assert ret.status_code == 200
+    job = ret.get_json()
+    assert job["phase"] == "done"
+    assert job["removed"] >= 3
+    assert not os.path.exists(path)
+    with app.app_context():
+        assert db.session.get(ORMFile, file_id) is None
+        assert db.session.get(ORMModelCode, code_id) is None
+        assert not persistence.has_blob(file_url)
+        assert not persistence.has_blob(code_url)
+        assert persistence.has_blob(training_file()[1])
+
+    ret = client.get(f"/api/admin/reconcile/{job['job_uuid']}", headers=header)
+    assert ret.get_json() == job
+    ret = client.get("/api/admin/reconcile", headers=header)
+    assert ret.get_json()[0] == job
+    ret = client.get(f"/api/admin/reconcile/{uuid4().hex}", headers=header)
+    assert ret.status_code == 404
+    ret = client.get("/api/admin/reconcile/nouuid", headers=header)
+    assert ret.status_code == 400
+
+
+def test_reconcile_changes(app, auth_client: Tuple[FlaskClient, dict]):
+    from datetime import datetime, timedelta
+    from koi_api.orm.instance import ORMInstance
+    from koi_api.orm.sample import ORMSampleChange
+
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    # a created sample modified twice and a second sample
+    ret = client.post(f"{base}/sample", headers=header, json={})
+    sample_uuid = ret.get_json()["sample_uuid"]
+    client.put(f"{base}/sample/{sample_uuid}/tags", headers=header, json=[{"name": "a"}])
+    client.put(f"{base}/sample/{sample_uuid}/tags", headers=header, json=[{"name": "b"}])
+    client.post(f"{base}/sample", headers=header, json={})
+
+    with app.app_context():
+        inst = db.session.query(ORMInstance).filter_by(instance_uuid=bytes.fromhex(instance["instance_uuid"])).one()
+        instance_id = inst.instance_id
+        version = inst.samples_version()
+        old = datetime.utcnow() - timedelta(seconds=app.config["CHANGE_LOG_RETENTION_SECONDS"] + 1)
+        db.session.query(ORMSampleChange).filter_by(instance_id=instance_id).update({"change_time": old})
+        db.session.commit()
+
+    ret = client.post("/api/admin/reconcile", headers=header, json={})
+    report = ret.get_json()["report"]["superseded_changes"]
+    assert {"instance_id": instance_id, "count": 2} in report
+
+    ret = client.post("/api/admin/reconcile", headers=header, json={"remove": True})
+    assert ret.get_json()["phase"] == "done"
+    with app.app_context():
+        changes = db.session.query(ORMSampleChange).filter_by(instance_id=instance_id).all()
+        assert len(changes) == 2
+        inst = db.session.get(ORMInstance, instance_id)
+        # compacting the log leaves the etag of the samples alone
+        assert inst.samples_version()[1] == version[1]
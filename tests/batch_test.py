@@ -0,0 +1,120 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from . import make_empty_model, make_empty_instance
+from base64 import b64encode, b64decode
+from typing import Tuple
+from flask.testing import FlaskClient
+import os
+
+
+def test_batch(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    response = client.post(f"{base}/sample", headers=header, json={})
+    sample = response.json["sample_uuid"]
+
+    response = client.post(
+        "/api/batch",
+        headers=header,
+        json={
+            "requests": [
+                {"method": "POST", "path": f"{base}/sample/{sample}/data", "body": {"key": "image"}},
+                {"method": "PUT", "path": f"{base}/sample/{sample}/tags", "body": [{"name": "batched"}]},
+                {"method": "GET", "path": f"{base}/sample?inc_tags=batched"},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    results = response.json
+    assert [r["status"] for r in results] == [200, 200, 200]
+    assert [s["sample_uuid"] for s in results[2]["body"]] == [sample]
+    data = results[0]["body"]["data_uuid"]
+
+    # raw payloads are exchanged base64 encoded
+    response = client.post(
+        "/api/batch",
+        headers=header,
+        json={
+            "requests": [
+                {
+                    "method": "POST",
+                    "path": f"{base}/sample/{sample}/data/{data}/file",
+                    "data": b64encode(b"payload").decode(),
+                },
+                {"method": "GET", "path": f"{base}/sample/{sample}/data/{data}/file"},
+                {"method": "PUT", "path": f"{base}/sample/{sample}", "body": {"finalized": True}},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    assert b64decode(response.json[1]["data"]) == b"payload"
+    response = client.get(f"{base}/sample/{sample}", headers=header)
+    assert response.json["finalized"] is True
+
+
+def test_batch_rollback(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    response = client.post(f"{base}/sample", headers=header, json={})
+    sample = response.json["sample_uuid"]
+    response = client.post(f"{base}/sample/{sample}/data", headers=header, json={"key": "image"})
+    data = response.json["data_uuid"]
+    response = client.post(f"{base}/sample/{sample}/data/{data}/file", headers=header, data=b"kept")
+    assert response.status_code == 200
+    files = set(os.listdir("./temp/"))
+
+    # the last request fails, so nothing of the batch must remain
+    response = client.post(
+        "/api/batch",
+        headers=header,
+        json={
+            "requests": [
+                {"method": "POST", "path": f"{base}/sample", "body": {}},
+                {"method": "DELETE", "path": f"{base}/sample/{sample}"},
+                {"method": "POST", "path": f"{base}/sample/{sample}/data/{data}/file", "data": "AAAA"},
+            ]
+        },
+    )
+    assert response.status_code == 400
+    assert [r["status"] for r in response.json] == [200, 200, 404]
+
+    response = client.get(f"{base}/sample", headers=header)
+    assert [s["sample_uuid"] for s in response.json] == [sample]
+    response = client.get(f"{base}/sample/{sample}/data/{data}/file", headers=header)
+    assert response.data == b"kept"
+    assert set(os.listdir("./temp/")) == files
+
+    # malformed batches are rejected before anything is executed
+    for requests in [
+        [{"method": "PATCH", "path": f"{base}/sample"}],
+        [{"method": "GET", "path": "/api/unknown"}],
+        [{"method": "POST", "path": "/api/batch", "body": {"requests": []}}],
+        [{"method": "POST", "path": f"{base}/sample", "body": {}, "data": ""}],
+    ]:
+        response = client.post("/api/batch", headers=header, json={"requests": requests})
+        assert response.status_code == 400
+    response = client.post("/api/batch", headers=header, json={})
+    assert response.status_code == 400
+    response = client.post("/api/batch", json={"requests": []})
+    assert response.status_code == 401
+    response = client.get("/api/batch", headers=header)
+    assert response.status_code == 405
@@ -0,0 +1,46 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from benchmarks.client import LocalClient
+from benchmarks.generate import generate
+from benchmarks.workloads import Context, WORKLOADS, summarize
+from typing import Tuple
+from flask.testing import FlaskClient
+
+
+def test_benchmarks(app, auth_client: Tuple[FlaskClient, dict]):
+    _, header = auth_client
+    client = LocalClient(app)
+
+    dataset = generate(app, client, header, samples=30, tags=3, label_requests=0.5, payload=64)
+    assert len(dataset["uuids"]) == 1
+
+    # the generated samples are visible through the api
+    instance_uuid = dataset["uuids"][0]["instance_uuids"][0]
+    base = f"/api/model/{dataset['uuids'][0]['model_uuid']}/instance/{instance_uuid}"
+    rsp = client.request("GET", f"{base}/sample", headers=header)
+    assert len(rsp.json()) == 30
+    rsp = client.request("GET", f"{base}/changes", headers=header)
+    assert len(rsp.json()["created"]) == 30
+    rsp = client.request("GET", f"{base}/tags", headers=header)
+    assert len(rsp.json()) == 3
+
+    for name, workload in WORKLOADS.items():
+        ctx = Context(app, client, header, dataset, payload=64, merge_samples=5)
+        workload(ctx, 2)
+        result = summarize(ctx, 1.0)
+        assert result["operations"] == 2, name
+        assert result["requests"] > 0, name
+        assert result["errors"] == 0, name
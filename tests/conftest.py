@@ -13,4 +13,4 @@
 # GNU Lesser General Public License is distributed along with this
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
-from .fixtures import app, auth_client  # noqa F401
+from .fixtures import app, auth_client, query_budget  # noqa F401
@@ -14,6 +14,9 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from koi_api import create_app
 from flask import Flask
 from flask.testing import FlaskClient
@@ -49,3 +52,32 @@ def auth_client(app: Flask) -> Tuple[FlaskClient, dict]:
         "Authorization": f"Bearer {token}",
     }
     return app.test_client(), header
+
+
+@pytest.fixture
+def query_budget():
+    """context manager failing the test if more statements than the budget run within it.
+
+    with query_budget(5) as statements:
+        client.get(...)
+    """
+
+    @contextmanager
+    def budget(max_statements):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+        assert len(statements) <= max_statements, "%d statements exceed the budget of %d:\n%s" % (
+            len(statements),
+            max_statements,
+            "\n".join(statements),
+        )
+
+    return budget
@@ -15,6 +15,13 @@
 
 from flask.testing import FlaskClient
 from typing import Tuple
+import threading
+import pytest
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from koi_api.orm import db
+from koi_api.common.metrics import Metrics, metrics, start_request, QUERY_START, REQUEST_QUERIES
 
 
 def test_get(auth_client: Tuple[FlaskClient, dict]):
@@ -39,3 +46,75 @@ def test_delete(auth_client: Tuple[FlaskClient, dict]):
     client, _ = auth_client
     ret = client.delete("/health")
     assert ret.status_code == 405
+
+
+def test_metrics(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    client.get("/health")
+    client.get("/api/model", headers=header)
+
+    ret = client.get("/metrics")
+    assert ret.status_code == 200
+    assert ret.mimetype == "text/plain"
+    text = ret.get_data(as_text=True)
+
+    assert "# TYPE koi_requests_total counter" in text
+    assert 'koi_requests_total{endpoint="apihealth",method="GET",status="200"}' in text
+    assert 'koi_request_duration_seconds_bucket{endpoint="apimodel",method="GET",le="+Inf"}' in text
+    assert 'koi_request_db_queries_total{endpoint="apimodel",method="GET"}' in text
+    assert "koi_response_cache_hits_total" in text
+
+    ret = client.post("/metrics")
+    assert ret.status_code == 405
+
+
+def test_query_timing(app, auth_client: Tuple[FlaskClient, dict]):
+    # a failing statement leaves no start time behind for the next ones
+    with app.test_request_context():
+        start_request()
+        with pytest.raises(OperationalError):
+            db.session.execute(text("SELECT * FROM missing_table"))
+        db.session.rollback()
+        db.session.execute(text("SELECT 1"))
+        assert g.get(REQUEST_QUERIES) == 1
+        assert QUERY_START not in db.session.connection().info
+        db.session.rollback()
+
+    # without METRICS_ENABLED requests are not recorded, even while the queries are timed
+    client, _ = auth_client
+    key = ("koi_requests_total", (("endpoint", "apihealth"), ("method", "GET"), ("status", "200")))
+    client.get("/health")
+    count = metrics.collect()[0][key]
+    metrics.enabled = False
+    try:
+        client.get("/health")
+    finally:
+        metrics.enabled = True
+    assert metrics.collect()[0][key] == count
+
+
+def test_metrics_threads():
+    m = Metrics()
+
+    def record():
+        for _ in range(1000):
+            m.inc("count", (("a", "b"),))
+            m.observe("latency", (), 0.02)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    counters, histograms = m.collect()
+    assert counters[("count", (("a", "b"),))] == 4000
+    hist = histograms[("latency", ())]
+    assert hist[-1] == 4000
+    assert hist[2] == 4000
+
+    text = m.render()
+    assert 'count{a="b"} 4000' in text
+    assert 'latency_bucket{le="0.01"} 0' in text
+    assert 'latency_bucket{le="0.025"} 4000' in text
+    assert "latency_count 4000" in text
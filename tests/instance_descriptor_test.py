@@ -1,6 +1,12 @@
 from . import make_empty_model, make_empty_instance
 from typing import Tuple
 from flask.testing import FlaskClient
+import os
+import pytest
+from sqlalchemy import delete
+from koi_api.orm import db
+from koi_api.orm.file import ORMFile
+from koi_api.persistence import persistence
 
 
 def test_forbidden(auth_client: Tuple[FlaskClient, str]):
@@ -126,3 +132,32 @@ def test_file(auth_client: Tuple[FlaskClient, str]):
     # head request should always return 200
     ret = client.head(f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}/descriptor/{desc['descriptor_uuid']}/file", headers=header)
     assert ret.status_code == 200
+
+
+def test_shared_blob(app):
+    # a blob stays on disk as long as one file entry links to it
+    with app.app_context():
+        file = persistence.store_file(b"shared" * 1000)
+        link = persistence.link_file(file)
+        assert link.file_digest == file.file_digest == persistence.digest_file(file)
+        db.session.add_all([file, link])
+        db.session.commit()
+
+        db.session.delete(file)
+        db.session.commit()
+        assert persistence.get_file(link) == b"shared" * 1000
+
+        db.session.delete(link)
+        db.session.commit()
+        assert not os.path.exists(os.path.join("./temp/", link.file_url))
+
+        # linking fails once another transaction removed all entries of the blob
+        file = persistence.store_file(b"removed" * 1000)
+        db.session.add(file)
+        db.session.commit()
+        db.session.execute(
+            delete(ORMFile).where(ORMFile.file_id == file.file_id).execution_options(synchronize_session=False)
+        )
+        with pytest.raises(FileNotFoundError):
+            persistence.link_file(file)
+        db.session.rollback()
@@ -16,6 +16,12 @@
 from . import Dummy, make_empty_model, make_empty_instance
 from typing import Tuple
 from flask.testing import FlaskClient
+import os
+import pytest
+import time
+import threading
+from flask import current_app
+from koi_api.jobs import JobRunner, LeaseLost, job_owner
 
 
 def test_forbidden(auth_client: Tuple[FlaskClient, str]):
@@ -265,3 +271,237 @@ def not_instance_merging(testserver):
 
         labels = [x.raw for x in sample.labels["class3"]]
         assert b"do not keep this" not in labels
+
+
+def test_instance_merge(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    base = f"/api/model/{model['model_uuid']}/instance"
+
+    def finalize(instance):
+        instance["finalized"] = True
+        ret = client.put(f"{base}/{instance['instance_uuid']}", headers=header, json=instance)
+        assert ret.status_code == 200
+
+    def add_descriptor(instance, key, value):
+        ret = client.post(f"{base}/{instance['instance_uuid']}/descriptor", headers=header, json={"key": key})
+        desc = ret.get_json()
+        ret = client.post(
+            f"{base}/{instance['instance_uuid']}/descriptor/{desc['descriptor_uuid']}/file", headers=header, data=value
+        )
+        assert ret.status_code == 200
+
+    def add_sample(instance):
+        ret = client.post(f"{base}/{instance['instance_uuid']}/sample", headers=header, json={})
+        sample = ret.get_json()["sample_uuid"]
+        url = f"{base}/{instance['instance_uuid']}/sample/{sample}"
+        client.put(f"{url}/tags", headers=header, json=[{"name": "keep this"}])
+        ret = client.post(f"{url}/label", headers=header, json={"key": "class1"})
+        client.post(f"{url}/label/{ret.get_json()['label_uuid']}/file", headers=header, data=b"keep this label")
+
+        # finalize the sample and add some non mergeable content
+        ret = client.put(url, headers=header, json={"finalized": True})
+        assert ret.status_code == 200
+        client.put(f"{url}/tags", headers=header, json=[{"name": "do not keep this"}])
+        ret = client.post(f"{url}/label", headers=header, json={"key": "class1"})
+        client.post(f"{url}/label/{ret.get_json()['label_uuid']}/file", headers=header, data=b"do not keep this")
+
+    inst1 = make_empty_instance(auth_client, model["model_uuid"])
+    inst2 = make_empty_instance(auth_client, model["model_uuid"])
+    inst3 = make_empty_instance(auth_client, model["model_uuid"])
+
+    add_descriptor(inst1, "c", b"1")
+    add_descriptor(inst1, "c", b"2")
+    add_descriptor(inst2, "c", b"2")
+    add_descriptor(inst2, "c", b"3")
+    add_descriptor(inst1, "a", b"1")
+    add_descriptor(inst2, "b", b"2")
+    add_descriptor(inst3, "c", b"1")
+
+    add_sample(inst1)
+    add_sample(inst2)
+    add_sample(inst2)
+
+    for instance in [inst1, inst2, inst3]:
+        finalize(instance)
+    blobs = set(os.listdir("./temp/"))
+
+    ret = client.post(
+        f"{base}/{inst3['instance_uuid']}/merge",
+        headers=header,
+        json={"instance_uuid": [inst1["instance_uuid"], inst2["instance_uuid"], inst3["instance_uuid"]]},
+    )
+    assert ret.status_code == 200
+    job = ret.get_json()
+    assert job["total"] == 3
+
+    # poll the job until it is finished
+    while job["phase"] in ["queued", "running"]:
+        time.sleep(0.1)
+        ret = client.get(f"{base}/{inst3['instance_uuid']}/merge/{job['job_uuid']}", headers=header)
+        assert ret.status_code == 200
+        job = ret.get_json()
+    assert job["phase"] == "done"
+    assert job["processed"] == 3
+    assert job["samples"] == 3
+
+    ret = client.get(f"{base}/{inst3['instance_uuid']}/merge", headers=header)
+    assert [j["job_uuid"] for j in ret.get_json()] == [job["job_uuid"]]
+    ret = client.get(f"{base}/{inst1['instance_uuid']}/merge/{job['job_uuid']}", headers=header)
+    assert ret.status_code == 404
+    ret = client.post(f"{base}/{inst3['instance_uuid']}/merge", headers=header, json={"instance_uuid": ["nope"]})
+    assert ret.status_code == 400
+
+    # the merged instances are empty, the target holds all samples
+    for instance in [inst1, inst2]:
+        ret = client.get(f"{base}/{instance['instance_uuid']}/sample", headers=header)
+        assert ret.get_json() == []
+        ret = client.get(f"{base}/{instance['instance_uuid']}/tags", headers=header)
+        assert ret.get_json() == []
+
+    ret = client.get(f"{base}/{inst3['instance_uuid']}/sample", headers=header)
+    samples = [s["sample_uuid"] for s in ret.get_json()]
+    assert len(samples) == 3
+
+    ret = client.get(f"{base}/{inst3['instance_uuid']}/tags", headers=header)
+    assert [t["name"] for t in ret.get_json()] == ["keep this"]
+
+    for sample in samples:
+        url = f"{base}/{inst3['instance_uuid']}/sample/{sample}"
+        ret = client.get(f"{url}/tags", headers=header)
+        assert [t["name"] for t in ret.get_json()] == ["keep this"]
+        ret = client.get(f"{url}/label", headers=header)
+        labels = ret.get_json()
+        assert len(labels) == 1
+        ret = client.get(f"{url}/label/{labels[0]['label_uuid']}/file", headers=header)
+        assert ret.data == b"keep this label"
+
+    # the descriptors are merged without duplicates
+    ret = client.get(f"{base}/{inst3['instance_uuid']}/descriptor", headers=header)
+    descriptors = dict()
+    for desc in ret.get_json():
+        ret = client.get(f"{base}/{inst3['instance_uuid']}/descriptor/{desc['descriptor_uuid']}/file", headers=header)
+        descriptors.setdefault(desc["key"], []).append(ret.data)
+    assert {k: sorted(v) for k, v in descriptors.items()} == {"a": [b"1"], "b": [b"2"], "c": [b"1", b"2", b"3"]}
+
+    # the merged descriptors are linked to the existing blobs
+    assert set(os.listdir("./temp/")) <= blobs
+
+
+def test_merge_answered_labels(auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    base = f"/api/model/{model['model_uuid']}/instance"
+    source = make_empty_instance(auth_client, model["model_uuid"])
+    target = make_empty_instance(auth_client, model["model_uuid"])
+
+    def answer(finalized, value):
+        ret = client.post(f"{base}/{source['instance_uuid']}/sample", headers=header, json={})
+        sample = ret.get_json()["sample_uuid"]
+        if finalized:
+            ret = client.put(f"{base}/{source['instance_uuid']}/sample/{sample}", headers=header, json={"finalized": True})
+            assert ret.status_code == 200
+        ret = client.post(f"{base}/{source['instance_uuid']}/label_request", headers=header, json={"sample_uuid": sample})
+        request = ret.get_json()["label_request_uuid"]
+        ret = client.post(f"{base}/{source['instance_uuid']}/label_request/{request}", headers=header, data=value)
+        assert ret.status_code == 200
+
+    # the answer to a request of a finalized sample is not mergeable
+    answer(False, b"keep this answer")
+    answer(True, b"do not keep this answer")
+
+    for instance in [source, target]:
+        instance["finalized"] = True
+        ret = client.put(f"{base}/{instance['instance_uuid']}", headers=header, json=instance)
+        assert ret.status_code == 200
+
+    ret = client.post(
+        f"{base}/{target['instance_uuid']}/merge", headers=header, json={"instance_uuid": [source["instance_uuid"]]}
+    )
+    assert ret.get_json()["phase"] == "done"
+
+    answers = []
+    ret = client.get(f"{base}/{target['instance_uuid']}/sample", headers=header)
+    for sample in ret.get_json():
+        url = f"{base}/{target['instance_uuid']}/sample/{sample['sample_uuid']}"
+        for label in client.get(f"{url}/label", headers=header).get_json():
+            answers.append(client.get(f"{url}/label/{label['label_uuid']}/file", headers=header).data)
+    assert answers == [b"keep this answer"]
+
+
+def test_job_runner(app):
+    from koi_api.orm import db
+
+    # with a database other threads can use, jobs run in their own thread and app context
+    runner = JobRunner()
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///jobs.db"
+    try:
+        runner.init_app(app)
+    finally:
+        app.config["SQLALCHEMY_DATABASE_URI"] = uri
+
+    future = runner.start(lambda: (threading.get_ident(), current_app.name))
+    assert future.result(timeout=5) != (threading.get_ident(), app.name)
+    assert future.result()[1] == app.name
+
+    # with the in-memory database of the tests they run in the calling thread,
+    # after the submitting session committed and in an app context of their own
+    runner = JobRunner()
+    runner.init_app(app)
+    runs = []
+    with app.app_context():
+        session = db.session()
+        runner.submit(session, lambda: runs.append((threading.get_ident(), db.session() is session)))
+        assert runs == []
+        session.commit()
+    assert runs == [(threading.get_ident(), False)]
+
+
+def test_job_lease(app):
+    from datetime import datetime, timedelta
+    from uuid import uuid4
+    from koi_api.orm import db
+    from koi_api.orm.job import ORMMergeJob
+    from koi_api.jobs.merge import merge_lease
+
+    with app.app_context():
+        # a job of another process that reported progress recently
+        job = ORMMergeJob(
+            job_uuid=uuid4().bytes,
+            job_phase="running",
+            job_created=datetime.utcnow(),
+            job_last_modified=datetime.utcnow(),
+            job_sources="[]",
+            job_total=0,
+            job_processed=0,
+            job_samples=0,
+            job_owner="other:1",
+            job_heartbeat=datetime.utcnow(),
+        )
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.job_id
+
+        assert job_id not in merge_lease.resumable()
+        assert not merge_lease.claim(job_id)
+        with pytest.raises(LeaseLost):
+            merge_lease.renew(job_id)
+        db.session.rollback()
+
+        # the other process stopped, its lease expires
+        job = db.session.get(ORMMergeJob, job_id)
+        job.job_heartbeat = datetime.utcnow() - timedelta(seconds=app.config["JOB_LEASE_SECONDS"] + 1)
+        db.session.commit()
+        assert job_id in merge_lease.resumable()
+        assert merge_lease.claim(job_id)
+        assert not merge_lease.claim(job_id)
+        job = db.session.get(ORMMergeJob, job_id)
+        assert job.job_owner == job_owner()
+        merge_lease.renew(job_id)
+        db.session.commit()
+
+        merge_lease.fail(job_id, {ORMMergeJob.job_error: "stopped"})
+        job = db.session.get(ORMMergeJob, job_id)
+        assert (job.job_phase, job.job_error) == ("failed", "stopped")
+        assert job_id not in merge_lease.resumable()
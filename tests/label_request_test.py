@@ -14,8 +14,19 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 from . import Dummy, make_empty_model, make_empty_instance
+from io import BytesIO
 from typing import Tuple
 from flask.testing import FlaskClient
+from uuid import UUID
+import os
+import tarfile
+import threading
+import time
+from sqlalchemy import select
+from koi_api.orm import db
+from koi_api.orm.instance import ORMInstance
+from koi_api.common import notifier as notifier_module
+from koi_api.common.notifier import Notifier, notifier
 
 
 def test_make_request_and_get(auth_client: Tuple[FlaskClient, str]):
@@ -269,3 +280,177 @@ def test_post_request(auth_client: Tuple[FlaskClient, str]):
         data=b"test",
     )
     assert response.status_code == 400
+
+
+def test_bulk_requests(auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    samples = []
+    for _ in range(3):
+        response = client.post(f"{base}/sample", headers=header, json={})
+        assert response.status_code == 200
+        samples.append(response.json["sample_uuid"])
+
+    # create a request for every sample at once
+    response = client.post(f"{base}/label_request_bulk", headers=header, json={"sample_uuid": samples})
+    assert response.status_code == 200
+    requests = response.json
+    assert [r["sample_uuid"] for r in requests] == samples
+
+    response = client.get(f"{base}/label_request?obsolete=0", headers=header)
+    assert len(response.json) == 3
+
+    # answer two of them in one multipart request
+    response = client.put(
+        f"{base}/label_request_bulk",
+        headers=header,
+        data={r["label_request_uuid"]: (BytesIO(b"label " + r["sample_uuid"].encode()), "label") for r in requests[:2]},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+
+    response = client.get(f"{base}/label_request?obsolete=0", headers=header)
+    assert [r["label_request_uuid"] for r in response.json] == [requests[2]["label_request_uuid"]]
+
+    for sample, count in zip(samples, [1, 1, 0]):
+        response = client.get(f"{base}/sample/{sample}/label", headers=header)
+        assert len(response.json) == count
+        if count:
+            label = response.json[0]["label_uuid"]
+            response = client.get(f"{base}/sample/{sample}/label/{label}/file", headers=header)
+            assert response.data == b"label " + sample.encode()
+
+    # answering a request twice is rejected without leaving blobs behind, within one archive
+    blobs = set(os.listdir("./temp/"))
+    archive = BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tf:
+        for payload in [b"a" * 2000, b"b" * 2000]:
+            info = tarfile.TarInfo(requests[2]["label_request_uuid"])
+            info.size = len(payload)
+            tf.addfile(info, BytesIO(payload))
+    response = client.put(
+        f"{base}/label_request_bulk", headers=header, data=archive.getvalue(), content_type="application/x-tar"
+    )
+    assert response.status_code == 400
+    assert set(os.listdir("./temp/")) == blobs
+
+    # and across requests
+    response = client.put(
+        f"{base}/label_request_bulk",
+        headers=header,
+        data={r["label_request_uuid"]: (BytesIO(b"c" * 2000), "label") for r in [requests[2], requests[0]]},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 400
+    assert set(os.listdir("./temp/")) == blobs
+    response = client.get(f"{base}/label_request?obsolete=0", headers=header)
+    assert [r["label_request_uuid"] for r in response.json] == [requests[2]["label_request_uuid"]]
+    response = client.get(f"{base}/sample/{samples[0]}/label", headers=header)
+    assert len(response.json) == 1
+
+    # unknown and malformed samples or requests
+    response = client.post(f"{base}/label_request_bulk", headers=header, json={"sample_uuid": ["not a uuid"]})
+    assert response.status_code == 400
+    response = client.post(f"{base}/label_request_bulk", headers=header, json={"sample_uuid": samples[0]})
+    assert response.status_code == 400
+    response = client.post(f"{base}/label_request_bulk", headers=header, json={})
+    assert response.status_code == 400
+    response = client.post(
+        f"{base}/label_request_bulk", headers=header, json={"sample_uuid": ["00000000000000000000000000000000"]}
+    )
+    assert response.status_code == 404
+    response = client.put(
+        f"{base}/label_request_bulk",
+        headers=header,
+        data={"00000000000000000000000000000000": (BytesIO(b"label"), "label")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 404
+    response = client.put(
+        f"{base}/label_request_bulk",
+        headers=header,
+        data={"not a uuid": (BytesIO(b"label"), "label")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 400
+
+    response = client.get(f"{base}/label_request_bulk", headers=header)
+    assert response.status_code == 405
+
+
+def test_notify(app, auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    with app.app_context():
+        stmt = select(ORMInstance.instance_id).where(ORMInstance.instance_uuid == UUID(instance["instance_uuid"]).bytes)
+        instance_id = db.session.scalars(stmt).one()
+
+    def notify(**params):
+        ret = client.get(f"{base}/notify", headers=header, query_string=params)
+        assert ret.status_code == 200
+        return ret.get_json()
+
+    versions = notify(timeout=0)
+    assert not versions["changed"]
+
+    # nothing changes until the timeout
+    start = time.monotonic()
+    body = notify(samples=versions["samples"], label_requests=versions["label_requests"], timeout=0.2)
+    assert time.monotonic() - start >= 0.2
+    assert not body["changed"]
+    assert body == versions
+
+    # a commit wakes the waiters of the instance
+    generation = notifier.generation(instance_id)
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.append(notifier.wait(instance_id, generation, 5)))
+    waiter.start()
+
+    sample = client.post(f"{base}/sample", headers=header, json={}).get_json()["sample_uuid"]
+    waiter.join()
+    assert woken == [True]
+
+    body = notify(samples=versions["samples"], timeout=5)
+    assert body["changed"]
+    assert body["samples"] != versions["samples"]
+    assert body["label_requests"] == versions["label_requests"]
+    versions = body
+
+    ret = client.post(f"{base}/label_request", headers=header, json={"sample_uuid": sample})
+    assert ret.status_code == 200
+    body = notify(label_requests=versions["label_requests"], timeout=5)
+    assert body["changed"]
+    assert body["label_requests"] != versions["label_requests"]
+
+    ret = client.get(f"{base}/notify", headers=header, query_string={"timeout": "x"})
+    assert ret.status_code == 400
+
+
+def test_notifier_prune(monkeypatch):
+    monkeypatch.setattr(notifier_module, "MAX_GENERATIONS", 2)
+    waiting = Notifier()
+    waiting.notify([1])
+    generation = waiting.generation(1)
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.append(waiting.wait(1, generation, 5)))
+    waiter.start()
+    while 1 not in waiting._waiters:
+        time.sleep(0.01)
+
+    # notifying many other instances forgets only the ones nobody waits for
+    for instance_id in range(2, 10):
+        waiting.notify([instance_id])
+    assert waiting.generation(1) == generation
+    assert waiting.generation(2) == 0
+    assert waiter.is_alive()
+
+    waiting.notify([1])
+    waiter.join()
+    assert woken == [True]
+    assert waiting.generation(1) > generation
@@ -14,7 +14,20 @@
 # software and can be found at http://www.gnu.org/licenses/lgpl.html
 
 from . import Dummy, make_empty_instance, make_empty_model
+from io import BytesIO
+from uuid import UUID
+import gzip
+import os
+import json
+import zlib
+from zipfile import ZipFile
+import tarfile
 from typing import Tuple
+from sqlalchemy import event
+from koi_api.orm import db
+from koi_api.persistence import persistence
+from koi_api.common.response_cache import cache, ResponseCache
+from koi_api.common.return_codes import JSON_ENCODERS
 from flask.testing import FlaskClient
 
 
@@ -651,4 +664,646 @@ def test_data_label_files(auth_client: Tuple[FlaskClient, str]):
             data=b"test",
             headers=header,
         )
-        assert ret.status_code == 405
\ No newline at end of file
+        assert ret.status_code == 405
+
+def test_sample_upload(auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    samples = []
+    for _ in range(2):
+        ret = client.post(f"{base}/sample", json={}, headers=header)
+        assert ret.status_code == 200
+        samples.append(ret.get_json()["sample_uuid"])
+
+    # upload data and labels for both samples in one zip archive
+    archive = BytesIO()
+    with ZipFile(archive, "w") as zf:
+        for s in samples:
+            zf.writestr(f"{s}/data/image", f"data {s}")
+            zf.writestr(f"{s}/label/class", f"label {s}")
+    ret = client.post(
+        f"{base}/sample_upload", data=archive.getvalue(), content_type="application/zip", headers=header
+    )
+    assert ret.status_code == 200
+    assert len(ret.get_json()) == 4
+
+    # uploading the same key again replaces the file, this time as tar
+    archive = BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tf:
+        payload = b"new data"
+        info = tarfile.TarInfo(f"{samples[0]}/data/image")
+        info.size = len(payload)
+        tf.addfile(info, BytesIO(payload))
+    ret = client.post(
+        f"{base}/sample_upload", data=archive.getvalue(), content_type="application/gzip", headers=header
+    )
+    assert ret.status_code == 200
+
+    ret = client.get(f"{base}/sample/{samples[0]}/data", headers=header)
+    assert ret.status_code == 200
+    data = ret.get_json()
+    assert len(data) == 1
+    assert data[0]["key"] == "image"
+    assert data[0]["has_file"]
+    ret = client.get(f"{base}/sample/{samples[0]}/data/{data[0]['data_uuid']}/file", headers=header)
+    assert ret.data == b"new data"
+
+    ret = client.get(f"{base}/sample/{samples[1]}/label", headers=header)
+    label = ret.get_json()
+    assert len(label) == 1
+    ret = client.get(f"{base}/sample/{samples[1]}/label/{label[0]['label_uuid']}/file", headers=header)
+    assert ret.data == f"label {samples[1]}".encode()
+
+    # multipart bodies are addressed by their field names
+    ret = client.post(
+        f"{base}/sample_upload",
+        data={f"{samples[1]}/data/other": (BytesIO(b"multipart"), "other.bin")},
+        content_type="multipart/form-data",
+        headers=header,
+    )
+    assert ret.status_code == 200
+    ret = client.get(f"{base}/sample/{samples[1]}/data", headers=header)
+    assert sorted(d["key"] for d in ret.get_json()) == ["image", "other"]
+
+    # malformed names, unknown samples and unknown content types are rejected
+    archive = BytesIO()
+    with ZipFile(archive, "w") as zf:
+        zf.writestr(f"{samples[0]}/image", b"data")
+    ret = client.post(
+        f"{base}/sample_upload", data=archive.getvalue(), content_type="application/zip", headers=header
+    )
+    assert ret.status_code == 400
+
+    archive = BytesIO()
+    with ZipFile(archive, "w") as zf:
+        zf.writestr(f"{samples[0]}/data/image", b"data")
+        zf.writestr("00000000000000000000000000000000/data/image", b"data")
+    ret = client.post(
+        f"{base}/sample_upload", data=archive.getvalue(), content_type="application/zip", headers=header
+    )
+    assert ret.status_code == 404
+
+    # two files for the same key are rejected without leaving blobs behind
+    blobs = set(os.listdir("./temp/"))
+    archive = BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tf:
+        for payload in [b"a" * 2000, b"b" * 2000]:
+            info = tarfile.TarInfo(f"{samples[0]}/data/image")
+            info.size = len(payload)
+            tf.addfile(info, BytesIO(payload))
+    ret = client.post(f"{base}/sample_upload", data=archive.getvalue(), content_type="application/x-tar", headers=header)
+    assert ret.status_code == 400
+    assert set(os.listdir("./temp/")) == blobs
+
+    ret = client.post(f"{base}/sample_upload", data=b"not a zip", content_type="application/zip", headers=header)
+    assert ret.status_code == 400
+
+    ret = client.post(f"{base}/sample_upload", data=b"data", content_type="text/plain", headers=header)
+    assert ret.status_code == 400
+
+    # data of finalized samples cannot be changed
+    ret = client.put(f"{base}/sample/{samples[0]}", json={"finalized": True}, headers=header)
+    assert ret.status_code == 200
+    archive = BytesIO()
+    with ZipFile(archive, "w") as zf:
+        zf.writestr(f"{samples[0]}/data/image", b"data")
+    ret = client.post(
+        f"{base}/sample_upload", data=archive.getvalue(), content_type="application/zip", headers=header
+    )
+    assert ret.status_code == 400
+
+    ret = client.get(f"{base}/sample_upload", headers=header)
+    assert ret.status_code == 405
+
+
+def test_sample_finalize_bulk(auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    samples = []
+    for i in range(6):
+        ret = client.post(f"{base}/sample", json={}, headers=header)
+        assert ret.status_code == 200
+        samples.append(ret.get_json()["sample_uuid"])
+        tag = "even" if i % 2 == 0 else "odd"
+        ret = client.put(f"{base}/sample/{samples[-1]}/tags", json=[{"name": tag}], headers=header)
+        assert ret.status_code == 200
+
+    etag = client.head(f"{base}/sample", headers=header).headers["ETag"]
+
+    def finalized():
+        ret = client.get(f"{base}/sample", headers=header)
+        return {s["sample_uuid"] for s in ret.get_json() if s["finalized"]}
+
+    # finalize by tag filter
+    ret = client.put(f"{base}/sample_finalize?inc_tags=even", json={"finalized": True}, headers=header)
+    assert ret.status_code == 200
+    assert ret.get_json()["count"] == 3
+    assert finalized() == set(samples[0::2])
+    assert client.head(f"{base}/sample", headers=header).headers["ETag"] != etag
+
+    # finalizing again changes nothing
+    ret = client.put(f"{base}/sample_finalize?inc_tags=even", json={"finalized": True}, headers=header)
+    assert ret.get_json()["count"] == 0
+
+    # finalize by uuid list, combined with an exclusion
+    ret = client.put(
+        f"{base}/sample_finalize?exc_tags=even", json={"finalized": 1, "sample_uuid": samples[:2]}, headers=header
+    )
+    assert ret.get_json()["count"] == 1
+    assert finalized() == set(samples[0::2]) | {samples[1]}
+
+    # unfinalize everything
+    ret = client.put(f"{base}/sample_finalize", json={"finalized": 0}, headers=header)
+    assert ret.get_json()["count"] == 4
+    assert finalized() == set()
+
+    # malformed requests
+    ret = client.put(f"{base}/sample_finalize", json={}, headers=header)
+    assert ret.status_code == 400
+    ret = client.put(f"{base}/sample_finalize", json={"finalized": "abc"}, headers=header)
+    assert ret.status_code == 400
+    ret = client.put(f"{base}/sample_finalize", json={"finalized": 1, "sample_uuid": "abc"}, headers=header)
+    assert ret.status_code == 400
+    ret = client.put(f"{base}/sample_finalize", json={"finalized": 1, "sample_uuid": ["abc"]}, headers=header)
+    assert ret.status_code == 400
+    ret = client.get(f"{base}/sample_finalize", headers=header)
+    assert ret.status_code == 405
+
+
+def test_sample_tags_bulk(auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    samples = []
+    for _ in range(3):
+        ret = client.post(f"{base}/sample", json={}, headers=header)
+        assert ret.status_code == 200
+        samples.append(ret.get_json()["sample_uuid"])
+
+    def tags_of(sample):
+        ret = client.get(f"{base}/sample/{sample}/tags", headers=header)
+        assert ret.status_code == 200
+        return sorted(t["name"] for t in ret.get_json())
+
+    def instance_tags():
+        ret = client.get(f"{base}/tags", headers=header)
+        return sorted(t["name"] for t in ret.get_json())
+
+    # add tags to all samples, including a duplicate pair
+    ret = client.put(
+        f"{base}/sample_tags",
+        json={"add": [{"sample_uuid": s, "name": "all"} for s in samples] + [
+            {"sample_uuid": samples[0], "name": "first"},
+            {"sample_uuid": samples[0], "name": "first"},
+        ]},
+        headers=header,
+    )
+    assert ret.status_code == 200
+    assert ret.get_json()["count"] == 3
+    assert tags_of(samples[0]) == ["all", "first"]
+    assert tags_of(samples[2]) == ["all"]
+
+    # adding known pairs changes nothing
+    ret = client.put(f"{base}/sample_tags", json={"add": [{"sample_uuid": samples[1], "name": "all"}]}, headers=header)
+    assert ret.get_json()["count"] == 0
+
+    # remove and add in one request, orphaned tags are dropped
+    ret = client.put(
+        f"{base}/sample_tags",
+        json={
+            "remove": [{"sample_uuid": samples[0], "name": "first"}, {"sample_uuid": samples[1], "name": "unknown"}],
+            "add": [{"sample_uuid": samples[1], "name": "second"}],
+        },
+        headers=header,
+    )
+    assert ret.status_code == 200
+    assert ret.get_json()["count"] == 2
+    assert tags_of(samples[0]) == ["all"]
+    assert tags_of(samples[1]) == ["all", "second"]
+    assert instance_tags() == ["all", "second"]
+
+    # only the samples which lose a tag are counted
+    etag = client.head(f"{base}/sample/{samples[2]}", headers=header).headers["ETag"]
+    ret = client.put(
+        f"{base}/sample_tags",
+        json={"remove": [{"sample_uuid": samples[1], "name": "second"}, {"sample_uuid": samples[2], "name": "second"}]},
+        headers=header,
+    )
+    assert ret.status_code == 200
+    assert ret.get_json()["count"] == 1
+    assert tags_of(samples[1]) == ["all"]
+    assert client.head(f"{base}/sample/{samples[2]}", headers=header).headers["ETag"] == etag
+
+    # put the tag back for the checks below
+    ret = client.put(f"{base}/sample_tags", json={"add": [{"sample_uuid": samples[1], "name": "second"}]}, headers=header)
+    assert ret.get_json()["count"] == 1
+
+    # the single sample tagging still works with the existing tags
+    ret = client.put(f"{base}/sample/{samples[2]}/tags", json=[{"name": "second"}, {"name": "all"}], headers=header)
+    assert ret.status_code == 200
+    assert tags_of(samples[2]) == ["all", "second"]
+    assert instance_tags() == ["all", "second"]
+
+    # malformed requests
+    ret = client.put(f"{base}/sample_tags", json=[], headers=header)
+    assert ret.status_code == 400
+    ret = client.put(f"{base}/sample_tags", json={"add": {"name": "x"}}, headers=header)
+    assert ret.status_code == 400
+    ret = client.put(f"{base}/sample_tags", json={"add": [{"name": "x"}]}, headers=header)
+    assert ret.status_code == 400
+    ret = client.put(f"{base}/sample_tags", json={"add": [{"sample_uuid": samples[0], "name": 1}]}, headers=header)
+    assert ret.status_code == 400
+    ret = client.put(
+        f"{base}/sample_tags",
+        json={"add": [{"sample_uuid": "00000000000000000000000000000000", "name": "x"}]},
+        headers=header,
+    )
+    assert ret.status_code == 404
+    ret = client.get(f"{base}/sample_tags", headers=header)
+    assert ret.status_code == 405
+
+
+def test_sample_writes_count_samples_version(app, auth_client: Tuple[FlaskClient, str]):
+    from sqlalchemy import delete, func, select
+    from koi_api.orm.instance import ORMInstance
+    from koi_api.orm.sample import ORMSample, ORMSampleChange
+    client, header = auth_client
+
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        etags = {client.head(f"{base}/sample", headers=header).headers["ETag"]}
+        instance_etags = {client.head(base, headers=header).headers["ETag"]}
+
+        ret = client.post(f"{base}/sample", json={}, headers=header)
+        sample = ret.get_json()["sample_uuid"]
+        etags.add(client.head(f"{base}/sample", headers=header).headers["ETag"])
+        instance_etags.add(client.head(base, headers=header).headers["ETag"])
+
+        ret = client.post(f"{base}/sample/{sample}/data", json={"key": "a"}, headers=header)
+        etags.add(client.head(f"{base}/sample", headers=header).headers["ETag"])
+
+        ret = client.put(f"{base}/sample/{sample}", json={"finalized": True}, headers=header)
+        etags.add(client.head(f"{base}/sample", headers=header).headers["ETag"])
+        instance_etags.add(client.head(base, headers=header).headers["ETag"])
+
+        ret = client.delete(f"{base}/sample/{sample}", headers=header)
+        etags.add(client.head(f"{base}/sample", headers=header).headers["ETag"])
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    # every write produced a new collection etag
+    assert len(etags) == 5
+    assert len(instance_etags) == 3
+
+    # the instance row was only written by counting up the version before each commit
+    updates = [s for s in statements if s.lstrip().upper().startswith("UPDATE INSTANCE")]
+    assert len(updates) == 4
+    assert all("instance_samples_version" in s for s in updates)
+
+    ret = client.get(base, headers=header)
+    assert ret.get_json()["sample_last_modified"] >= inst["sample_last_modified"]
+
+    # a commit whose change does not raise the newest change id, like one holding
+    # an id older than a change committed before, still moves the version
+    ret = client.post(f"{base}/sample", json={}, headers=header)
+    etag = client.head(f"{base}/sample", headers=header).headers["ETag"]
+    with app.app_context():
+        instance = db.session.scalars(
+            select(ORMInstance).where(ORMInstance.instance_uuid == UUID(inst["instance_uuid"]).bytes)
+        ).one()
+        sample = db.session.scalars(select(ORMSample).where(ORMSample.instance_id == instance.instance_id)).first()
+        instance.samples_changed(sample)
+        db.session.flush()
+        newest = db.session.scalar(select(func.max(ORMSampleChange.change_id)))
+        db.session.execute(delete(ORMSampleChange).where(ORMSampleChange.change_id == newest))
+        db.session.commit()
+    assert client.head(f"{base}/sample", headers=header).headers["ETag"] != etag
+
+
+def test_change_feed(app, auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    def feed(**params):
+        ret = client.get(f"{base}/changes", headers=header, query_string=params)
+        assert ret.status_code == 200
+        return ret.get_json()
+
+    samples = [client.post(f"{base}/sample", json={}, headers=header).get_json()["sample_uuid"] for _ in range(3)]
+    client.put(f"{base}/sample/{samples[0]}/tags", headers=header, json=[{"name": "a"}])
+
+    body = feed()
+    assert sorted(body["created"]) == sorted(samples)
+    assert body["modified"] == [] and body["deleted"] == [] and not body["more"]
+    cursor = body["cursor"]
+
+    # an unchanged instance reports nothing and keeps the cursor
+    body = feed(since=cursor)
+    assert body["created"] == [] and body["cursor"] == cursor
+
+    client.put(f"{base}/sample/{samples[1]}", json={"finalized": True}, headers=header)
+    client.delete(f"{base}/sample/{samples[2]}", headers=header)
+    new_sample = client.post(f"{base}/sample", json={}, headers=header).get_json()["sample_uuid"]
+
+    body = feed(since=cursor)
+    assert body["modified"] == [samples[1]]
+    assert body["deleted"] == [samples[2]]
+    assert body["created"] == [new_sample]
+
+    # paging through the log with the cursor
+    body = feed(since=cursor, page_limit=1)
+    assert body["more"] and body["modified"] == [samples[1]]
+    body = feed(since=body["cursor"], page_limit=1)
+    assert body["deleted"] == [samples[2]]
+
+    # by date
+    assert feed(since_time="2000-01-01T00:00:00+00:00")["cursor"] == feed()["cursor"]
+    assert feed(since_time="2999-01-01T00:00:00")["created"] == []
+
+    ret = client.get(f"{base}/changes", headers=header, query_string={"since": "x"})
+    assert ret.status_code == 400
+
+    # changes of concurrent writers are held back for a while
+    app.config["CHANGE_FEED_SETTLE_SECONDS"] = 60
+    try:
+        assert feed(since=cursor)["created"] == []
+    finally:
+        app.config["CHANGE_FEED_SETTLE_SECONDS"] = 0
+
+
+def test_query_budget(app, auth_client: Tuple[FlaskClient, str], query_budget):
+    client, header = auth_client
+
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+    sample = client.post(f"{base}/sample", json={}, headers=header).get_json()["sample_uuid"]
+    url = f"{base}/sample/{sample}"
+
+    for i in range(8):
+        ret = client.post(f"{url}/data", json={"key": str(i)}, headers=header)
+        client.post(f"{url}/data/{ret.get_json()['data_uuid']}/file", data=b"data", headers=header)
+        ret = client.post(f"{url}/label", json={"key": str(i)}, headers=header)
+        client.post(f"{url}/label/{ret.get_json()['label_uuid']}/file", data=b"label", headers=header)
+        client.put(f"{url}/tags", json=[{"name": str(i)}], headers=header)
+        client.post(f"{base}/label_request", json={"sample_uuid": sample}, headers=header)
+
+    # listings do not load the children of their entries one by one
+    for listing in [f"{url}/data", f"{url}/label", f"{url}/tags", f"{base}/label_request"]:
+        with query_budget(12) as statements:
+            ret = client.get(listing, headers=header)
+        assert ret.status_code == 200
+        assert len(ret.get_json()) == 8
+        assert len(set(statements)) == len(statements)
+
+    # the statements are reported and repeated ones flagged while debugging queries
+    app.config["QUERY_DEBUG"] = True
+    app.config["QUERY_REPEAT_THRESHOLD"] = 1
+    try:
+        ret = client.get(f"{url}/data", headers=header)
+        assert int(ret.headers["X-Query-Count"]) > 0
+        assert float(ret.headers["X-Query-Time"]) >= 0
+        assert ret.headers["X-Query-Repeated"] == "1"
+    finally:
+        app.config["QUERY_DEBUG"] = False
+        app.config["QUERY_REPEAT_THRESHOLD"] = 5
+
+    ret = client.get(f"{url}/data", headers=header)
+    assert "X-Query-Count" not in ret.headers
+
+
+def test_conditional_requests(auth_client: Tuple[FlaskClient, str], monkeypatch):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    ret = client.post(f"{base}/sample", headers=header, json={})
+    sample = ret.get_json()["sample_uuid"]
+    ret = client.post(f"{base}/sample/{sample}/data", headers=header, json={"key": "image"})
+    data = ret.get_json()["data_uuid"]
+    client.post(f"{base}/sample/{sample}/data/{data}/file", headers=header, data=b"payload")
+
+    ret = client.get(f"{base}/sample/{sample}/data/{data}/file", headers=header)
+    assert ret.status_code == 200
+    etag = ret.headers["ETag"]
+    last_modified = ret.headers["Last-Modified"]
+
+    # a fresh client cache is answered without reading the blob
+    def fail(*args, **kwargs):
+        raise AssertionError("blob must not be read")
+
+    monkeypatch.setattr(persistence.instance, "get_file", fail)
+    ret = client.get(f"{base}/sample/{sample}/data/{data}/file", headers={**header, "If-None-Match": etag})
+    assert ret.status_code == 304
+    assert ret.data == b""
+    assert ret.headers["ETag"] == etag
+    ret = client.get(
+        f"{base}/sample/{sample}/data/{data}/file", headers={**header, "If-Modified-Since": last_modified}
+    )
+    assert ret.status_code == 304
+    monkeypatch.undo()
+
+    ret = client.get(f"{base}/sample/{sample}/data/{data}/file", headers={**header, "If-None-Match": '"other"'})
+    assert ret.status_code == 200
+    assert ret.data == b"payload"
+
+    # collections are checked against the etag of the instance samples
+    ret = client.get(f"{base}/sample", headers=header)
+    etag = ret.headers["ETag"]
+    ret = client.get(f"{base}/sample", headers={**header, "If-None-Match": etag})
+    assert ret.status_code == 304
+    ret = client.get(f"{base}/sample/{sample}", headers=header)
+    ret = client.get(f"{base}/sample/{sample}", headers={**header, "If-None-Match": ret.headers["ETag"]})
+    assert ret.status_code == 304
+
+    client.post(f"{base}/sample", headers=header, json={})
+    ret = client.get(f"{base}/sample", headers={**header, "If-None-Match": etag})
+    assert ret.status_code == 200
+    assert len(ret.get_json()) == 2
+
+
+def test_response_cache(app, auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    client.post(f"{base}/sample", headers=header, json={})
+
+    queries = []
+
+    def count(*args):
+        queries.append(args)
+
+    # a repeated listing is served from the cache
+    ret = client.get(f"{base}/sample", headers=header)
+    first = ret.get_json()
+    hits = cache.hits
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        ret = client.get(f"{base}/sample", headers=header)
+        cached = len(queries)
+        queries.clear()
+        ret_paged = client.get(f"{base}/sample?page_limit=1", headers=header)
+        uncached = len(queries)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert cache.hits == hits + 1
+    assert ret.get_json() == first
+    assert ret.headers["ETag"] is not None
+    assert ret_paged.get_json() == first
+    assert cached < uncached
+
+    # conditional requests are answered from the cache as well
+    ret = client.get(f"{base}/sample", headers={**header, "If-None-Match": ret.headers["ETag"]})
+    assert ret.status_code == 304
+
+    # changes of the parent create a new entry
+    client.post(f"{base}/sample", headers=header, json={})
+    ret = client.get(f"{base}/sample", headers=header)
+    assert len(ret.get_json()) == 2
+
+
+def test_response_cache_eviction():
+    bounded = ResponseCache()
+    bounded._max_size = 100
+    bounded.put("a", b"x" * 40, [], 10)
+    bounded.put("b", b"x" * 40, [], 10)
+    assert bounded.get("a") is not None
+    bounded.put("c", b"x" * 40, [], 10)
+
+    # the least recently used entry is evicted
+    assert bounded.get("b") is None
+    assert bounded.get("a") is not None
+    assert bounded.get("c") is not None
+
+    # entries larger than the cache are not stored
+    bounded.put("d", b"x" * 101, [], 10)
+    assert bounded.get("d") is None
+
+
+def test_json_compression(app, auth_client: Tuple[FlaskClient, str]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    inst = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{inst['instance_uuid']}"
+
+    for _ in range(20):
+        client.post(f"{base}/sample", headers=header, json={})
+    plain = client.get(f"{base}/sample", headers=header)
+    assert "Content-Encoding" not in plain.headers
+    assert len(plain.data) >= 1024
+
+    min_size = app.config["JSON_COMPRESS_MIN_SIZE"]
+    app.config["JSON_COMPRESS_MIN_SIZE"] = 1024
+    try:
+        for encoding, decompress in [("gzip", gzip.decompress), ("deflate", zlib.decompress)]:
+            ret = client.get(f"{base}/sample", headers={**header, "Accept-Encoding": encoding})
+            assert ret.headers["Content-Encoding"] == encoding
+            assert "Accept-Encoding" in ret.headers["Vary"]
+            assert decompress(ret.data) == plain.data
+
+        # small bodies and clients without support stay uncompressed
+        ret = client.get(f"{base}/sample?page_limit=1", headers={**header, "Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in ret.headers
+        ret = client.get(f"{base}/sample", headers={**header, "Accept-Encoding": "br"})
+        assert "Content-Encoding" not in ret.headers
+        assert ret.data == plain.data
+    finally:
+        app.config["JSON_COMPRESS_MIN_SIZE"] = min_size
+
+
+def test_json_encoders(app):
+    body = [{"sample_uuid": "00" * 16, "finalized": True, "count": 1, "uuid": UUID(int=1), "missing": None}]
+    with app.app_context():
+        encoded = [JSON_ENCODERS[name](body) for name in ["flask", "orjson"]]
+    assert json.loads(encoded[0]) == json.loads(encoded[1])
+
+
+def test_inline_files(app, auth_client: Tuple[FlaskClient, dict]):
+    from koi_api.orm.file import ORMFile
+    from koi_api.orm.sample import ORMSampleData
+
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+    small = b'{"class": 3}'
+    large = b"x" * app.config["FILEPERSISTENCE_INLINE_SIZE"]
+
+    def add_data(value):
+        ret = client.post(f"{base}/sample", headers=header, json={})
+        url = f"{base}/sample/{ret.get_json()['sample_uuid']}"
+        ret = client.post(f"{url}/data", headers=header, json={"key": "image"})
+        data_uuid = ret.get_json()["data_uuid"]
+        ret = client.post(f"{url}/data/{data_uuid}/file", headers=header, data=value)
+        assert ret.status_code == 200
+        return url, data_uuid
+
+    def stored_file(data_uuid):
+        with app.app_context():
+            data = db.session.query(ORMSampleData).filter_by(data_uuid=UUID(data_uuid).bytes).one()
+            file = db.session.get(ORMFile, data.file_id)
+            return file.file_url, file.file_inline
+
+    # small payloads are kept in the row, larger ones in a blob
+    url, data_uuid = add_data(small)
+    assert stored_file(data_uuid) == (None, small)
+    ret = client.get(f"{url}/data/{data_uuid}/file", headers=header)
+    assert ret.get_data() == small
+
+    url, data_uuid = add_data(large)
+    file_url, inline = stored_file(data_uuid)
+    assert inline is None
+    assert os.path.exists(os.path.join("./temp/", file_url))
+    ret = client.get(f"{url}/data/{data_uuid}/file", headers=header)
+    assert ret.get_data() == large
+
+    # uploaded streams are stored inline if they end before the threshold
+    archive = BytesIO()
+    with ZipFile(archive, "w") as zip:
+        zip.writestr(f"{UUID(url.rsplit('/', 1)[1]).hex}/label/class", small)
+    ret = client.post(
+        f"{base}/sample_upload", data=archive.getvalue(), content_type="application/zip", headers=header
+    )
+    assert ret.status_code == 200
+    label_uuid = ret.get_json()[0]["label_uuid"]
+    ret = client.get(f"{url}/label/{label_uuid}/file", headers=header)
+    assert ret.get_data() == small
+
+    # deleting a sample removes the inline file rows with it
+    with app.app_context():
+        files = db.session.query(ORMFile).count()
+    ret = client.put(url, headers=header, json={"finalized": True})
+    ret = client.delete(url, headers=header)
+    assert ret.status_code == 200
+    with app.app_context():
+        assert db.session.query(ORMFile).count() == files - 2
@@ -0,0 +1,130 @@
+# Copyright (c) individual contributors.
+# All rights reserved.
+#
+# This is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of
+# the License, or any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details. A copy of the
+# GNU Lesser General Public License is distributed along with this
+# software and can be found at http://www.gnu.org/licenses/lgpl.html
+
+from . import make_empty_model, make_empty_instance
+from typing import Tuple
+from flask.testing import FlaskClient
+from io import BytesIO
+from uuid import UUID
+import json
+import os
+import tarfile
+from sqlalchemy import select
+from koi_api.orm import db
+from koi_api.orm.snapshot import ORMSnapshot, ORMSnapshotShard
+
+
+def test_snapshot(app, auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+    model = make_empty_model(auth_client)
+    instance = make_empty_instance(auth_client, model["model_uuid"])
+    base = f"/api/model/{model['model_uuid']}/instance/{instance['instance_uuid']}"
+
+    def add_sample(value, finalized=True):
+        ret = client.post(f"{base}/sample", headers=header, json={})
+        sample = ret.get_json()["sample_uuid"]
+        url = f"{base}/sample/{sample}"
+        client.put(f"{url}/tags", headers=header, json=[{"name": "tag"}])
+        ret = client.post(f"{url}/data", headers=header, json={"key": "image"})
+        client.post(f"{url}/data/{ret.get_json()['data_uuid']}/file", headers=header, data=value)
+        ret = client.post(f"{url}/label", headers=header, json={"key": "class"})
+        client.post(f"{url}/label/{ret.get_json()['label_uuid']}/file", headers=header, data=value + b" label")
+        if finalized:
+            ret = client.put(url, headers=header, json={"finalized": True})
+            assert ret.status_code == 200
+        return sample
+
+    samples = [add_sample(b"sample %d" % i) for i in range(3)]
+    add_sample(b"not finalized", finalized=False)
+
+    # reading builds nothing
+    ret = client.get(f"{base}/snapshot", headers=header)
+    assert ret.status_code == 404
+
+    # every sample gets its own shard
+    app.config["SNAPSHOT_SHARD_SIZE"] = 1
+    try:
+        ret = client.post(f"{base}/snapshot", headers=header)
+        assert ret.status_code == 200
+        ret = client.get(f"{base}/snapshot", headers=header)
+        assert ret.status_code == 200
+        body = ret.get_json()
+        snapshot = body["snapshot"]
+        assert snapshot["phase"] == "done"
+        assert snapshot["samples"] == 3
+        assert len(snapshot["shards"]) == 3
+        assert body["ready"]["snapshot_uuid"] == snapshot["snapshot_uuid"]
+
+        # an unchanged instance serves the same snapshot
+        ret = client.post(f"{base}/snapshot", headers=header)
+        assert ret.get_json()["snapshot_uuid"] == snapshot["snapshot_uuid"]
+
+        shard_url = f"{base}/snapshot/{snapshot['snapshot_uuid']}/shard/0"
+        ret = client.get(shard_url, headers=header)
+        assert ret.status_code == 200
+        assert ret.headers["Accept-Ranges"] == "bytes"
+        full = ret.get_data()
+        assert len(full) == snapshot["shards"][0]["size"]
+
+        with tarfile.open(fileobj=BytesIO(full)) as tar:
+            meta = json.load(tar.extractfile(f"{samples[0]}/meta.json"))
+            assert meta["tags"] == ["tag"]
+            data_uuid = meta["data"][0]["uuid"]
+            label_uuid = meta["label"][0]["uuid"]
+            assert tar.extractfile(f"{samples[0]}/data/{data_uuid}").read() == b"sample 0"
+            assert tar.extractfile(f"{samples[0]}/label/{label_uuid}").read() == b"sample 0 label"
+
+        # partial downloads seek into the uncompressed blob
+        with app.app_context():
+            shard = db.session.scalars(
+                select(ORMSnapshotShard)
+                .join(ORMSnapshotShard.snapshot)
+                .where(ORMSnapshot.snapshot_uuid == UUID(snapshot["snapshot_uuid"]).bytes, ORMSnapshotShard.shard_index == 0)
+            ).one()
+            with open(os.path.join(app.config["FILEPERSISTENCE_BASE_URI"], shard.file.file_url), "rb") as f:
+                assert f.read() == full
+
+        ret = client.get(shard_url, headers={**header, "Range": "bytes=100-599"})
+        assert ret.status_code == 206
+        assert ret.get_data() == full[100:600]
+        assert ret.headers["Content-Range"] == f"bytes 100-599/{len(full)}"
+
+        ret = client.get(shard_url, headers={**header, "Range": f"bytes={len(full)}-"})
+        assert ret.status_code == 416
+
+        ret = client.get(shard_url, headers={**header, "If-None-Match": f'"{snapshot["snapshot_uuid"]}-0"'})
+        assert ret.status_code == 304
+
+        ret = client.get(f"{base}/snapshot/{snapshot['snapshot_uuid']}/shard/3", headers=header)
+        assert ret.status_code == 404
+
+        # after a change the finished snapshot is served until a new one is built, only the two newest are kept
+        add_sample(b"sample 3")
+        ret = client.get(f"{base}/snapshot", headers=header)
+        assert ret.get_json()["snapshot"] is None
+        assert ret.get_json()["ready"]["snapshot_uuid"] == snapshot["snapshot_uuid"]
+        ret = client.post(f"{base}/snapshot", headers=header)
+        second = ret.get_json()
+        assert second["snapshot_uuid"] != snapshot["snapshot_uuid"]
+        assert second["samples"] == 4
+
+        add_sample(b"sample 4")
+        ret = client.post(f"{base}/snapshot", headers=header)
+        assert ret.get_json()["samples"] == 5
+
+        ret = client.get(shard_url, headers=header)
+        assert ret.status_code == 404
+    finally:
+        app.config["SNAPSHOT_SHARD_SIZE"] = 1024 * 1024 * 1024
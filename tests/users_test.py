@@ -15,6 +15,12 @@
 
 from flask.testing import FlaskClient
 from typing import Tuple
+import copy
+from sqlalchemy import event, select
+from koi_api.orm import db
+from koi_api.orm.user import ORMUser
+from koi_api.orm.role import ORMUserRoleGeneral
+from koi_api.seed import seed_database
 
 
 def test_forbidden(auth_client: Tuple[FlaskClient, dict]):
@@ -148,3 +154,50 @@ def test_delete_user(auth_client: Tuple[FlaskClient, str]):
         if user["user_name"] == "admin":
             ret = client.delete(f"/api/user/{user['user_uuid']}", headers=header)
             assert ret.status_code == 405
+
+
+def test_seed(app, auth_client: Tuple[FlaskClient, dict]):
+    client, header = auth_client
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            # the database was seeded from this config when the app was created
+            assert not seed_database(app.config)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert len(statements) == 1
+
+        config = copy.deepcopy(dict(app.config))
+        config["ADDITIONAL_USERS"] = [
+            {"name": "seeded", "password": "seeded", "is_essential": False, "general_roles": ["worker", "unknown"]}
+        ]
+        config["INITIAL_GENERAL_ROLES"][2]["description"] = "Seeded worker"
+        # a role named twice is added once, the last entry wins
+        for description in ["First", "Second"]:
+            duplicate = copy.deepcopy(config["INITIAL_GENERAL_ROLES"][2])
+            duplicate.update({"name": "duplicate", "description": description})
+            config["INITIAL_GENERAL_ROLES"].append(duplicate)
+        assert seed_database(config)
+        assert not seed_database(config)
+
+        user = db.session.scalars(select(ORMUser).where(ORMUser.user_name == "seeded")).one()
+        assert [a.role.role_name for a in user.access_rights] == ["worker"]
+        role = db.session.scalars(select(ORMUserRoleGeneral).where(ORMUserRoleGeneral.role_name == "worker")).one()
+        assert role.role_description == "Seeded worker"
+        roles = db.session.scalars(select(ORMUserRoleGeneral).where(ORMUserRoleGeneral.role_name == "duplicate")).all()
+        assert [r.role_description for r in roles] == ["Second"]
+
+        # restore the original roles
+        assert seed_database(app.config)
+        db.session.refresh(role)
+        assert role.role_description == "Worker"
+
+    ret = client.post("/api/login", json={"user_name": "seeded", "password": "seeded"})
+    assert ret.status_code == 200